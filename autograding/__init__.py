@@ -0,0 +1,15 @@
+"""
+Scripts and library API to run unit tests on student Canvas submissions
+"""
+
+__all__ = ["GradingSession"]
+
+
+def __getattr__(name: str):
+    # Only import the grading machinery once it is actually used, so that
+    # importing this package stays cheap for embedding applications
+    if name == "GradingSession":
+        from .grading_session import GradingSession
+        return GradingSession
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
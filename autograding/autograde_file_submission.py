@@ -87,23 +87,29 @@ def refactor_test_input(dest_module: str, file_lines: List[str],
         new_test_file.write("".join(file_lines))
 
 
-if __name__ == "__main__":
-    parser = make_parser()
-    args = parser.parse_args()
+def run_file_submission_tests(submissions_dir: str,
+                               local_hw_folder_path: str,
+                               test_results_dir: str) -> \
+        Dict[str, Dict[str, bool]]:
+    """Runs the student-written and teacher-written tests for every python
+    file submission and saves their output into the test results folder.
+
+    Args:
+        submissions_dir: Path to the folder of (unzipped) Canvas python file
+         submissions
+        local_hw_folder_path: Path to the homework folder in the teaching team
+         repository, which must contain exactly one 'test_hw*.py' file
+        test_results_dir: Folder to (re)create and save the test results into
 
-    if not os.path.isdir(args.submissions_dir):
-        print(
-            "Specified submissions folder {} is not a directory/does not "
-            "exist".format(args.submissions_dir))
-        exit()
+    Returns:
+        Dictionary that maps each student identifier to whether the output of
+         their 'student_tests' and 'teacher_tests' was acquired
 
+    Raises:
+        Exception: If not exactly one teacher test file is found
+    """
     student_python_file_paths: Dict[str, List[str]] = \
-        acquire_and_rename_student_python_submissions(args.submissions_dir)
-
-    autograding_dir: str = os.path.dirname(os.path.realpath(__file__))
-    test_results_dir: str = os.path.join(autograding_dir,
-                                         "{}_test_results".format(
-                                             args.hw_dir_name))
+        acquire_and_rename_student_python_submissions(submissions_dir)
 
     if os.path.isdir(test_results_dir):
         print("There already exists a folder at {} that presumably "
@@ -118,17 +124,14 @@ if __name__ == "__main__":
     # into the students' directories. Get the contents of the file from the
     # teaching team repository for writing into a new file in the students'
     # repositories.
-    local_hw_folder_path: str = os.path.join(Path(os.getcwd()).parent, "hw",
-                                             args.hw_dir_name)
     matching_test_file_list = glob.glob(
         os.path.join(local_hw_folder_path, "test_hw*.py"))
 
     if len(matching_test_file_list) != 1:
-        print("It appears that more than one or no file matches 'test_*.py' "
-              "in {}. Make sure that there is only one file that matches to "
-              "proceed."
-              .format(local_hw_folder_path))
-        exit()
+        raise Exception("It appears that more than one or no file matches "
+                        "'test_*.py' in {}. Make sure that there is only one "
+                        "file that matches to proceed."
+                        .format(local_hw_folder_path))
 
     # Copy over the official tests to the submission folder and set up for
     # the test running
@@ -137,15 +140,16 @@ if __name__ == "__main__":
     with open(matching_test_file_list[0], 'r') as official_test_file:
         teacher_test_lines = official_test_file.readlines()
         official_test_text = "".join(teacher_test_lines)
-    teacher_test_filepath = os.path.join(args.submissions_dir,
+    teacher_test_filepath = os.path.join(submissions_dir,
                                          "teacher_tests.py")
-    teacher_test_lines: List[str]
     with open(teacher_test_filepath, 'w') as teacher_test_file:
         teacher_test_file.write(official_test_text)
 
     # Run tests
+    results: Dict[str, Dict[str, bool]] = {}
     for student in student_python_file_paths:
-        full_student_test_path = os.path.join(args.submissions_dir, student_python_file_paths[
+        results[student] = {"student_tests": False, "teacher_tests": False}
+        full_student_test_path = os.path.join(submissions_dir, student_python_file_paths[
                                    student][1])
         student_test_lines: List[str]
         with open(full_student_test_path, 'r') as student_tests_file:
@@ -159,7 +163,7 @@ if __name__ == "__main__":
                                                         "-v",
                                                         "{}".format(
                 student_python_file_paths[student][1])],
-                cwd=args.submissions_dir,
+                cwd=submissions_dir,
                 stdout=subprocess.PIPE,
                 text=True,
                 timeout=2
@@ -170,6 +174,7 @@ if __name__ == "__main__":
                 student_tests_file.write(student_test_results_text.stdout)
             print("Student test output acquisition succeeded for {}".format(
                 student))
+            results[student]["student_tests"] = True
         except:
             print("Student test output acquisition failed for {}".format(
                 student))
@@ -182,7 +187,7 @@ if __name__ == "__main__":
         try:
             teacher_test_results_text = subprocess.run(["python3", "-m",
                 "pytest", "-v", "{}".format(teacher_test_filepath)],
-                cwd=args.submissions_dir,
+                cwd=submissions_dir,
                 stdout=subprocess.PIPE,
                 text=True,
                 timeout=2
@@ -193,9 +198,32 @@ if __name__ == "__main__":
                 student_tests_file.write(teacher_test_results_text.stdout)
             print("Teacher test output acquisition succeeded for {}".format(
                 student))
+            results[student]["teacher_tests"] = True
         except:
             print("Teacher test output acquisition failed for {}".format(
                 student))
 
+    return results
 
 
+if __name__ == "__main__":
+    try:
+        from .grading_session import GradingSession
+    except ImportError:
+        from grading_session import GradingSession
+
+    parser = make_parser()
+    args = parser.parse_args()
+
+    session = GradingSession(
+        args.submissions_dir,
+        args.hw_dir_name,
+        submission_type="file",
+        hw_root_dir=os.path.join(Path(os.getcwd()).parent, "hw"),
+    )
+    try:
+        session.run()
+    except Exception as ex:
+        print(ex)
+        exit(1)
+    print(session.summary())
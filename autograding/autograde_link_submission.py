@@ -4,17 +4,46 @@ Run tests on submissions by github links for an assignment
 
 import argparse
 import glob
+import hashlib
+import json
 import os
 import re
 import shutil
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple, Union
-
-from bs4 import BeautifulSoup
+from typing import Dict, List, Tuple, Union
+
+try:
+    from .golden_outputs import GOLDEN_FIXTURE_NAME
+    from .regrade import RegradePlan, load_regrade_history, \
+        save_regrade_history
+    from .sharding import DURATIONS_ARGS, PerTestDurations, \
+        merge_shard_outputs, parse_collected_test_ids, parse_test_durations, \
+        partition_test_ids
+except ImportError:
+    # Run as a script from the autograding directory
+    from golden_outputs import GOLDEN_FIXTURE_NAME
+    from regrade import RegradePlan, load_regrade_history, \
+        save_regrade_history
+    from sharding import DURATIONS_ARGS, PerTestDurations, \
+        merge_shard_outputs, parse_collected_test_ids, parse_test_durations, \
+        partition_test_ids
 
 __author__ = "Duncan Mazza"
 
+COVERAGE_REPORT_FILE_NAME: str = "student_test_coverage.json"
+# Files that grading writes into (and may commit to) a homework folder, which
+# are not part of the student's code
+GRADING_FILE_NAMES: Tuple[str, ...] = (
+    "teacher_tests.py", "teacher_test_results.txt", "student_test_results.txt",
+    COVERAGE_REPORT_FILE_NAME, GOLDEN_FIXTURE_NAME)
+# Files of a homework folder that hold the results of grading it
+RESULT_FILE_NAMES: Tuple[str, ...] = (
+    "teacher_test_results.txt", "student_test_results.txt",
+    COVERAGE_REPORT_FILE_NAME)
+
 
 class GHLink:
     rx: str = r"(?<=^https:\/\/github.com\/)[\w\d./-]+$|(?<=^https:\/\/github" \
@@ -118,6 +147,42 @@ class GHLink:
         return self._orig_link
 
 
+class Assignment:
+    """A homework folder to grade in each student's repository, along with
+    the tests to grade it with
+    """
+
+    def __init__(self, hw_folder: str, teacher_tests_text: str,
+                 student_test_file_name: Union[str, None] = None,
+                 history_dir: Union[str, None] = None,
+                 coverage_module: Union[str, None] = None,
+                 test_shards: int = 1,
+                 test_durations: Union[PerTestDurations, None] = None,
+                 golden_fixture_path: Union[str, None] = None):
+        self.hw_folder: str = hw_folder
+        self.teacher_tests_text: str = teacher_tests_text
+        self.student_test_file_name: Union[str, None] = \
+            student_test_file_name
+        # Grading history of the homework folder (e.g.,
+        # 'grading_history/hw_2'), where each student's teacher test results
+        # are kept along with the teacher tests that produced them so that
+        # they can be regraded
+        self.history_dir: Union[str, None] = history_dir
+        # Student module (e.g., 'hw2.py') whose coverage by the student's
+        # own tests should be measured, if any
+        self.coverage_module: Union[str, None] = coverage_module
+        # Number of pytest processes to split the teacher tests across, and
+        # the per-test durations of earlier runs to balance them with
+        self.test_shards: int = test_shards
+        self.test_durations: Union[PerTestDurations, None] = test_durations
+        # Precomputed outputs of the teacher tests' GOLDEN_CASES, copied next
+        # to the teacher tests (see golden_outputs.py)
+        self.golden_fixture_path: Union[str, None] = golden_fixture_path
+
+    def __repr__(self):
+        return self.hw_folder
+
+
 class Student:
     def __init__(self, gh_link: GHLink, student_repos_dir: str):
         self.gh_link = gh_link
@@ -133,6 +198,25 @@ class Student:
         self._tested_without_failure: bool = False
         self._pushed_successfully: bool = True
         self._detached_head: bool = False
+        # Branch and commit of the latest committed results; pushes may run
+        # after another link sharing this clone has checked out a different
+        # branch, so they push exactly these rather than HEAD
+        self._results_branch: Union[str, None] = None
+        self._results_commit: Union[str, None] = None
+        self._results_paths: List[str] = []
+        # Tips of the remote's branches when the repository was synced. The
+        # results are pushed only if their branch is still there (or absent)
+        # on the remote, so that pushes (which can run minutes later) never
+        # overwrite commits the student pushed since
+        self._synced_remote_tips: Dict[str, str] = {}
+        self._results_lease: Union[str, None] = None
+        self._push_rejected: bool = False
+        self._coverage: Dict[str, Dict[str, Union[str, int, float,
+                                                  List[int]]]] = {}
+        # Teacher test results of each homework folder as of when this link
+        # was tested; the files in the clone are overwritten by the next
+        # link that shares it
+        self._teacher_test_results: Dict[str, str] = {}
 
     def __repr__(self):
         return self.gh_link.username()
@@ -164,7 +248,8 @@ class Student:
             self,
             command: List[str],
             cwd: Union[str, None] = None,
-            check: bool = True
+            check: bool = True,
+            env: Union[Dict[str, str], None] = None
     ) -> str:
         subprocess_cwd_arg: str
         if cwd is None:
@@ -178,6 +263,7 @@ class Student:
             stdout=subprocess.PIPE,
             text=True,
             timeout=20,
+            env=env,
         )
         return output.stdout
 
@@ -192,6 +278,7 @@ class Student:
             self._resolve_local_repo_existence(True)
         finally:
             self._run_cmd_for_student(["git", "fetch", "--all"])
+        self._synced_remote_tips = self._remote_tips()
 
         if len(self.gh_link.commit()) == 0 and len(self.gh_link.branch()) == 0:
             self._run_cmd_for_student(["git", "checkout", "main"])
@@ -204,24 +291,116 @@ class Student:
                 ["git", "checkout", self.gh_link.commit()])
             self._detached_head = True
 
+    def _remote_tips(self) -> Dict[str, str]:
+        remote_refs = self._run_cmd_for_student(
+            ["git", "for-each-ref", "--format=%(refname:lstrip=3) "
+             "%(objectname)", "refs/remotes/origin"])
+        return {branch: commit for branch, commit in [
+            line.split(" ") for line in remote_refs.splitlines() if
+            len(line.split(" ")) == 2]}
+
+    def _run_pytest(self, test_args: List[str],
+                    hw_folder_abs_path: str,
+                    env: Union[Dict[str, str], None] = None) -> str:
+        return self._run_cmd_for_student(
+            ["python3", "-m", "pytest", "-v", "--timeout=5"] + test_args,
+            hw_folder_abs_path, False, env
+        )
+
     def _run_tests_for_file(self, test_file_name: str,
                             hw_folder_abs_path: str,
-                            output_file_name: str) -> None:
-        test_results = self._run_cmd_for_student(
-            ["python3", "-m", "pytest", "-v", "--timeout=5",
-             test_file_name], hw_folder_abs_path, False
-        )
+                            output_file_name: str,
+                            extra_args: Union[List[str], None] = None,
+                            env: Union[Dict[str, str], None] = None) -> None:
+        test_results = self._run_pytest([test_file_name] + (extra_args or []),
+                                        hw_folder_abs_path, env)
         with open(os.path.join(hw_folder_abs_path, output_file_name),
                   'w') as test_results_file:
             test_results_file.write(test_results)
 
-    def _push_results(self, hw_folder_abs_path: str):
-        self._run_cmd_for_student(["git", "add", os.path.join(
-            hw_folder_abs_path, ".")])
-        self._run_cmd_for_student(
-            ["git", "commit", "-m", "Add testing results for {}".format(
-                hw_folder_abs_path.split(os.path.sep)[-1])]
-        )
+    def _run_sharded_tests_for_file(
+            self,
+            test_file_name: str,
+            hw_folder_abs_path: str,
+            output_file_name: str,
+            shards: int,
+            test_durations: Union[PerTestDurations, None] = None
+    ) -> None:
+        """Runs the tests of a file split across several pytest processes,
+        balanced by the tests' durations in earlier runs, and writes the
+        merged output (which reads as if the file was run at once).
+        """
+        collected = self._run_cmd_for_student(
+            ["python3", "-m", "pytest", "--collect-only", "-q",
+             test_file_name], hw_folder_abs_path, False)
+        test_ids = parse_collected_test_ids(collected)
+        if len(test_ids) < 2:
+            # Nothing to split (or collection failed, which a normal run
+            # reports best)
+            self._run_tests_for_file(test_file_name, hw_folder_abs_path,
+                                     output_file_name)
+            return
+
+        shard_test_ids = partition_test_ids(
+            test_ids, test_durations.durations_s() if test_durations is not
+            None else {}, shards)
+        with ThreadPoolExecutor(max_workers=len(shard_test_ids)) as executor:
+            shard_results = list(executor.map(
+                lambda test_ids_of_shard: self._run_pytest(
+                    ["{}::{}".format(test_file_name, test_id) for test_id in
+                     test_ids_of_shard] + DURATIONS_ARGS,
+                    hw_folder_abs_path),
+                shard_test_ids))
+        if test_durations is not None:
+            for shard_result in shard_results:
+                test_durations.record(parse_test_durations(shard_result))
+        with open(os.path.join(hw_folder_abs_path, output_file_name),
+                  'w') as test_results_file:
+            test_results_file.write(merge_shard_outputs(shard_results,
+                                                        test_ids))
+
+    def _regrade_teacher_tests(self, regrade_plan: RegradePlan,
+                               hw_folder_abs_path: str,
+                               output_file_name: str) -> None:
+        rerun_results: Union[str, None] = None
+        if len(regrade_plan.node_ids()) > 0:
+            rerun_results = self._run_pytest(regrade_plan.node_ids(),
+                                             hw_folder_abs_path)
+        with open(os.path.join(hw_folder_abs_path, output_file_name),
+                  'w') as test_results_file:
+            test_results_file.write(regrade_plan.merge(rerun_results))
+
+    def _commit_results(self, hw_folder_abs_paths: List[str]):
+        # Homework folders missing from the repository were not tested and
+        # have no results to commit
+        hw_folder_abs_paths = [hw_folder_abs_path for hw_folder_abs_path in
+                               hw_folder_abs_paths if
+                               os.path.isdir(hw_folder_abs_path)]
+        if len(hw_folder_abs_paths) == 0:
+            raise Exception("the repository has none of the homework folders")
+        for hw_folder_abs_path in hw_folder_abs_paths:
+            self._run_cmd_for_student(["git", "add", os.path.join(
+                hw_folder_abs_path, ".")])
+        # Results that were already committed (e.g., by a run whose push
+        # failed) leave nothing staged, in which case there is nothing to
+        # commit; if no results were ever committed, there is nothing to push
+        # either
+        staged = self._run_cmd_for_student(
+            ["git", "diff", "--cached", "--name-only"])
+        if len(staged.strip()) == 0:
+            committed_results = self._run_cmd_for_student(
+                ["git", "ls-files", "--"] + [
+                    os.path.join(hw_folder_abs_path, results_file_name) for
+                    hw_folder_abs_path in hw_folder_abs_paths for
+                    results_file_name in RESULT_FILE_NAMES])
+            if len(committed_results.strip()) == 0:
+                raise Exception("there are no test results to commit")
+        else:
+            self._run_cmd_for_student(
+                ["git", "commit", "-m", "Add testing results for {}".format(
+                    ", ".join([hw_folder_abs_path.split(os.path.sep)[-1] for
+                               hw_folder_abs_path in hw_folder_abs_paths]))]
+            )
 
         if self._detached_head:
             # Create temporary branch with the commits, switch out of
@@ -251,24 +430,237 @@ class Student:
             )
             self._run_cmd_for_student(["git", "branch", "-D", tmp_branch])
 
-        self._run_cmd_for_student(["git", "push", "--force"])
-
-    def test(self, hw_folder: str, teacher_tests_text: str,
-             student_test_file_name: Union[str, None], push_results: bool =
-             False) -> str:
-        self._tested_without_failure = False
-        self._pushed_successfully = False
-
+        self._results_branch = self._run_cmd_for_student(
+            ["git", "symbolic-ref", "-q", "--short", "HEAD"],
+            check=False).strip() or None
+        self._results_commit = self._run_cmd_for_student(
+            ["git", "rev-parse", "HEAD"]).strip() or None
+        self._results_paths = [
+            "hw/{}/{}".format(os.path.basename(hw_folder_abs_path),
+                              results_file_name) for hw_folder_abs_path in
+            hw_folder_abs_paths for results_file_name in RESULT_FILE_NAMES]
+        self._results_lease = None if self._results_branch is None else \
+            self._synced_remote_tips.get(self._results_branch)
+        self._push_rejected = False
+
+    def _contains(self, commit: str, ancestor: str) -> bool:
+        return self._run_cmd_for_student(
+            ["git", "rev-list", "--count", commit + ".." + ancestor]
+        ).strip() == "0"
+
+    def _recommit_results_onto(self, base: str):
+        """Recreates the results commit on top of another commit (e.g., one
+        the student pushed after the repository was synced), taking only the
+        results files from the original results commit. A separate index is
+        used so that the clone's working tree, which another link may be
+        testing in, is left alone.
+        """
+        index_dir = tempfile.mkdtemp(prefix="results_index_")
+        try:
+            env = dict(os.environ)
+            env["GIT_INDEX_FILE"] = os.path.join(index_dir, "index")
+            self._run_cmd_for_student(["git", "read-tree", base], env=env)
+            results_entries = self._run_cmd_for_student(
+                ["git", "ls-tree", self._results_commit, "--"] +
+                self._results_paths)
+            for results_entry in results_entries.splitlines():
+                mode_type_hash, path = results_entry.split("\t", 1)
+                mode, _, object_hash = mode_type_hash.split(" ")
+                self._run_cmd_for_student(
+                    ["git", "update-index", "--add", "--cacheinfo",
+                     "{},{},{}".format(mode, object_hash, path)], env=env)
+            tree = self._run_cmd_for_student(["git", "write-tree"],
+                                             env=env).strip()
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
+        message = self._run_cmd_for_student(
+            ["git", "log", "-1", "--format=%B", self._results_commit]).strip()
+        self._results_commit = self._run_cmd_for_student(
+            ["git", "commit-tree", tree, "-p", base, "-m", message]).strip()
+
+    def _has_unpushed_commits(self) -> bool:
+        remote_ref = "refs/remotes/origin/" + self._results_branch
+        if len(self._run_cmd_for_student(
+                ["git", "rev-parse", "-q", "--verify", remote_ref],
+                check=False).strip()) == 0:
+            return True
+        num_unpushed = self._run_cmd_for_student(
+            ["git", "rev-list", "--count",
+             remote_ref + ".." + self._results_commit]).strip()
+        return num_unpushed != "0"
+
+    def _push_results(self, hw_folder_abs_paths: List[str]):
+        self._commit_results(hw_folder_abs_paths)
+        self.push_committed_results()
+
+    def sync_repo(self):
+        """Clones the student's repository if needed and checks out what
+        their link specifies
+        """
         if not self._local_repo_existence_resolved:
             self._resolve_local_repo_existence()
         self._update_to_gh_link_specified()
 
+    def commit_results(self, hw_folders: List[str]):
+        """Commits the test results in the given homework folders without
+        pushing them (see `push_committed_results`), remembering the branch
+        and commit to push
+        """
+        self._commit_results([self._hw_folder_abs_path(hw_folder) for
+                              hw_folder in hw_folders])
+
+    def push_committed_results(self) -> bool:
+        """Pushes the committed test results if they have not been pushed
+        already, so that it is safe to call again after a failure.
+
+        Returns:
+            Whether anything had to be pushed
+        """
+        self._pushed_successfully = False
+        if self._results_branch is None or self._results_commit is None:
+            raise Exception("No results were committed to a branch")
+        if self._push_rejected:
+            # The student may have pushed since the repository was synced
+            self._run_cmd_for_student(["git", "fetch", "origin"])
+            self._results_lease = self._remote_tips().get(
+                self._results_branch)
+            self._push_rejected = False
+        if self._results_lease is not None and not self._contains(
+                self._results_commit, self._results_lease):
+            self._recommit_results_onto(self._results_lease)
+        pushed = False
+        if self._has_unpushed_commits():
+            try:
+                self._run_cmd_for_student(
+                    ["git", "push", "--force-with-lease=refs/heads/{}:{}"
+                     .format(self._results_branch, self._results_lease or ""),
+                     "origin", "{}:refs/heads/{}".format(
+                         self._results_commit, self._results_branch)])
+            except subprocess.CalledProcessError:
+                self._push_rejected = True
+                raise Exception("the push was rejected (e.g., the student "
+                                "pushed since their repository was synced); "
+                                "the results will be committed again on top "
+                                "of the remote before the next attempt")
+            pushed = True
+        self._pushed_successfully = True
+        return pushed
+
+    def checkout_folder_name(self) -> str:
+        """Name of a folder for what the student's link checks out, so that
+        links to different branches or commits of one repository are kept
+        apart
+        """
+        checkout = self.gh_link.commit() or self.gh_link.branch() or "main"
+        return checkout.replace("/", "_")
+
+    def regrade_history_dir(self, hw_history_dir: str) -> str:
+        """Folder of a homework's grading history in which the results of
+        what the student's link checks out are kept
+        """
+        return os.path.join(hw_history_dir, self._repo_folder_name,
+                            self.checkout_folder_name())
+
+    def hw_folder_fingerprint(self, hw_folder: str) -> str:
+        """Hash of the student's files in a homework folder as checked out,
+        leaving out the files that grading writes into it (including empty
+        __init__.py files and bytecode caches)
+        """
+        staged = self._run_cmd_for_student(
+            ["git", "ls-files", "-s", "--", "hw/" + hw_folder])
+        student_entries: List[str] = []
+        for entry in staged.splitlines():
+            path = entry.partition("\t")[2]
+            parts = path.split("/")
+            if parts[-1] in GRADING_FILE_NAMES or "__pycache__" in parts or \
+                    ".pytest_cache" in parts:
+                continue
+            abs_path = os.path.join(self._repo_folder_path, path)
+            if parts[-1] == "__init__.py" and os.path.isfile(abs_path) and \
+                    os.path.getsize(abs_path) == 0:
+                continue
+            student_entries.append(entry)
+        return hashlib.sha256("\n".join(student_entries).encode()).hexdigest()
+
+    def _make_regrade_plan(self, assignment: "Assignment",
+                           code_fingerprint: str) -> Union[RegradePlan, None]:
+        if assignment.history_dir is None:
+            return None
+        regrade_history = load_regrade_history(
+            self.regrade_history_dir(assignment.history_dir))
+        if regrade_history is None:
+            return None
+        prev_results_text, prev_teacher_tests_text, prev_code_fingerprint = \
+            regrade_history
+        code_changed = prev_code_fingerprint != code_fingerprint
+        if code_changed:
+            print("Rerunning every teacher test for {}: hw/{} changed since "
+                  "the recorded results".format(self.__repr__(),
+                                                assignment.hw_folder))
+        regrade_plan = RegradePlan(prev_results_text, prev_teacher_tests_text,
+                                   assignment.teacher_tests_text,
+                                   code_changed=code_changed)
+        if regrade_plan.rerun_all():
+            return None
+        return regrade_plan
+
+    def _coverage_args(
+            self,
+            assignment: "Assignment",
+            hw_folder_abs_path: str
+    ) -> Tuple[List[str], Union[Dict[str, str], None]]:
+        """Pytest arguments and environment that load the student_coverage
+        plugin from this folder into the run of the student's tests
+        """
+        if assignment.coverage_module is None:
+            return [], None
+        coverage_report_path = os.path.join(hw_folder_abs_path,
+                                            COVERAGE_REPORT_FILE_NAME)
+        if os.path.isfile(coverage_report_path):
+            os.remove(coverage_report_path)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [os.path.dirname(os.path.realpath(__file__))] +
+            ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+        return ["-p", "student_coverage",
+                "--student-cov=" + assignment.coverage_module,
+                "--student-cov-report=" + COVERAGE_REPORT_FILE_NAME], env
+
+    def _read_coverage(self, assignment: "Assignment",
+                       hw_folder_abs_path: str) -> str:
+        coverage_report_path = os.path.join(hw_folder_abs_path,
+                                            COVERAGE_REPORT_FILE_NAME)
+        if not os.path.isfile(coverage_report_path):
+            return "Coverage of {} was not measured | ".format(
+                assignment.coverage_module)
+        with open(coverage_report_path, 'r') as coverage_report_file:
+            coverage = json.load(coverage_report_file)
+        self._coverage[assignment.hw_folder] = coverage
+        if "error" in coverage:
+            return "Coverage of {} was not measured due to error: {} | " \
+                .format(assignment.coverage_module, coverage["error"])
+        return "Student tests cover {:.0%} of lines and {:.0%} of branches " \
+               "of {} | ".format(coverage["line_rate"],
+                                 coverage["branch_rate"],
+                                 assignment.coverage_module)
+
+    def _hw_folder_abs_path(self, hw_folder: str) -> str:
         hw_folder_subdir = os.path.join("hw", hw_folder)
-        hw_folder_abs_path = os.path.join(
+        return os.path.join(
             self._repo_folder_path,
             hw_folder_subdir
         )
 
+    def _test_assignment(self, assignment: "Assignment",
+                         regrade: bool) -> str:
+        """Runs the tests of one assignment on the already checked-out
+        repository, returning the report for it.
+        """
+        hw_folder_abs_path = self._hw_folder_abs_path(assignment.hw_folder)
+        if not os.path.isdir(hw_folder_abs_path):
+            raise Exception("the repository has no hw/{} folder".format(
+                assignment.hw_folder))
+
         # Import errors may occur if there is no __init__.py in the homework
         # directory, so add one just to be safe
         hw_init_py_path = os.path.join(hw_folder_abs_path, "__init__.py")
@@ -279,54 +671,154 @@ class Student:
         teacher_tests_path: str = os.path.join(hw_folder_abs_path,
                                                "teacher_tests.py")
 
-        with open(teacher_tests_path, 'w') as teacher_tests_file:
-            teacher_tests_file.write(teacher_tests_text)
+        # Fingerprint the student's code before grading writes anything
+        # into the homework folder, and decide what to rerun before anything
+        # overwrites the previous results
+        code_fingerprint: Union[str, None] = None
+        if assignment.history_dir is not None:
+            code_fingerprint = self.hw_folder_fingerprint(
+                assignment.hw_folder)
+        regrade_plan: Union[RegradePlan, None] = None
+        if regrade and code_fingerprint is not None:
+            regrade_plan = self._make_regrade_plan(assignment,
+                                                   code_fingerprint)
 
-        full_report: str = "Testing for " + self.__repr__() + ": "
-        self._tested_without_failure = True
-        if student_test_file_name is not None:
+        with open(teacher_tests_path, 'w') as teacher_tests_file:
+            teacher_tests_file.write(assignment.teacher_tests_text)
+        golden_fixture_path: str = os.path.join(hw_folder_abs_path,
+                                                GOLDEN_FIXTURE_NAME)
+        if assignment.golden_fixture_path is not None:
+            shutil.copyfile(assignment.golden_fixture_path,
+                            golden_fixture_path)
+
+        report: str = ""
+        tested_without_failure = True
+        if assignment.student_test_file_name is not None:
             try:
+                coverage_args, coverage_env = self._coverage_args(
+                    assignment, hw_folder_abs_path)
                 self._run_tests_for_file(
-                    student_test_file_name,
+                    assignment.student_test_file_name,
                     hw_folder_abs_path,
-                    "student_test_results.txt"
+                    "student_test_results.txt",
+                    coverage_args,
+                    coverage_env
                 )
                 print("Completed student tests successfully for {}".format(
                     self.__repr__())
                 )
+                if assignment.coverage_module is not None:
+                    report += self._read_coverage(assignment,
+                                                  hw_folder_abs_path)
             except Exception as ex:
                 failed_diagnosis1: str = "Could not complete student tests " \
                                          "for {} due to error: {}".format(
                     self.gh_link.username(),
                     ex)
                 print(failed_diagnosis1)
-                full_report += failed_diagnosis1 + " | "
-                self._tested_without_failure = False
+                report += failed_diagnosis1 + " | "
+                tested_without_failure = False
 
         try:
-            self._run_tests_for_file(
-                "teacher_tests.py",
-                hw_folder_abs_path,
-                "teacher_test_results.txt"
-            )
+            if regrade_plan is None and assignment.test_shards > 1:
+                self._run_sharded_tests_for_file(
+                    "teacher_tests.py",
+                    hw_folder_abs_path,
+                    "teacher_test_results.txt",
+                    assignment.test_shards,
+                    assignment.test_durations
+                )
+            elif regrade_plan is None:
+                self._run_tests_for_file(
+                    "teacher_tests.py",
+                    hw_folder_abs_path,
+                    "teacher_test_results.txt"
+                )
+            else:
+                self._regrade_teacher_tests(
+                    regrade_plan,
+                    hw_folder_abs_path,
+                    "teacher_test_results.txt"
+                )
             print("Completed teacher tests successfully for {}".format(
                 self.__repr__())
             )
+            with open(os.path.join(hw_folder_abs_path,
+                                   "teacher_test_results.txt"),
+                      'r') as test_results_file:
+                teacher_test_results = test_results_file.read()
+            self._teacher_test_results[assignment.hw_folder] = \
+                teacher_test_results
+            if assignment.history_dir is not None:
+                save_regrade_history(
+                    self.regrade_history_dir(assignment.history_dir),
+                    teacher_test_results, assignment.teacher_tests_text,
+                    code_fingerprint)
         except Exception as ex:
             failed_diagnosis2: str = "Could not complete teacher tests for {}" \
                 " due to error: {}".format(self.gh_link.username(), ex)
             print(failed_diagnosis2)
-            full_report += failed_diagnosis2 + (" | " if push_results else "")
-            self._tested_without_failure = False
+            report += failed_diagnosis2
+            tested_without_failure = False
 
         os.remove(teacher_tests_path)
+        if os.path.isfile(golden_fixture_path):
+            os.remove(golden_fixture_path)
+
+        if tested_without_failure:
+            report += "SUCCESS (tests gave exit code 0)"
+        else:
+            self._tested_without_failure = False
+        return report
+
+    def test(self, hw_folder: str, teacher_tests_text: str,
+             student_test_file_name: Union[str, None], push_results: bool =
+             False, regrade: bool = False,
+             history_dir: Union[str, None] = None) -> str:
+        return self.test_assignments(
+            [Assignment(hw_folder, teacher_tests_text, student_test_file_name,
+                        history_dir)],
+            push_results, regrade)
+
+    def test_assignments(self, assignments: List["Assignment"],
+                         push_results: bool = False,
+                         regrade: bool = False) -> str:
+        """Tests several assignments against a single checkout of the
+        student's repository and, if requested, pushes all of their results
+        in a single commit.
+        """
+        self._tested_without_failure = False
+        self._pushed_successfully = False
+        self._coverage = {}
+        self._teacher_test_results = {}
+
+        self.sync_repo()
 
-        if self._tested_without_failure:
-            full_report += "SUCCESS (tests gave exit code 0)"
+        full_report: str = "Testing for " + self.__repr__() + ": "
+        self._tested_without_failure = True
+        assignment_reports: List[str] = []
+        for assignment in assignments:
+            # An assignment that cannot be tested (e.g., its folder is
+            # missing) fails on its own; the others are still tested
+            try:
+                assignment_report = self._test_assignment(assignment, regrade)
+            except Exception as ex:
+                assignment_report = "Could not complete testing due to " \
+                                    "error: {}".format(ex)
+                print("Could not complete testing of {} for {} due to error: "
+                      "{}".format(assignment.hw_folder, self.__repr__(), ex))
+                self._tested_without_failure = False
+            if len(assignments) > 1:
+                assignment_report = assignment.hw_folder + ": " + \
+                                    assignment_report
+            assignment_reports.append(assignment_report)
+        full_report += " | ".join(assignment_reports)
 
         if push_results:
             try:
-                self._push_results(hw_folder_abs_path)
+                self._push_results([
+                    self._hw_folder_abs_path(assignment.hw_folder)
+                    for assignment in assignments])
                 self._pushed_successfully = True
                 full_report += " | Pushed successfully"
             except Exception as ex:
@@ -335,22 +827,18 @@ class Student:
 
         return full_report
 
-    def do_push_only(self, hw_folder: str) -> str:
+    def do_push_only(self, hw_folder: Union[str, List[str]]) -> str:
         self._pushed_successfully = False
 
-        if not self._local_repo_existence_resolved:
-            self._resolve_local_repo_existence()
-        self._update_to_gh_link_specified()
+        self.sync_repo()
 
-        hw_folder_subdir = os.path.join("hw", hw_folder)
-        hw_folder_abs_path = os.path.join(
-            self._repo_folder_path,
-            hw_folder_subdir
-        )
+        hw_folders: List[str] = [hw_folder] if isinstance(hw_folder, str) \
+            else hw_folder
 
         full_report: str = "For " + self.__repr__() + ": "
         try:
-            self._push_results(hw_folder_abs_path)
+            self._push_results([self._hw_folder_abs_path(folder) for folder
+                                in hw_folders])
             self._pushed_successfully = True
             full_report += "Pushed successfully"
         except Exception as ex:
@@ -361,6 +849,25 @@ class Student:
     def tested_without_failure(self) -> bool:
         return self._tested_without_failure
 
+    def repo_folder_path(self) -> str:
+        return str(self._repo_folder_path)
+
+    def repo_folder_name(self) -> str:
+        return str(self._repo_folder_name)
+
+    def coverage(self) -> Dict[str, Dict[str, Union[str, int, float,
+                                                    List[int]]]]:
+        """Coverage of the student's module by their own tests (see
+        student_coverage.py) for each homework folder it was measured for
+        """
+        return dict(self._coverage)
+
+    def teacher_test_results(self) -> Dict[str, str]:
+        """Teacher test results of each homework folder that was tested, as
+        they were when this link was tested
+        """
+        return dict(self._teacher_test_results)
+
     def pushed_successfully(self) -> bool:
         return self._pushed_successfully
 
@@ -405,6 +912,110 @@ def make_parser() -> argparse.ArgumentParser:
         help="push results to student repos (without this flag, "
              "no results are committed or pushed)"
     )
+    parser.add_argument(
+        "-R",
+        action="store_true",
+        help="regrade: only rerun the teacher tests that failed in the "
+             "previous run or whose source changed since the previous run, "
+             "and merge their results into the previous results"
+    )
+    parser.add_argument(
+        "-a",
+        nargs="+",
+        action="append",
+        default=[],
+        metavar="ARG",
+        help="also grade another homework folder in the same pass over each "
+             "student's repository, given as 'HW_DIR_NAME TEACHER_TEST_FILE "
+             "[STUDENT_TEST_FILE]' (e.g., '-a hw_3 test_hw3.py test_hw3.py'); "
+             "may be given several times. Results of every graded homework "
+             "folder are pushed in a single commit"
+    )
+    parser.add_argument(
+        "-C",
+        action="store_true",
+        help="measure the line and branch coverage of the student's code by "
+             "their own tests (requires -s). The student's code is assumed "
+             "to be the teacher test file without its 'test_' prefix (e.g., "
+             "'hw2.py' for 'test_hw2.py')"
+    )
+    parser.add_argument(
+        "-M",
+        action="store_true",
+        help="mutation test the student's own tests (requires -s): count how "
+             "many mutants of the homework's *_solution.py file they catch"
+    )
+    parser.add_argument(
+        "--mutation-workers",
+        type=int,
+        default=None,
+        help="number of processes to run mutants on (default: the CPU count)"
+    )
+    parser.add_argument(
+        "-w",
+        type=int,
+        default=1,
+        help="number of students to grade at once (default: 1). Students "
+             "expected to take longest, based on earlier runs, are graded "
+             "first"
+    )
+    parser.add_argument(
+        "--test-shards",
+        type=int,
+        default=1,
+        help="number of pytest processes to split each student's teacher "
+             "tests across (default: 1), balanced by how long each test took "
+             "in earlier runs; the merged results read as if the tests were "
+             "run in one process"
+    )
+    parser.add_argument(
+        "--serve",
+        type=str,
+        default=None,
+        metavar="HOST:PORT",
+        help="instead of grading here, hand the students out to workers "
+             "started with 'python3 distributed.py HOST:PORT' (on this or "
+             "other machines) and collect their results; HOST defaults to "
+             "127.0.0.1, and the coordinator and workers must share a token "
+             "in the AUTOGRADE_WORKER_TOKEN environment variable"
+    )
+    parser.add_argument(
+        "--serve-timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="with --serve, give up (listing the student repos that were not "
+             "graded) if the workers have not graded every student within "
+             "this many seconds (default: wait indefinitely)"
+    )
+    parser.add_argument(
+        "--push-only",
+        action="store_true",
+        help="do not run any tests; only commit and push the results that "
+             "are already in the student repos and were not pushed yet"
+    )
+    parser.add_argument(
+        "--push-workers",
+        type=int,
+        default=4,
+        help="number of pushes to student repos that may be in flight at "
+             "once (default: 4)"
+    )
+    parser.add_argument(
+        "--pushes-per-minute",
+        type=float,
+        default=None,
+        help="maximum number of push attempts started per minute (default: "
+             "no limit)"
+    )
+    parser.add_argument(
+        "--push-attempts",
+        type=int,
+        default=4,
+        help="number of times to attempt pushing to a student repo, backing "
+             "off exponentially between attempts, before giving up "
+             "(default: 4)"
+    )
     return parser
 
 
@@ -419,6 +1030,10 @@ def acquire_gh_links(submission_dir: str) -> Tuple[GHLink]:
     Returns:
         Tuple of student-submitted github links
     """
+    # Imported here so that importing this module (e.g., to only push
+    # results) does not pay for loading BeautifulSoup
+    from bs4 import BeautifulSoup
+
     matched_files = glob.glob(os.path.join(submission_dir, "*.html"))
     gh_links: List[GHLink] = []
 
@@ -434,48 +1049,46 @@ def acquire_gh_links(submission_dir: str) -> Tuple[GHLink]:
     return tuple(gh_links)
 
 
-if __name__ == "__main__":
-    parser = make_parser()
-    args = parser.parse_args()
+def load_teacher_tests(local_hw_folder_path: str,
+                       teacher_test_file: str) -> str:
+    """Reads the teacher-written tests for a homework and rewrites them to
+    test the students' code instead of the solution.
 
-    if not os.path.isdir(args.submissions_dir):
-        print(
-            "Specified submissions folder {} is not a directory/does not "
-            "exist".format(args.submissions_dir)
-        )
-        exit()
+    The import statement that imports the solution file is changed such that
+    it imports the students' code. This is achieved by deleting the
+    '_solution' suffix from the imported file/package (assumes solution file
+    is the same as the student's submission except with a '_solution'
+    suffix).
 
-    autograding_dir: str = os.path.dirname(os.path.realpath(__file__))
-    student_repos_dir: str = os.path.join(autograding_dir, "student_repos")
+    Args:
+        local_hw_folder_path: Path to the homework folder in the teaching team
+         repository
+        teacher_test_file: File (or glob pattern) in the homework folder that
+         contains the teacher-written tests
+
+    Returns:
+        Text of the rewritten teacher tests
 
-    # The python file containing the appropriate tests will need to be copied
-    # into the students' directories. Get the contents of the file from the
-    # teaching team repository for writing into a new file in the students'
-    # repositories.
-    local_hw_folder_path: str = os.path.join(Path(os.getcwd()).parent, "hw",
-                                             args.hw_dir_name)
+    Raises:
+        Exception: If not exactly one file matches the teacher test file or
+         the import statement could not be rewritten
+    """
     matching_test_file_list = glob.glob(
-        os.path.join(local_hw_folder_path, args.teacher_test_file))
+        os.path.join(local_hw_folder_path, teacher_test_file))
 
     if len(matching_test_file_list) != 1:
-        print(
+        raise Exception(
             "It appears that more than one or no file matches '{}' in {}. Make "
             "sure that there is only one file that matches to proceed.".format(
-                args.teacher_test_file, local_hw_folder_path
+                teacher_test_file, local_hw_folder_path
             )
         )
-        exit()
 
     teacher_tests_lines: List[str]
 
-    with open(matching_test_file_list[0], 'r') as teacher_test_file:
-        teacher_tests_lines = teacher_test_file.readlines()
+    with open(matching_test_file_list[0], 'r') as teacher_test_file_obj:
+        teacher_tests_lines = teacher_test_file_obj.readlines()
 
-    # Search for the import statement that imports the solution file in the
-    # teacher test suite and change it such that it imports the students'
-    # code. This is achieved by deleting the '_solution' suffix from the
-    # imported file/package (assumes solution file is the same as the
-    # student's submission except with a '_solution' suffix).
     refactored_teacher_tests: bool = False
     for i in range(len(teacher_tests_lines)):
         if re.findall(
@@ -487,36 +1100,71 @@ if __name__ == "__main__":
             break
 
     if not refactored_teacher_tests:
-        print("Failed to update the import statement in teacher tests file")
-        exit(1)
+        raise Exception("Failed to update the import statement in teacher "
+                        "tests file")
 
-    teacher_tests_text: str = "".join(teacher_tests_lines)
+    return "".join(teacher_tests_lines)
 
-    if not os.path.isdir(student_repos_dir):
-        os.mkdir(student_repos_dir)
 
-    gh_links = acquire_gh_links(args.submissions_dir)
+if __name__ == "__main__":
+    try:
+        from .distributed import TOKEN_ENV
+        from .grading_session import GradingSession
+    except ImportError:
+        from distributed import TOKEN_ENV
+        from grading_session import GradingSession
 
-    students: List[Student] = []
-    failed_for: List[str] = []
-    for gh_link in gh_links:
-        try:
-            students.append(Student(gh_link, student_repos_dir))
-        except Exception as ex:
-            print("Could not proceed with repository cloning or testing for "
-                  "link: {}".format(gh_link.__repr__()))
-            failed_for.append(gh_link.__repr__() + " (reason: {})".format(
-                gh_link.diagnosis()))
-
-    report: List[str] = []
-    for student in students:
-        report.append(student.test(args.hw_dir_name, teacher_tests_text,
-                                   args.s, args.P))
-        print("")
-
-    print("\n--------\nSummary:")
-    if len(report) > 0:
-        print("\n".join(report))
-    if len(failed_for) > 0:
-        print("\nCould not proceed with repository cloning for any of the "
-              "following submitted links:\n{}".format("\n".join(failed_for)))
+    parser = make_parser()
+    args = parser.parse_args()
+
+    # The teacher tests are looked up in the teaching team repository that
+    # this script is run from (i.e., from its autograding directory)
+    session = GradingSession(
+        args.submissions_dir,
+        args.hw_dir_name,
+        teacher_test_file=args.teacher_test_file,
+        student_test_file=args.s,
+        hw_root_dir=os.path.join(Path(os.getcwd()).parent, "hw"),
+        push_concurrency=args.push_workers,
+        max_pushes_per_minute=args.pushes_per_minute,
+        max_push_attempts=args.push_attempts,
+        workers=args.w,
+        test_shards=args.test_shards,
+        measure_coverage=args.C,
+        mutation_testing=args.M,
+        mutation_workers=args.mutation_workers,
+    )
+    try:
+        for extra_assignment in args.a:
+            if len(extra_assignment) not in (2, 3):
+                raise Exception("Expected '-a HW_DIR_NAME TEACHER_TEST_FILE "
+                                "[STUDENT_TEST_FILE]' but got '-a {}'".format(
+                                    " ".join(extra_assignment)))
+            session.add_assignment(*extra_assignment)
+        # Pushing only needs the homework folders, not their teacher tests
+        # (whose golden outputs would otherwise be computed by the solution)
+        if not args.push_only:
+            session.configure_teacher_tests()
+    except Exception as ex:
+        print(ex)
+        exit(1)
+
+    try:
+        if args.push_only:
+            session.push_only()
+        elif args.serve is not None:
+            token = os.environ.get(TOKEN_ENV)
+            if not token:
+                raise Exception("Set the {} environment variable to a token "
+                                "to share with the workers".format(TOKEN_ENV))
+            serve_host, _, serve_port = args.serve.rpartition(":")
+            session.run_distributed(token, serve_host or "127.0.0.1",
+                                    int(serve_port), push_results=args.P,
+                                    regrade=args.R,
+                                    timeout_s=args.serve_timeout)
+        else:
+            session.run(push_results=args.P, regrade=args.R)
+    except Exception as ex:
+        print(ex)
+        exit(1)
+    print(session.summary())
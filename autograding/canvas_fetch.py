@@ -0,0 +1,358 @@
+"""
+Download an assignment's submissions directly from Canvas
+"""
+
+import argparse
+import html
+import http.client
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
+from urllib.parse import urlencode, urljoin, urlsplit
+
+__author__ = "Duncan Mazza"
+
+STATE_FILE_NAME: str = ".canvas_fetch_state.json"
+LINK_SUBMISSION: str = "link"
+FILE_SUBMISSION: str = "file"
+
+_REDIRECT_STATUSES: Tuple[int, ...] = (301, 302, 303, 307, 308)
+
+
+class CanvasClient:
+    """Minimal client for the Canvas REST API.
+
+    Connections are kept alive and pooled per thread and per host, so that
+    listing pages and downloading many attachments from a thread pool does
+    not pay for a new TCP/TLS handshake on every request. The API token is
+    only sent to the Canvas host itself, not to the file storage hosts that
+    attachment downloads redirect to.
+    """
+
+    def __init__(self, base_url: str, token: str, timeout: float = 30):
+        """
+        Args:
+            base_url: URL of the Canvas instance (e.g.,
+             'https://canvas.olin.edu')
+            token: Canvas API access token
+            timeout: Timeout (in seconds) of each request
+        """
+        self._base_url: str = base_url.rstrip("/")
+        self._base_netloc: str = urlsplit(self._base_url).netloc
+        self._token: str = token
+        self._timeout: float = timeout
+        self._local = threading.local()
+
+    def _connection(self, scheme: str, netloc: str,
+                    reconnect: bool = False) -> http.client.HTTPConnection:
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        connections: Dict[Tuple[str, str], http.client.HTTPConnection] = \
+            self._local.connections
+        key = (scheme, netloc)
+        if reconnect and key in connections:
+            connections.pop(key).close()
+        if key not in connections:
+            if scheme == "https":
+                connections[key] = http.client.HTTPSConnection(
+                    netloc, timeout=self._timeout)
+            elif scheme == "http":
+                connections[key] = http.client.HTTPConnection(
+                    netloc, timeout=self._timeout)
+            else:
+                raise Exception("Unsupported URL scheme '{}'".format(scheme))
+        return connections[key]
+
+    def _get_once(self, url: str) -> http.client.HTTPResponse:
+        split_url = urlsplit(url)
+        path = split_url.path + ("?" + split_url.query if split_url.query
+                                 else "")
+        headers = {"Accept": "application/json"}
+        if split_url.netloc == self._base_netloc:
+            headers["Authorization"] = "Bearer " + self._token
+
+        # A pooled connection may have been closed by the server since it was
+        # last used, so retry once on a fresh connection
+        for attempt in range(2):
+            connection = self._connection(split_url.scheme, split_url.netloc,
+                                          reconnect=attempt > 0)
+            try:
+                connection.request("GET", path, headers=headers)
+                return connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                if attempt > 0:
+                    raise
+        raise Exception("Unreachable")
+
+    def get(self, url: str) -> Tuple[bytes, http.client.HTTPResponse]:
+        """GETs a URL (absolute, or relative to the Canvas instance),
+        following redirects.
+
+        Returns:
+            Body and response of the final request
+        """
+        url = urljoin(self._base_url + "/", url)
+        for _ in range(6):
+            response = self._get_once(url)
+            body = response.read()
+            if response.status in _REDIRECT_STATUSES:
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            if not 200 <= response.status < 300:
+                raise Exception("Canvas request to {} failed with status "
+                                "{}".format(url, response.status))
+            return body, response
+        raise Exception("Too many redirects when requesting {}".format(url))
+
+    def get_paginated(self, path: str,
+                      params: List[Tuple[str, str]]) -> List[dict]:
+        """GETs every page of a paginated Canvas API list endpoint.
+
+        Args:
+            path: Path of the endpoint (e.g., '/api/v1/courses/1/users')
+            params: Query parameters
+
+        Returns:
+            Concatenation of every page's items
+        """
+        items: List[dict] = []
+        url: Union[str, None] = path + "?" + urlencode(
+            params + [("per_page", "100")])
+        while url is not None:
+            body, response = self.get(url)
+            items.extend(json.loads(body))
+            # Canvas gives the next page in the Link header, e.g.:
+            # <https://canvas/api/v1/...&page=2>; rel="next", <...>; rel="last"
+            match_obj = re.search(r"<([^>]+)>;\s*rel=\"next\"",
+                                  response.getheader("Link") or "")
+            url = match_obj.group(1) if match_obj is not None else None
+        return items
+
+    def list_submissions(self, course_id: str,
+                         assignment_id: str) -> List[dict]:
+        return self.get_paginated(
+            "/api/v1/courses/{}/assignments/{}/submissions".format(
+                course_id, assignment_id),
+            [("include[]", "user")])
+
+
+def _student_identifier(submission: dict) -> str:
+    # Mirror the names Canvas gives downloaded submissions ('lastfirst'),
+    # which must not contain underscores since the file submission script
+    # splits file names at them
+    user = submission.get("user") or {}
+    name = user.get("sortable_name") or user.get("name") or "student"
+    return re.sub(r"[^a-z0-9]", "", name.lower()) or "student"
+
+
+def _write_link_submission(submission: dict, output_dir: str) -> List[str]:
+    file_name = "{}_{}.html".format(_student_identifier(submission),
+                                    submission["user_id"])
+    link = html.escape(submission.get("url") or "", quote=True)
+    with open(os.path.join(output_dir, file_name), 'w') as submission_file:
+        submission_file.write("<html><body><a href=\"{0}\">{0}</a></body>"
+                              "</html>\n".format(link))
+    return [file_name]
+
+
+def _download_attachment(client: CanvasClient, submission: dict,
+                         attachment: dict, output_dir: str) -> str:
+    # Same naming as a submissions download from the Canvas web interface:
+    # <student>_<user id>_<attachment id>_<file name>
+    file_name = "{}_{}_{}_{}".format(
+        _student_identifier(submission), submission["user_id"],
+        attachment["id"], os.path.basename(
+            attachment.get("filename") or attachment["display_name"]))
+    body, _ = client.get(attachment["url"])
+    with open(os.path.join(output_dir, file_name), 'wb') as attachment_file:
+        attachment_file.write(body)
+    return file_name
+
+
+def _is_unchanged(prev_state: Dict[str, Union[str, List[str]]],
+                  submission: dict, output_dir: str) -> bool:
+    # Files that were since renamed, moved, or deleted (e.g., by the file
+    # submission script) are downloaded again
+    return prev_state.get("submitted_at") == submission["submitted_at"] and \
+        all(os.path.isfile(os.path.join(output_dir, file_name)) for
+            file_name in prev_state.get("files", []))
+
+
+def fetch_submissions(client: CanvasClient, course_id: str,
+                      assignment_id: str, output_dir: str,
+                      submission_type: str = LINK_SUBMISSION,
+                      workers: int = 8) -> Dict[str, List[str]]:
+    """Downloads an assignment's submissions into a folder laid out like an
+    unzipped Canvas submissions download, which the link and file submission
+    scripts can then grade.
+
+    Only submissions whose `submitted_at` changed since the previous fetch
+    into the same folder, or whose previously downloaded files are no
+    longer there, are downloaded; files of a student's previous submission
+    are replaced.
+
+    Args:
+        client: Canvas API client
+        course_id: Canvas course id
+        assignment_id: Canvas assignment id
+        output_dir: Folder to download the submissions into
+        submission_type: 'link' to write each submitted URL as an html file or
+         'file' to download each submission's attachments
+        workers: Number of submissions to download concurrently
+
+    Returns:
+        Dictionary with the 'downloaded', 'unchanged', and 'skipped' (e.g.,
+         never submitted) student identifiers, and the identifiers of the
+         students whose submissions could not be downloaded, with the reason,
+         in 'failed' (these are downloaded again by the next fetch)
+    """
+    if submission_type not in (LINK_SUBMISSION, FILE_SUBMISSION):
+        raise Exception("Unknown submission type '{}'; expected '{}' or "
+                        "'{}'".format(submission_type, LINK_SUBMISSION,
+                                      FILE_SUBMISSION))
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, STATE_FILE_NAME)
+    state: Dict[str, Dict[str, Union[str, List[str]]]] = {}
+    if os.path.isfile(state_path):
+        with open(state_path, 'r') as state_file:
+            state = json.load(state_file)
+
+    summary: Dict[str, List[str]] = {"downloaded": [], "unchanged": [],
+                                     "skipped": [], "failed": []}
+    to_download: List[dict] = []
+    for submission in client.list_submissions(course_id, assignment_id):
+        student = "{}_{}".format(_student_identifier(submission),
+                                 submission["user_id"])
+        if submission.get("submitted_at") is None or \
+                submission.get("workflow_state") == "unsubmitted":
+            summary["skipped"].append(student)
+        elif _is_unchanged(state.get(str(submission["user_id"]), {}),
+                           submission, output_dir):
+            summary["unchanged"].append(student)
+        else:
+            to_download.append(submission)
+
+    def download(submission: dict) -> Tuple[List[str], Union[str, None]]:
+        # One submission failing to download (e.g., a missing attachment or
+        # throttling) must not lose the others
+        try:
+            if submission_type == LINK_SUBMISSION:
+                return _write_link_submission(submission, output_dir), None
+            return [_download_attachment(client, submission, attachment,
+                                         output_dir)
+                    for attachment in submission.get("attachments") or []], \
+                None
+        except Exception as ex:
+            return [], str(ex)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for submission, (file_names, error) in zip(
+                    to_download, executor.map(download, to_download)):
+                student = "{}_{}".format(_student_identifier(submission),
+                                         submission["user_id"])
+                if error is not None:
+                    print("Could not download the submission of {} due to "
+                          "error: {}".format(student, error))
+                    summary["failed"].append("{} (reason: {})".format(
+                        student, error))
+                    continue
+                prev_state = state.get(str(submission["user_id"]), {})
+                for prev_file_name in prev_state.get("files", []):
+                    if prev_file_name not in file_names and os.path.isfile(
+                            os.path.join(output_dir, prev_file_name)):
+                        os.remove(os.path.join(output_dir, prev_file_name))
+                state[str(submission["user_id"])] = {
+                    "submitted_at": submission["submitted_at"],
+                    "files": file_names,
+                }
+                summary["downloaded"].append(student)
+    finally:
+        # Keep what was downloaded so that the next fetch does not download
+        # it again
+        with open(state_path, 'w') as state_file:
+            json.dump(state, state_file, indent=2)
+    return summary
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes an argument parser object for this program
+
+    Returns:
+        Argument parser
+    """
+    parser = argparse.ArgumentParser(
+        description="Download an assignment's submissions from Canvas")
+    parser.add_argument(
+        "base_url",
+        type=str,
+        help="URL of the Canvas instance (e.g., 'https://canvas.olin.edu')",
+    )
+    parser.add_argument(
+        "course_id",
+        type=str,
+        help="Canvas course id",
+    )
+    parser.add_argument(
+        "assignment_id",
+        type=str,
+        help="Canvas assignment id",
+    )
+    parser.add_argument(
+        "submissions_dir",
+        type=str,
+        help="folder to download the submissions into (and to later pass to "
+             "the grading scripts)",
+    )
+    parser.add_argument(
+        "-t",
+        type=str,
+        default=LINK_SUBMISSION,
+        choices=[LINK_SUBMISSION, FILE_SUBMISSION],
+        help="type of the submissions: 'link' (default) or 'file'"
+    )
+    parser.add_argument(
+        "-w",
+        type=int,
+        default=8,
+        help="number of submissions to download concurrently (default: 8)"
+    )
+    parser.add_argument(
+        "--token-env",
+        type=str,
+        default="CANVAS_API_TOKEN",
+        help="environment variable that holds the Canvas API access token "
+             "(default: 'CANVAS_API_TOKEN')"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = make_parser()
+    args = parser.parse_args()
+
+    token = os.environ.get(args.token_env)
+    if token is None:
+        print("Set the {} environment variable to a Canvas API access "
+              "token".format(args.token_env))
+        exit(1)
+
+    try:
+        fetch_summary = fetch_submissions(
+            CanvasClient(args.base_url, token), args.course_id,
+            args.assignment_id, args.submissions_dir, args.t, args.w)
+    except Exception as ex:
+        print(ex)
+        exit(1)
+    print("Downloaded {} new or updated submission(s); {} unchanged; {} not "
+          "submitted".format(len(fetch_summary["downloaded"]),
+                             len(fetch_summary["unchanged"]),
+                             len(fetch_summary["skipped"])))
+    if len(fetch_summary["failed"]) > 0:
+        print("Could not download the following submission(s), which will be "
+              "downloaded again by the next fetch:\n{}".format(
+                  "\n".join(fetch_summary["failed"])))
+        exit(1)
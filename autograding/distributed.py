@@ -0,0 +1,635 @@
+"""
+Grade across several machines: a coordinator hands out students to workers
+
+The coordinator holds the queue of jobs (the links to one student repository,
+along with the rewritten teacher tests) and serves them over TCP as lines of
+JSON. Workers connect, ask for a job, clone and test the repository, and send
+back the results (including the text of the results files). Workers keep
+nothing besides their clones, so they can be started or stopped at any time:
+the students' regrade histories (see `regrade.py`) are kept by the
+coordinator, which sends them along with the jobs and records the ones the
+workers send back.
+
+Jobs include the teacher tests and their golden outputs, and results are
+written to the students' results folders, so every message carries a token
+shared by the coordinator and its workers (read from the environment variable
+`TOKEN_ENV`); a connection with a missing or wrong token is closed. A result
+is only accepted from the worker that holds the lease of its job.
+
+Jobs are dealt out longest expected first, in chunks, to a deque per worker.
+A worker whose deque runs dry takes another chunk of the jobs not dealt yet
+or, once every job has been dealt, steals from the tail of the deque with the
+most queued work. A job whose worker disconnects, or does not report back
+before its lease runs out, is queued again.
+
+Start workers (on any machine that can reach the coordinator) with:
+
+    python3 distributed.py grader.example.edu:7100
+
+and the coordinator with `autograde_link_submission.py --serve 0.0.0.0:7100`
+(the coordinator listens on 127.0.0.1 unless another address is given).
+"""
+
+import argparse
+import base64
+import hmac
+import json
+import os
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, List, Tuple, Union
+
+try:
+    from .autograde_link_submission import RESULT_FILE_NAMES, Assignment, \
+        GHLink, Student
+    from .push_queue import PushQueue
+    from .regrade import load_regrade_history, save_regrade_history
+except ImportError:
+    # Run as a script from the autograding directory
+    from autograde_link_submission import RESULT_FILE_NAMES, Assignment, \
+        GHLink, Student
+    from push_queue import PushQueue
+    from regrade import load_regrade_history, save_regrade_history
+
+__author__ = "Duncan Mazza"
+
+# Environment variable that holds the token shared by the coordinator and its
+# workers
+TOKEN_ENV: str = "AUTOGRADE_WORKER_TOKEN"
+
+_POLL_S: float = 0.5
+
+
+def _send(connection_file, message: Dict[str, object]):
+    connection_file.write((json.dumps(message) + "\n").encode())
+    connection_file.flush()
+
+
+def _receive(connection_file) -> Union[Dict[str, object], None]:
+    line = connection_file.readline()
+    if len(line) == 0:
+        return None
+    return json.loads(line)
+
+
+class _WorkerConnectionHandler(socketserver.StreamRequestHandler):
+    """Serves one worker's connection for as long as it stays open"""
+
+    # Results and requests are sent back to back; do not let Nagle's
+    # algorithm hold the second one until the first is acknowledged
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        coordinator: "GradingCoordinator" = self.server.coordinator
+        worker: Union[str, None] = None
+        try:
+            while True:
+                message = _receive(self.rfile)
+                if message is None or not coordinator.is_authorized(
+                        message.get("token")):
+                    return
+                if worker is None:
+                    worker = str(message["worker"])
+                elif str(message["worker"]) != worker:
+                    # A connection speaks for one worker only
+                    return
+                if message["type"] == "result":
+                    coordinator.complete(worker, int(message["job_id"]),
+                                         message["result"])
+                elif message["type"] == "request":
+                    _send(self.wfile, coordinator.next_message(worker))
+        except (OSError, ValueError, KeyError):
+            return
+        finally:
+            if worker is not None:
+                coordinator.release(worker)
+
+
+class _CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class GradingCoordinator:
+    """Hands out grading jobs to workers that connect over TCP and collects
+    their results.
+
+    Example:
+        coordinator = GradingCoordinator(jobs, token, port=7100)
+        coordinator.start()
+        results = coordinator.wait()
+        coordinator.close()
+    """
+
+    def __init__(self, jobs: List[Dict[str, object]], token: str,
+                 expected_durations_s: Union[Dict[int, float], None] = None,
+                 host: str = "127.0.0.1", port: int = 0,
+                 lease_s: float = 600.0):
+        """
+        Args:
+            jobs: Jobs to hand out, each a JSON-serializable dictionary with a
+             unique integer 'job_id'
+            token: Secret shared with the workers, which must send it with
+             every message
+            expected_durations_s: Expected duration of each job, by job id;
+             jobs expected to take longest are dealt first
+            host: Address to listen on
+            port: Port to listen on; 0 picks a free one (see `address`)
+            lease_s: Time a worker has to report back the result of a job
+             before the job is queued again
+        """
+        if len(token) == 0:
+            raise Exception("The token shared with the workers cannot be "
+                            "empty")
+        self._token: str = token
+        expected_durations_s = expected_durations_s or {}
+        self._jobs: Dict[int, Dict[str, object]] = {
+            int(job["job_id"]): job for job in jobs}
+        self._expected_durations_s: Dict[int, float] = {
+            job_id: expected_durations_s.get(job_id, 1.0) for job_id in
+            self._jobs}
+        self._lease_s: float = lease_s
+
+        self._undealt: Deque[int] = deque(sorted(
+            self._jobs, key=lambda job_id: -self._expected_durations_s[
+                job_id]))
+        self._deques: Dict[str, Deque[int]] = {}
+        self._leases: Dict[int, Tuple[str, float]] = {}
+        self._results: Dict[int, Dict[str, object]] = {}
+        self._jobs_by_worker: Dict[str, int] = {}
+        self._steals: int = 0
+        self._lock = threading.Condition()
+
+        self._server = _CoordinatorServer((host, port),
+                                          _WorkerConnectionHandler)
+        self._server.coordinator = self
+        self._thread: Union[threading.Thread, None] = None
+
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wait(self, timeout: Union[float, None] = None) -> \
+            Dict[int, Dict[str, object]]:
+        """Waits for the results of every job.
+
+        Returns:
+            Result of each job, by job id
+
+        Raises:
+            Exception: If the timeout ran out first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while len(self._results) < len(self._jobs):
+                # Wake up now and then to requeue jobs whose lease ran out
+                # even if no worker is asking for work
+                wait_s = self._lease_s if deadline is None else \
+                    deadline - time.monotonic()
+                if wait_s <= 0:
+                    raise Exception("Timed out waiting for {} job(s)".format(
+                        len(self._jobs) - len(self._results)))
+                self._lock.wait(min(wait_s, _POLL_S * 4))
+                self._requeue_expired_leases()
+            return dict(self._results)
+
+    def unfinished_jobs(self) -> List[int]:
+        """Ids of the jobs whose results have not been reported yet"""
+        with self._lock:
+            return sorted(job_id for job_id in self._jobs if job_id not in
+                          self._results)
+
+    def jobs_by_worker(self) -> Dict[str, int]:
+        """Number of results each worker reported"""
+        with self._lock:
+            return dict(self._jobs_by_worker)
+
+    def steals(self) -> int:
+        """Number of jobs taken from another worker's deque"""
+        with self._lock:
+            return self._steals
+
+    def is_authorized(self, token: object) -> bool:
+        """Whether a message carries the token shared with the workers"""
+        return isinstance(token, str) and hmac.compare_digest(
+            token.encode(), self._token.encode())
+
+    def _requeue_expired_leases(self):
+        now = time.monotonic()
+        for job_id, (worker, deadline) in list(self._leases.items()):
+            if deadline < now:
+                print("Lease of job {} by worker {} ran out; queueing it "
+                      "again".format(job_id, worker))
+                del self._leases[job_id]
+                self._undealt.appendleft(job_id)
+
+    def _queued_s(self, worker_deque: Deque[int]) -> float:
+        return sum(self._expected_durations_s[job_id] for job_id in
+                   worker_deque)
+
+    def _take_job(self, worker: str) -> Union[int, None]:
+        own_deque = self._deques.setdefault(worker, deque())
+        if len(own_deque) == 0 and len(self._undealt) > 0:
+            # Deal smaller chunks as fewer jobs remain, so that the last jobs
+            # spread over every worker
+            chunk = max(1, len(self._undealt) // (2 * len(self._deques)))
+            for _ in range(min(chunk, len(self._undealt))):
+                own_deque.append(self._undealt.popleft())
+        if len(own_deque) > 0:
+            return own_deque.popleft()
+
+        victims = [other_deque for other_worker, other_deque in
+                   self._deques.items() if other_worker != worker and
+                   len(other_deque) > 0]
+        if len(victims) == 0:
+            return None
+        self._steals += 1
+        return max(victims, key=self._queued_s).pop()
+
+    def next_message(self, worker: str) -> Dict[str, object]:
+        """Answers a worker's request for work: a job, a request to wait
+        (for jobs that are leased but may be queued again), or that every
+        job is done
+        """
+        with self._lock:
+            self._requeue_expired_leases()
+            if len(self._results) == len(self._jobs):
+                return {"type": "done"}
+            job_id = self._take_job(worker)
+            if job_id is None:
+                return {"type": "wait", "seconds": _POLL_S}
+            self._leases[job_id] = (worker, time.monotonic() + self._lease_s)
+            return {"type": "job", "job": self._jobs[job_id]}
+
+    def complete(self, worker: str, job_id: int,
+                 result: Dict[str, object]) -> bool:
+        """Records the result of a job, if the worker holds the job's lease
+        (a worker whose lease ran out or that was never handed the job cannot
+        report its result).
+
+        Returns:
+            Whether the result was accepted
+        """
+        with self._lock:
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != worker:
+                print("Ignoring a result for job {} from worker {}, which "
+                      "does not hold its lease".format(job_id, worker))
+                return False
+            del self._leases[job_id]
+            self._results[job_id] = result
+            self._jobs_by_worker[worker] = \
+                self._jobs_by_worker.get(worker, 0) + 1
+            self._lock.notify_all()
+            return True
+
+    def release(self, worker: str):
+        """Queues the jobs of a worker that disconnected again"""
+        with self._lock:
+            for job_id, (lease_worker, _) in list(self._leases.items()):
+                if lease_worker == worker:
+                    del self._leases[job_id]
+                    self._undealt.appendleft(job_id)
+            worker_deque = self._deques.pop(worker, deque())
+            self._undealt.extendleft(reversed(worker_deque))
+            self._lock.notify_all()
+
+
+def make_grading_job(job_id: int, students: List[Student],
+                     assignments: List[Assignment],
+                     push_results: bool = False,
+                     regrade: bool = False,
+                     push_settings: Union[Dict[str, object], None] = None) \
+        -> Dict[str, object]:
+    """Describes the grading of the students that submitted links to one
+    repository as a job that can be sent to a worker. For a regrade, the
+    students' recorded results (see `Student.regrade_history_dir`) are sent
+    along, so that what is rerun does not depend on the worker. The push
+    settings are the keyword arguments of the `PushQueue` that the worker
+    pushes the results with.
+    """
+    links = [student.gh_link.orig_link() for student in students]
+    regrade_histories: Dict[str, Dict[str, List[str]]] = {}
+    for student in students if regrade else []:
+        for assignment in assignments:
+            if assignment.history_dir is None:
+                continue
+            regrade_history = load_regrade_history(
+                student.regrade_history_dir(assignment.history_dir))
+            if regrade_history is not None:
+                regrade_histories.setdefault(student.gh_link.orig_link(), {})[
+                    assignment.hw_folder] = list(regrade_history)
+
+    job_assignments: List[Dict[str, object]] = []
+    for assignment in assignments:
+        golden_fixture: Union[str, None] = None
+        if assignment.golden_fixture_path is not None:
+            with open(assignment.golden_fixture_path, 'rb') as fixture_file:
+                golden_fixture = base64.b64encode(
+                    fixture_file.read()).decode()
+        job_assignments.append({
+            "hw_folder": assignment.hw_folder,
+            "teacher_tests_text": assignment.teacher_tests_text,
+            "student_test_file_name": assignment.student_test_file_name,
+            "coverage_module": assignment.coverage_module,
+            "test_shards": assignment.test_shards,
+            "golden_fixture": golden_fixture,
+        })
+    return {"job_id": job_id, "links": links, "assignments": job_assignments,
+            "push_results": push_results, "push": push_settings or {},
+            "regrade": regrade, "regrade_histories": regrade_histories}
+
+
+def grade_job(job: Dict[str, object], student_repos_dir: str,
+              push_queue: Union[PushQueue, None] = None) -> \
+        Dict[str, object]:
+    """Clones and tests the repository of a job (see `make_grading_job`).
+    If the job pushes results, each link's results are committed once it is
+    tested and pushed through the push queue (one made from the job's push
+    settings if none is given) while the next link is tested.
+
+    Returns:
+        Results of each of the job's links, with the text of the results
+         files, the regrade history of every homework folder, and the
+         outcome of the push
+    """
+    push_results = bool(job.get("push_results"))
+    own_push_queue: Union[PushQueue, None] = None
+    if push_results and push_queue is None:
+        own_push_queue = PushQueue(**job.get("push", {}))
+        own_push_queue.start()
+        push_queue = own_push_queue
+
+    os.makedirs(student_repos_dir, exist_ok=True)
+    # The regrade histories sent with the job, and those recorded by this
+    # run, are only kept until they are sent back
+    history_root = tempfile.mkdtemp(prefix=".history_{}_".format(
+        job["job_id"]), dir=student_repos_dir)
+    assignments: List[Assignment] = []
+    for job_assignment in job["assignments"]:
+        golden_fixture_path: Union[str, None] = None
+        if job_assignment.get("golden_fixture") is not None:
+            golden_fixture_path = os.path.join(
+                student_repos_dir, ".golden_{}_{}.pickle".format(
+                    job["job_id"], job_assignment["hw_folder"]))
+            with open(golden_fixture_path, 'wb') as fixture_file:
+                fixture_file.write(base64.b64decode(
+                    job_assignment["golden_fixture"]))
+        assignments.append(Assignment(
+            job_assignment["hw_folder"],
+            job_assignment["teacher_tests_text"],
+            job_assignment.get("student_test_file_name"),
+            history_dir=os.path.join(history_root,
+                                     job_assignment["hw_folder"]),
+            coverage_module=job_assignment.get("coverage_module"),
+            test_shards=job_assignment.get("test_shards") or 1,
+            golden_fixture_path=golden_fixture_path,
+        ))
+
+    start = time.monotonic()
+    link_results: List[Dict[str, object]] = []
+    push_outcomes = []
+    try:
+        for link in job["links"]:
+            student = Student(GHLink(link), student_repos_dir)
+            for hw_folder, regrade_history in job.get(
+                    "regrade_histories", {}).get(link, {}).items():
+                save_regrade_history(student.regrade_history_dir(
+                    os.path.join(history_root, hw_folder)), *regrade_history)
+            try:
+                report = student.test_assignments(
+                    assignments, False, bool(job.get("regrade")))
+            except Exception as ex:
+                report = "Testing for {}: Could not complete testing due to " \
+                         "error: {}".format(student.__repr__(), ex)
+                if push_queue is not None:
+                    push_outcomes.append(push_queue.record_failure(student,
+                                                                   str(ex)))
+            else:
+                if push_queue is not None:
+                    try:
+                        student.commit_results([assignment.hw_folder for
+                                                assignment in assignments])
+                        push_outcomes.append(push_queue.submit(student))
+                    except Exception as ex:
+                        push_outcomes.append(push_queue.record_failure(
+                            student, str(ex)))
+            results_files: Dict[str, Dict[str, str]] = {}
+            regrade_histories: Dict[str, List[str]] = {}
+            for assignment in assignments:
+                regrade_history = load_regrade_history(
+                    student.regrade_history_dir(assignment.history_dir))
+                if regrade_history is not None:
+                    regrade_histories[assignment.hw_folder] = \
+                        list(regrade_history)
+                hw_folder_path = os.path.join(student.repo_folder_path(), "hw",
+                                              assignment.hw_folder)
+                results_files[assignment.hw_folder] = {}
+                for file_name in RESULT_FILE_NAMES:
+                    file_path = os.path.join(hw_folder_path, file_name)
+                    if os.path.isfile(file_path):
+                        with open(file_path, 'r') as results_file:
+                            results_files[assignment.hw_folder][file_name] = \
+                                results_file.read()
+            link_results.append({
+                "link": link,
+                "student": student.__repr__(),
+                "repo_folder_name": student.repo_folder_name(),
+                "report": report,
+                "tested_without_failure": student.tested_without_failure(),
+                "pushed_successfully": False,
+                "coverage": student.coverage(),
+                "results_files": results_files,
+                "regrade_history": regrade_histories,
+                "push": None,
+            })
+
+        for link_result, outcome in zip(link_results, push_outcomes):
+            outcome.wait()
+            link_result["pushed_successfully"] = outcome.succeeded()
+            link_result["push"] = outcome.to_dict()
+            if outcome.succeeded():
+                link_result["report"] += " | Pushed successfully"
+            else:
+                link_result["report"] += " | Did NOT push successfully due " \
+                                         "to error: {}".format(outcome.error)
+    finally:
+        if own_push_queue is not None:
+            own_push_queue.close()
+        shutil.rmtree(history_root, ignore_errors=True)
+        for assignment in assignments:
+            if assignment.golden_fixture_path is not None and \
+                    os.path.isfile(assignment.golden_fixture_path):
+                os.remove(assignment.golden_fixture_path)
+    return {"links": link_results, "duration_s": time.monotonic() - start}
+
+
+class GradingWorker:
+    """Asks a coordinator for jobs until every job is done, grading each with
+    `grade_job` (or the given executor)
+    """
+
+    def __init__(self, host: str, port: int, token: str,
+                 student_repos_dir: str, worker_id: Union[str, None] = None,
+                 executor: Union[Callable[[Dict[str, object]],
+                                          Dict[str, object]], None] = None,
+                 connect_timeout_s: float = 30.0):
+        """
+        Args:
+            host: Address of the coordinator
+            port: Port of the coordinator
+            token: Secret shared with the coordinator
+            student_repos_dir: Folder to clone student repositories into
+            worker_id: Name of the worker in the coordinator's bookkeeping;
+             defaults to the host name plus a random suffix
+            executor: Grades a job, returning its result; defaults to
+             `grade_job`, pushing through a push queue that is kept for as
+             long as the worker runs (made from the push settings of the
+             first job that pushes), so that its rate limit holds across
+             jobs
+            connect_timeout_s: How long to keep trying to reach the
+             coordinator (e.g., while it is starting up)
+        """
+        self._address: Tuple[str, int] = (host, port)
+        self._token: str = token
+        self._student_repos_dir: str = student_repos_dir
+        self.worker_id: str = worker_id or "{}-{}".format(
+            socket.gethostname(), uuid.uuid4().hex[:6])
+        self._executor = executor or (lambda job: grade_job(
+            job, self._student_repos_dir, self._push_queue_for(job)))
+        self._push_queue: Union[PushQueue, None] = None
+        self._connect_timeout_s: float = connect_timeout_s
+
+    def _connect(self) -> socket.socket:
+        deadline = time.monotonic() + self._connect_timeout_s
+        while True:
+            try:
+                connection = socket.create_connection(self._address)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise Exception("Could not reach the coordinator at "
+                                    "{}:{}".format(*self._address))
+                time.sleep(_POLL_S)
+                continue
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return connection
+
+    def _push_queue_for(self, job: Dict[str, object]) -> \
+            Union[PushQueue, None]:
+        if not job.get("push_results"):
+            return None
+        if self._push_queue is None:
+            self._push_queue = PushQueue(**job.get("push", {}))
+            self._push_queue.start()
+        return self._push_queue
+
+    def run(self) -> int:
+        """Grades jobs until the coordinator reports that every job is done
+        (or disconnects).
+
+        Returns:
+            Number of jobs graded
+        """
+        try:
+            return self._run()
+        finally:
+            if self._push_queue is not None:
+                self._push_queue.close()
+                self._push_queue = None
+
+    def _run(self) -> int:
+        num_graded = 0
+        with self._connect() as connection:
+            connection_file = connection.makefile("rwb")
+            while True:
+                _send(connection_file, {"type": "request",
+                                        "token": self._token,
+                                        "worker": self.worker_id})
+                message = _receive(connection_file)
+                if message is None or message["type"] == "done":
+                    return num_graded
+                if message["type"] == "wait":
+                    time.sleep(float(message["seconds"]))
+                    continue
+
+                job = message["job"]
+                print("Worker {} grading job {}".format(self.worker_id,
+                                                        job["job_id"]))
+                try:
+                    result = self._executor(job)
+                except Exception as ex:
+                    result = {"error": str(ex), "links": []}
+                _send(connection_file, {"type": "result",
+                                        "token": self._token,
+                                        "worker": self.worker_id,
+                                        "job_id": job["job_id"],
+                                        "result": result})
+                num_graded += 1
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes an argument parser object for this program
+
+    Returns:
+        Argument parser
+    """
+    parser = argparse.ArgumentParser(
+        description="Grade students handed out by a grading coordinator")
+    parser.add_argument(
+        "coordinator",
+        type=str,
+        help="address of the coordinator, as HOST:PORT",
+    )
+    parser.add_argument(
+        "-r",
+        type=str,
+        default=os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             "student_repos"),
+        help="folder to clone student repositories into (default: "
+             "student_repos in this folder)"
+    )
+    parser.add_argument(
+        "--token-env",
+        type=str,
+        default=TOKEN_ENV,
+        help="environment variable that holds the token shared with the "
+             "coordinator (default: '{}')".format(TOKEN_ENV)
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = make_parser()
+    args = parser.parse_args()
+
+    token = os.environ.get(args.token_env)
+    if not token:
+        print("Set the {} environment variable to the token shared with the "
+              "coordinator".format(args.token_env))
+        exit(1)
+
+    coordinator_host, _, coordinator_port = args.coordinator.rpartition(":")
+    try:
+        graded = GradingWorker(coordinator_host, int(coordinator_port), token,
+                               args.r).run()
+    except Exception as ex:
+        print(ex)
+        exit(1)
+    print("Graded {} job(s)".format(graded))
@@ -0,0 +1,207 @@
+"""
+Group identical teacher test failures across students
+
+Each failing or erroring test in a `pytest -v` report is reduced to a
+signature: the test id, the exception type, the first line of the error
+message (with memory addresses and folder paths stripped, so that it reads
+the same for every student), and the file of the frame that raised it.
+Indexing the signatures for a whole class lets failures be reviewed once per
+distinct bug instead of once per student.
+"""
+
+import os
+import re
+from typing import Dict, List, Tuple, Union
+
+try:
+    from .pytest_output import ENTRY_RX, SECTION_RX, entry_test_id
+except ImportError:
+    # Run as a script from the autograding directory
+    from pytest_output import ENTRY_RX, SECTION_RX, entry_test_id
+
+__author__ = "Duncan Mazza"
+
+# Location of a traceback entry, e.g. 'hw2.py:11: ZeroDivisionError' for the
+# frame that raised or 'hw2.py:8: in div' for the frames before it
+_LOCATION_RX = re.compile(r"^(\S[^:]*):(\d+): ?(.*)$")
+_ERROR_LINE_RX = re.compile(r"^E\s+(.*)$")
+_EXCEPTION_RX = re.compile(r"^([A-Za-z_][\w.]*(?:Error|Exception|Exit|"
+                           r"Failed|Interrupt|Warning)):")
+_ADDRESS_RX = re.compile(r"0x[0-9a-fA-F]+")
+_PATH_RX = re.compile(r"(?:[A-Za-z]:)?(?:[/\\][^\s/\\'\"():,]+)+[/\\]"
+                      r"(?=[^\s/\\'\"():,]+)")
+
+_MAX_MESSAGE_LENGTH: int = 200
+
+
+def normalize_message(message: str) -> str:
+    """Strips what differs between students' runs of the same failure (object
+    addresses and the folders files are in) from an error message
+    """
+    message = _ADDRESS_RX.sub("0x...", message)
+    message = _PATH_RX.sub("", message)
+    return message.strip()[:_MAX_MESSAGE_LENGTH]
+
+
+class FailureSignature:
+    """What identifies one way of failing one test"""
+
+    def __init__(self, test_id: str, exception_type: str, message: str,
+                 frame_file: str):
+        self.test_id: str = test_id
+        self.exception_type: str = exception_type
+        self.message: str = message
+        self.frame_file: str = frame_file
+
+    def key(self) -> Tuple[str, str, str, str]:
+        return self.test_id, self.exception_type, self.message, \
+            self.frame_file
+
+    def __eq__(self, other):
+        return isinstance(other, FailureSignature) and \
+            self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return "{}: {} in {}: {}".format(
+            self.test_id, self.exception_type or "error",
+            self.frame_file or "unknown file", self.message)
+
+
+def _signature_of_entry(test_id: str, entry_lines: List[str]) -> \
+        FailureSignature:
+    message = ""
+    exception_type = ""
+    frame_file = ""
+    for line in entry_lines:
+        match_obj = _ERROR_LINE_RX.match(line)
+        if match_obj is not None:
+            message = match_obj.group(1)
+            break
+    for line in reversed(entry_lines):
+        match_obj = _LOCATION_RX.match(line)
+        if match_obj is not None:
+            frame_file = os.path.basename(match_obj.group(1))
+            if not match_obj.group(3).startswith("in "):
+                exception_type = match_obj.group(3).strip()
+            break
+    if exception_type == "":
+        match_obj = _EXCEPTION_RX.match(message)
+        if match_obj is not None:
+            exception_type = match_obj.group(1)
+    return FailureSignature(test_id, exception_type,
+                            normalize_message(message), frame_file)
+
+
+def parse_failures(results_text: str) -> List[Tuple[FailureSignature, str]]:
+    """Finds every entry of the FAILURES and ERRORS sections of a `pytest -v`
+    report.
+
+    Returns:
+        Signature and full text of each entry, in the order of the report
+    """
+    failures: List[Tuple[FailureSignature, str]] = []
+    in_section = False
+    entry_title: Union[str, None] = None
+    entry_lines: List[str] = []
+
+    def finish_entry():
+        if entry_title is not None:
+            failures.append((
+                _signature_of_entry(entry_test_id(entry_title), entry_lines),
+                "\n".join(entry_lines).strip("\n")))
+
+    for line in results_text.splitlines():
+        section_match = SECTION_RX.match(line)
+        if section_match is not None:
+            finish_entry()
+            entry_title = None
+            entry_lines = []
+            in_section = section_match.group(1) in ("FAILURES", "ERRORS")
+            continue
+        if not in_section:
+            continue
+        entry_match = ENTRY_RX.match(line)
+        if entry_match is not None:
+            finish_entry()
+            entry_title = entry_match.group(1)
+            entry_lines = [line]
+        elif entry_title is not None:
+            entry_lines.append(line)
+    finish_entry()
+    return failures
+
+
+class FailureGroup:
+    """Students whose tests failed with the same signature"""
+
+    def __init__(self, signature: FailureSignature, representative: str):
+        self.signature: FailureSignature = signature
+        self.representative: str = representative
+        self.students: List[str] = []
+
+
+class FailureIndex:
+    """Class-wide index of teacher test failures by signature
+
+    Example:
+        index = FailureIndex()
+        for student, results_path in results_paths.items():
+            index.add_file(student, results_path)
+        print(index.report())
+    """
+
+    def __init__(self):
+        self._groups: Dict[FailureSignature, FailureGroup] = {}
+        self._students: List[str] = []
+
+    def add(self, student: str, results_text: str):
+        """Indexes the failures in one student's `pytest -v` report"""
+        self._students.append(student)
+        for signature, entry_text in parse_failures(results_text):
+            group = self._groups.get(signature)
+            if group is None:
+                group = FailureGroup(signature, entry_text)
+                self._groups[signature] = group
+            if student not in group.students:
+                group.students.append(student)
+
+    def add_file(self, student: str, results_path: str):
+        with open(results_path, 'r') as results_file:
+            self.add(student, results_file.read())
+
+    def groups(self) -> List[FailureGroup]:
+        """Groups of failures, most common first"""
+        return sorted(self._groups.values(), key=lambda group: (
+            -len(group.students), group.signature.test_id))
+
+    def failing_students(self) -> List[str]:
+        return [student for student in self._students if any(
+            student in group.students for group in self._groups.values())]
+
+    def summary(self) -> str:
+        """One line per signature, with the number of students"""
+        summary = "Failure index: {} of {} student(s) failed teacher tests " \
+                  "in {} distinct way(s)".format(
+                      len(self.failing_students()), len(self._students),
+                      len(self._groups))
+        for group in self.groups():
+            summary += "\n  {:>4} student(s): {}".format(
+                len(group.students), group.signature.__repr__())
+        return summary
+
+    def report(self) -> str:
+        """Every signature with the students it groups and the output of
+        the first of them
+        """
+        report = self.summary()
+        for i, group in enumerate(self.groups()):
+            report += "\n\n{} Signature {} of {} {}\n{}\n\nStudents ({}): " \
+                      "{}\n\nRepresentative output (from {}):\n{}".format(
+                          "=" * 10, i + 1, len(self._groups), "=" * 10,
+                          group.signature.__repr__(), len(group.students),
+                          ", ".join(group.students), group.students[0],
+                          group.representative)
+        return report + "\n"
@@ -0,0 +1,247 @@
+"""
+Precompute the expected outputs of teacher tests by running the solution once
+
+Teacher tests can declare the inputs whose expected outputs are expensive to
+compute in a module-level `GOLDEN_CASES` dictionary and get the outputs
+through a `golden_output` function:
+
+    from hw2_solution import shortest_path
+
+    GOLDEN_CASES = {
+        "big_grid": (shortest_path, (make_grid(500),), {}),
+    }
+
+    def golden_output(key):
+        func, args, kwargs = GOLDEN_CASES[key]
+        return func(*args, **kwargs)
+
+    def test_big_grid():
+        assert shortest_path(make_grid(500)) == golden_output("big_grid")
+
+Run against the solution (e.g., by the teaching team), `golden_output` calls
+it directly. When grading, the solution is run once per homework to pickle
+every case's output into a fixture, which is cached by the hash of the
+solution and the teacher tests; the teacher tests written into each
+student's repository get a `golden_output` that loads the fixture instead.
+
+To precompute the fixture ahead of grading, run (from this folder):
+
+    python3 golden_outputs.py hw_2 test_hw2.py
+"""
+
+import argparse
+import ast
+import glob
+import hashlib
+import importlib.util
+import io
+import os
+import pickle
+import sys
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+__author__ = "Duncan Mazza"
+
+GOLDEN_CASES_NAME: str = "GOLDEN_CASES"
+GOLDEN_FIXTURE_NAME: str = "teacher_golden.pickle"
+
+# Appended to the teacher tests written into the students' repositories so
+# that `golden_output` loads the precomputed outputs instead of calling the
+# (rewritten) solution import. Each output is pickled separately, so a test
+# only loads the outputs it uses and always gets a fresh copy that it cannot
+# modify for the tests after it.
+_GOLDEN_LOADER_TEMPLATE: str = '''
+
+# Added by the autograder: outputs of GOLDEN_CASES precomputed by the solution
+_GOLDEN_FIXTURE_KEY = "{fixture_key}"
+_golden_fixture = None
+
+
+def golden_output(key):
+    global _golden_fixture
+    import os
+    import pickle
+    if _golden_fixture is None:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "{fixture_name}"), "rb") as golden_file:
+            _golden_fixture = pickle.load(golden_file)
+        if _golden_fixture["key"] != _GOLDEN_FIXTURE_KEY:
+            raise Exception("The golden outputs fixture is out of date")
+    return pickle.loads(_golden_fixture["outputs"][key])
+'''
+
+
+def declares_golden_cases(teacher_tests_text: str) -> bool:
+    """Whether teacher tests assign a module-level GOLDEN_CASES"""
+    for node in ast.parse(teacher_tests_text).body:
+        targets = node.targets if isinstance(node, ast.Assign) else \
+            [node.target] if isinstance(node, ast.AnnAssign) else []
+        if any(isinstance(target, ast.Name) and target.id ==
+               GOLDEN_CASES_NAME for target in targets):
+            return True
+    return False
+
+
+def golden_fixture_key(local_hw_folder_path: str,
+                       teacher_tests_path: str) -> str:
+    """Hash of the solution and the teacher tests (which declare the
+    inputs), so that the fixture is recomputed whenever either changes
+    """
+    sha = hashlib.sha256()
+    for path in [teacher_tests_path] + sorted(glob.glob(os.path.join(
+            local_hw_folder_path, "*_solution.py"))):
+        sha.update(os.path.basename(path).encode())
+        with open(path, 'rb') as hashed_file:
+            sha.update(hashed_file.read())
+    return sha.hexdigest()[:16]
+
+
+class _GoldenPickler(pickle.Pickler):
+    """Refuses to pickle instances of classes defined in a solution module,
+    since the students' repositories cannot unpickle them
+    """
+
+    def persistent_id(self, obj):
+        module_name = getattr(type(obj), "__module__", "") or ""
+        if module_name.split(".")[-1].endswith("_solution"):
+            raise Exception("Golden outputs must not contain instances of "
+                            "classes from the solution ({}.{})".format(
+                                module_name, type(obj).__name__))
+        return None
+
+
+def _dumps(obj: object) -> bytes:
+    buffer = io.BytesIO()
+    _GoldenPickler(buffer, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buffer.getvalue()
+
+
+def compute_golden_outputs(local_hw_folder_path: str,
+                           teacher_tests_path: str) -> Dict[str, bytes]:
+    """Imports the (unrewritten) teacher tests, which import the solution,
+    and calls every case of their GOLDEN_CASES.
+
+    Returns:
+        Pickled output of each case
+    """
+    hw_folder = os.path.realpath(local_hw_folder_path)
+    prev_sys_path = list(sys.path)
+    prev_modules = set(sys.modules)
+    sys.path.insert(0, hw_folder)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            "_golden_teacher_tests", teacher_tests_path)
+        teacher_tests = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(teacher_tests)
+        golden_cases = getattr(teacher_tests, GOLDEN_CASES_NAME)
+
+        outputs: Dict[str, bytes] = {}
+        for key, (func, args, kwargs) in golden_cases.items():
+            try:
+                outputs[key] = _dumps(func(*args, **(kwargs or {})))
+            except Exception as ex:
+                raise Exception("Could not compute the golden output of "
+                                "case '{}' due to error: {}".format(key, ex))
+        return outputs
+    finally:
+        sys.path[:] = prev_sys_path
+        # Forget the modules of the homework folder so that a later import
+        # of a module with the same name (e.g., a student's) is not shadowed
+        for module_name in set(sys.modules) - prev_modules:
+            module_file = getattr(sys.modules[module_name], "__file__",
+                                  None) or ""
+            if os.path.realpath(module_file).startswith(hw_folder + os.sep):
+                del sys.modules[module_name]
+
+
+def load_or_compute_golden_fixture(
+        local_hw_folder_path: str,
+        teacher_tests_path: str,
+        cache_dir: str
+) -> Union[Tuple[str, str], None]:
+    """Finds the cached golden outputs fixture of the current solution and
+    teacher tests, computing it if there is none.
+
+    Args:
+        local_hw_folder_path: Path to the homework folder in the teaching team
+         repository
+        teacher_tests_path: Path to the teacher-written tests
+        cache_dir: Folder to cache fixtures in
+
+    Returns:
+        Path and key of the fixture, or None if the teacher tests do not
+         declare any golden cases
+    """
+    with open(teacher_tests_path, 'r') as teacher_tests_file:
+        if not declares_golden_cases(teacher_tests_file.read()):
+            return None
+    fixture_key = golden_fixture_key(local_hw_folder_path, teacher_tests_path)
+    fixture_path = os.path.join(cache_dir, "golden_{}.pickle".format(
+        fixture_key))
+    if os.path.isfile(fixture_path):
+        return fixture_path, fixture_key
+
+    outputs = compute_golden_outputs(local_hw_folder_path, teacher_tests_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale_fixture_path in glob.glob(os.path.join(cache_dir,
+                                                     "golden_*.pickle")):
+        os.remove(stale_fixture_path)
+    with open(fixture_path, 'wb') as fixture_file:
+        pickle.dump({"key": fixture_key, "outputs": outputs}, fixture_file,
+                    pickle.HIGHEST_PROTOCOL)
+    return fixture_path, fixture_key
+
+
+def golden_loader_source(fixture_key: str) -> str:
+    """Code to append to the rewritten teacher tests so that they load the
+    golden outputs fixture (copied next to them as teacher_golden.pickle)
+    """
+    return _GOLDEN_LOADER_TEMPLATE.format(fixture_key=fixture_key,
+                                          fixture_name=GOLDEN_FIXTURE_NAME)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes an argument parser object for this program
+
+    Returns:
+        Argument parser
+    """
+    parser = argparse.ArgumentParser(
+        description="Precompute the golden outputs that a homework's teacher "
+                    "tests declare")
+    parser.add_argument(
+        "hw_dir_name",
+        type=str,
+        help="name of the homework folder (e.g., 'hw_2')",
+    )
+    parser.add_argument(
+        "teacher_test_file",
+        type=str,
+        help="file in the homework folder that contains the teacher-written "
+             "tests (e.g., 'test_hw2.py')",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = make_parser()
+    args = parser.parse_args()
+
+    autograding_dir = os.path.dirname(os.path.realpath(__file__))
+    local_hw_folder_path = os.path.join(Path(autograding_dir).parent, "hw",
+                                        args.hw_dir_name)
+    try:
+        fixture = load_or_compute_golden_fixture(
+            local_hw_folder_path,
+            os.path.join(local_hw_folder_path, args.teacher_test_file),
+            os.path.join(autograding_dir, "grading_history",
+                         args.hw_dir_name, "golden"))
+    except Exception as ex:
+        print(ex)
+        exit(1)
+    if fixture is None:
+        print("{} does not declare {}".format(args.teacher_test_file,
+                                              GOLDEN_CASES_NAME))
+    else:
+        print("Golden outputs are in {}".format(fixture[0]))
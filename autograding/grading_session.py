@@ -0,0 +1,931 @@
+"""
+Library API for grading a homework assignment's Canvas submissions
+"""
+
+import glob
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple, Union
+
+try:
+    from .autograde_link_submission import Assignment, Student, \
+        acquire_gh_links, load_teacher_tests
+    from .failure_index import FailureIndex
+    from .golden_outputs import golden_loader_source, \
+        load_or_compute_golden_fixture
+    from .push_queue import PushQueue
+    from .regrade import save_regrade_history
+    from .scheduler import GradingHistory, LongestJobFirstScheduler, \
+        estimate_durations_s, github_repo_size_kb, local_repo_size_kb
+    from .sharding import PerTestDurations
+except ImportError:
+    # Imported by one of the scripts run from the autograding directory
+    from autograde_link_submission import Assignment, Student, \
+        acquire_gh_links, load_teacher_tests
+    from failure_index import FailureIndex
+    from golden_outputs import golden_loader_source, \
+        load_or_compute_golden_fixture
+    from push_queue import PushQueue
+    from regrade import save_regrade_history
+    from scheduler import GradingHistory, LongestJobFirstScheduler, \
+        estimate_durations_s, github_repo_size_kb, local_repo_size_kb
+    from sharding import PerTestDurations
+
+__author__ = "Duncan Mazza"
+
+LINK_SUBMISSION: str = "link"
+FILE_SUBMISSION: str = "file"
+
+
+class GradingSession:
+    """Grades the Canvas submissions of one homework assignment.
+
+    This is what the `autograde_link_submission.py` and
+    `autograde_file_submission.py` scripts run; use it directly to drive a
+    grading run from other tooling. Nothing is read from or written to disk
+    until one of `configure_teacher_tests`, `run`, or `push_only` is called.
+
+    More homework folders can be graded in the same pass with
+    `add_assignment`, in which case each student's repository is only
+    updated and checked out once for all of them.
+
+    Example:
+        session = GradingSession("/home/duncan/Downloads/submissions", "hw_2",
+                                 teacher_test_file="test_hw2.py",
+                                 student_test_file="test_hw2.py")
+        session.run(push_results=False)
+        for result in session.results():
+            print(result["student"], result["tested_without_failure"])
+    """
+
+    def __init__(
+            self,
+            submissions_dir: str,
+            hw_dir_name: str,
+            teacher_test_file: Union[str, None] = None,
+            student_test_file: Union[str, None] = None,
+            submission_type: str = LINK_SUBMISSION,
+            hw_root_dir: Union[str, None] = None,
+            autograding_dir: Union[str, None] = None,
+            push_concurrency: int = 4,
+            max_pushes_per_minute: Union[float, None] = None,
+            max_push_attempts: int = 4,
+            workers: int = 1,
+            test_shards: int = 1,
+            measure_coverage: bool = False,
+            mutation_testing: bool = False,
+            mutation_workers: Union[int, None] = None,
+    ):
+        """
+        Args:
+            submissions_dir: Path to the (unzipped) Canvas submissions folder
+            hw_dir_name: Name of the homework folder to grade (e.g., 'hw_2')
+            teacher_test_file: File in the homework folder of the teaching
+             team repository that contains the teacher-written tests (e.g.,
+             'test_hw2.py'); required for link submissions
+            student_test_file: File in the homework folder of the students'
+             repositories that contains the student-written tests
+            submission_type: Either 'link' (GitHub links submitted as html
+             files) or 'file' (python files submitted directly)
+            hw_root_dir: 'hw' folder of the teaching team repository; defaults
+             to the one next to this package
+            autograding_dir: Folder in which student repositories, test
+             results, and grading history are kept; defaults to this
+             package's folder
+            push_concurrency: Number of results pushes that may be in flight
+             at once
+            max_pushes_per_minute: Limit on how many push attempts are started
+             per minute; None for no limit
+            max_push_attempts: Number of times pushing a student's results is
+             attempted before giving up
+            workers: Number of students to grade at once. Students are
+             dispatched longest expected first, based on how long they took
+             in earlier runs (or on their repository size if they are new)
+            test_shards: Number of pytest processes to split each student's
+             teacher tests across, balanced by how long each test took in
+             earlier runs (not used when regrading)
+            measure_coverage: Measure the line and branch coverage of each
+             student's module by their own tests. The module is the teacher
+             test file without its 'test_' prefix (e.g., 'hw2.py' for
+             'test_hw2.py')
+            mutation_testing: Score each student's own tests by how many
+             mutants of the homework's solution ('hw*_solution.py' in the
+             teaching team's homework folder) they catch (link submissions
+             only)
+            mutation_workers: Number of processes to run mutants on; defaults
+             to the CPU count
+        """
+        if submission_type not in (LINK_SUBMISSION, FILE_SUBMISSION):
+            raise Exception("Unknown submission type '{}'; expected '{}' or "
+                            "'{}'".format(submission_type, LINK_SUBMISSION,
+                                          FILE_SUBMISSION))
+
+        if autograding_dir is None:
+            autograding_dir = os.path.dirname(os.path.realpath(__file__))
+        if hw_root_dir is None:
+            hw_root_dir = os.path.join(Path(autograding_dir).parent, "hw")
+
+        self.submissions_dir: str = submissions_dir
+        self.hw_dir_name: str = hw_dir_name
+        self.teacher_test_file: Union[str, None] = teacher_test_file
+        self.student_test_file: Union[str, None] = student_test_file
+        self.submission_type: str = submission_type
+        self.local_hw_folder_path: str = os.path.join(hw_root_dir,
+                                                      hw_dir_name)
+        self.student_repos_dir: str = os.path.join(autograding_dir,
+                                                   "student_repos")
+        self.history_dir: str = os.path.join(autograding_dir,
+                                             "grading_history")
+        self.test_results_dir: str = os.path.join(
+            autograding_dir, "{}_test_results".format(hw_dir_name))
+        self.autograding_dir: str = autograding_dir
+
+        self.push_concurrency: int = push_concurrency
+        self.max_pushes_per_minute: Union[float, None] = max_pushes_per_minute
+        self.max_push_attempts: int = max_push_attempts
+        self.workers: int = workers
+        if test_shards < 1:
+            raise Exception("Number of test shards must be at least 1")
+        self.test_shards: int = test_shards
+        self.measure_coverage: bool = measure_coverage
+        self.mutation_testing: bool = mutation_testing
+        self.mutation_workers: Union[int, None] = mutation_workers
+
+        self._extra_assignments: List[List[Union[str, None]]] = []
+        self._assignments: Union[List[Assignment], None] = None
+        self._students: List[Student] = []
+        self._failed_for: List[str] = []
+        self._report: List[str] = []
+        self._results: List[Dict[str, Union[str, bool]]] = []
+        self._result_index: Dict[int, int] = {}
+        self._push_report: str = ""
+        self._failure_indexes: Dict[str, FailureIndex] = {}
+        # Teacher test results of each link by homework folder, captured when
+        # the link was tested (links to different branches of a repository
+        # share its clone, so its results files only hold the last link's)
+        self._teacher_test_results: Dict[str, Dict[str, str]] = {}
+        # Copies of each link's homework folders, by homework folder and
+        # link, taken when the link was tested so that they can be mutation
+        # tested after every link was
+        self._mutation_snapshots_dir: Union[str, None] = None
+        self._mutation_snapshots: Dict[str, Dict[str, str]] = {}
+
+    def _check_submissions_dir(self):
+        if not os.path.isdir(self.submissions_dir):
+            raise Exception(
+                "Specified submissions folder {} is not a directory/does not "
+                "exist".format(self.submissions_dir)
+            )
+
+    def fetch_canvas_submissions(self, base_url: str, token: str,
+                                 course_id: str, assignment_id: str,
+                                 workers: int = 8) -> Dict[str, List[str]]:
+        """Downloads the assignment's new or updated submissions from Canvas
+        into the submissions folder (see `canvas_fetch.fetch_submissions`).
+        """
+        try:
+            from .canvas_fetch import CanvasClient, fetch_submissions
+        except ImportError:
+            from canvas_fetch import CanvasClient, fetch_submissions
+        return fetch_submissions(CanvasClient(base_url, token), course_id,
+                                 assignment_id, self.submissions_dir,
+                                 self.submission_type, workers)
+
+    def add_assignment(self, hw_dir_name: str, teacher_test_file: str,
+                       student_test_file: Union[str, None] = None):
+        """Grades another homework folder in the same pass (link submissions
+        only).
+
+        Args:
+            hw_dir_name: Name of the homework folder (e.g., 'hw_3')
+            teacher_test_file: File in that homework folder of the teaching
+             team repository that contains the teacher-written tests
+            student_test_file: File in that homework folder of the students'
+             repositories that contains the student-written tests
+        """
+        if self.submission_type != LINK_SUBMISSION:
+            raise Exception("Only link submissions can be graded for several "
+                            "homework folders in one pass")
+        self._extra_assignments.append(
+            [hw_dir_name, teacher_test_file, student_test_file])
+        self._assignments = None
+
+    def hw_dir_names(self) -> List[str]:
+        return [self.hw_dir_name] + [str(extra_assignment[0]) for
+                                     extra_assignment in
+                                     self._extra_assignments]
+
+    def configure_teacher_tests(
+            self,
+            teacher_test_file: Union[str, None] = None
+    ) -> str:
+        """Loads the teacher-written tests of every assignment and rewrites
+        their solution import so that they test the students' code. If the
+        teacher tests declare GOLDEN_CASES, their outputs are computed by the
+        solution (or loaded from the cache, see golden_outputs.py) so that the
+        students' runs do not recompute them.
+
+        Args:
+            teacher_test_file: Overrides the teacher test file given to the
+             constructor
+
+        Returns:
+            Text of the rewritten teacher tests (of the homework folder given
+             to the constructor)
+
+        Raises:
+            Exception: If coverage or mutation testing is requested for an
+             assignment without a student test file
+        """
+        if teacher_test_file is not None:
+            self.teacher_test_file = teacher_test_file
+        if self.teacher_test_file is None:
+            raise Exception("No teacher test file was specified")
+
+        hw_root_dir = os.path.dirname(self.local_hw_folder_path)
+        assignments: List[Assignment] = []
+        assignment_files = [[self.hw_dir_name, self.teacher_test_file,
+                             self.student_test_file]] + \
+            self._extra_assignments
+        # Coverage and mutation scores are measured on the students' own
+        # tests
+        for hw_dir_name, _, hw_student_test_file in assignment_files:
+            for requested, option in ((self.measure_coverage, "Coverage"),
+                                      (self.mutation_testing,
+                                       "Mutation testing")):
+                if requested and hw_student_test_file is None:
+                    raise Exception("{} needs a student test file, but none "
+                                    "was given for {}".format(option,
+                                                              hw_dir_name))
+        for hw_dir_name, hw_teacher_test_file, hw_student_test_file in \
+                assignment_files:
+            coverage_module: Union[str, None] = None
+            if self.measure_coverage:
+                coverage_module = re.sub(
+                    r"^test_", "", os.path.basename(hw_teacher_test_file))
+            local_hw_folder_path = os.path.join(hw_root_dir, hw_dir_name)
+            teacher_tests_text = load_teacher_tests(local_hw_folder_path,
+                                                    hw_teacher_test_file)
+            # load_teacher_tests made sure that exactly one file matches
+            golden_fixture = load_or_compute_golden_fixture(
+                local_hw_folder_path,
+                glob.glob(os.path.join(local_hw_folder_path,
+                                       hw_teacher_test_file))[0],
+                os.path.join(self.history_dir, hw_dir_name, "golden"))
+            golden_fixture_path: Union[str, None] = None
+            if golden_fixture is not None:
+                golden_fixture_path, golden_fixture_key = golden_fixture
+                teacher_tests_text += golden_loader_source(golden_fixture_key)
+            assignments.append(Assignment(
+                hw_dir_name,
+                teacher_tests_text,
+                hw_student_test_file,
+                os.path.join(self.history_dir, hw_dir_name),
+                coverage_module=coverage_module,
+                test_shards=self.test_shards,
+                golden_fixture_path=golden_fixture_path,
+            ))
+        self._assignments = assignments
+        return self._assignments[0].teacher_tests_text
+
+    def _resolve_students(self):
+        if not os.path.isdir(self.student_repos_dir):
+            os.mkdir(self.student_repos_dir)
+
+        self._students = []
+        self._failed_for = []
+        for gh_link in acquire_gh_links(self.submissions_dir):
+            try:
+                self._students.append(Student(gh_link,
+                                              self.student_repos_dir))
+            except Exception:
+                print("Could not proceed with repository cloning or testing "
+                      "for link: {}".format(gh_link.__repr__()))
+                self._failed_for.append(
+                    gh_link.__repr__() + " (reason: {})".format(
+                        gh_link.diagnosis()))
+
+    def _record_student_result(self, student: Student, report: str):
+        self._result_index[id(student)] = len(self._results)
+        self._teacher_test_results[student.gh_link.orig_link()] = \
+            student.teacher_test_results()
+        self._report.append(report)
+        self._results.append({
+            "student": student.__repr__(),
+            "link": student.gh_link.orig_link(),
+            "report": report,
+            "tested_without_failure": student.tested_without_failure(),
+            "pushed_successfully": student.pushed_successfully(),
+            "results_dir": os.path.join(student.repo_folder_path(), "hw",
+                                        self.hw_dir_name),
+            "results_dirs": [os.path.join(student.repo_folder_path(), "hw",
+                                          hw_dir_name) for hw_dir_name in
+                             self.hw_dir_names()],
+            "coverage": student.coverage(),
+            "mutation": {},
+        })
+
+    def _make_push_queue(self) -> PushQueue:
+        push_queue = PushQueue(self.push_concurrency,
+                               self.max_pushes_per_minute,
+                               self.max_push_attempts)
+        push_queue.start()
+        return push_queue
+
+    def _commit_and_queue_push(self, student: Student,
+                               push_queue: PushQueue):
+        try:
+            student.commit_results(self.hw_dir_names())
+            push_queue.submit(student)
+        except Exception as ex:
+            push_queue.record_failure(student, str(ex))
+
+    def _finish_pushes(self, push_queue: PushQueue, push_only: bool):
+        """Waits for the queued pushes and adds their outcomes to the
+        per-student results
+        """
+        for outcome in push_queue.close():
+            i = self._result_index[id(outcome.student)]
+            result = self._results[i]
+            result["pushed_successfully"] = outcome.succeeded()
+            if push_only:
+                push_report = "Pushed successfully" if outcome.succeeded() \
+                    else "Not pushed successfully due to error: {}".format(
+                        outcome.error)
+                result["report"] = "For {}: {}".format(result["student"],
+                                                        push_report)
+            elif outcome.succeeded():
+                result["report"] += " | Pushed successfully"
+            else:
+                result["report"] += " | Did NOT push successfully due to " \
+                                    "error: {}".format(outcome.error)
+            self._report[i] = result["report"]
+        self._push_report = push_queue.reconciliation_report()
+
+    def run(self, push_results: bool = False, regrade: bool = False) -> \
+            List[Dict[str, Union[str, bool]]]:
+        """Runs the student-written and teacher-written tests for every
+        submission.
+
+        Args:
+            push_results: Commit and push the results to the students'
+             repositories (link submissions only). Pushing happens in the
+             background while the remaining students are tested
+            regrade: Only rerun the teacher tests that previously failed or
+             changed (link submissions only)
+
+        Returns:
+            Per-student results (see `results`)
+        """
+        self._check_submissions_dir()
+        self._report = []
+        self._results = []
+        self._push_report = ""
+        self._failure_indexes = {}
+        self._teacher_test_results = {}
+
+        if self.submission_type == FILE_SUBMISSION:
+            self._run_file_submissions()
+            self._index_failures()
+            return self.results()
+
+        if self._assignments is None:
+            self.configure_teacher_tests()
+        for assignment in self._assignments:
+            if assignment.test_shards > 1:
+                assignment.test_durations = PerTestDurations(
+                    self.history_dir, assignment.hw_folder)
+
+        push_queue: Union[PushQueue, None] = None
+        if push_results:
+            push_queue = self._make_push_queue()
+        self._mutation_snapshots = {}
+        if self.mutation_testing:
+            self._mutation_snapshots_dir = tempfile.mkdtemp(
+                prefix="mutation_snapshots_")
+
+        try:
+            self._resolve_students()
+            reports = self._test_students(push_queue, regrade)
+            for student in self._students:
+                self._record_student_result(student, reports[id(student)])
+            if self.mutation_testing:
+                self._mutation_test_students()
+            self._index_failures()
+
+            if push_queue is not None:
+                self._finish_pushes(push_queue, False)
+        finally:
+            if push_queue is not None:
+                # The push threads are daemons, so pushes still queued when
+                # an error is raised would be dropped when the process exits
+                push_queue.close()
+            if self._mutation_snapshots_dir is not None:
+                shutil.rmtree(self._mutation_snapshots_dir,
+                              ignore_errors=True)
+                self._mutation_snapshots_dir = None
+
+        for assignment in self._assignments:
+            if assignment.test_durations is not None:
+                assignment.test_durations.save()
+        return self.results()
+
+    def run_distributed(
+            self,
+            token: str,
+            host: str = "127.0.0.1",
+            port: int = 7100,
+            push_results: bool = False,
+            regrade: bool = False,
+            lease_s: float = 600.0,
+            on_start: Union[Callable[[Tuple[str, int]], None], None] = None,
+            timeout_s: Union[float, None] = None
+    ) -> List[Dict[str, Union[str, bool]]]:
+        """Like `run`, but hands the students out to workers on other
+        machines (or processes) instead of testing them here. Start workers
+        with `python3 distributed.py HOST:PORT`, with the token in their
+        environment (see `distributed.TOKEN_ENV`); they can join and leave at
+        any time until every student is graded. The results files that the
+        workers send back are written to
+        `<hw_dir_name>_test_results/<repository folder>/<hw folder>/`, and
+        the students' regrade histories are kept here and sent along with
+        their jobs.
+
+        Args:
+            token: Secret shared with the workers, which must send it with
+             every message
+            host: Address to listen for workers on; listen on 0.0.0.0 (or the
+             address of a network interface) for workers on other machines
+            port: Port to listen for workers on; 0 picks a free one
+            push_results: Have the workers commit and push the results to the
+             students' repositories. Each worker pushes from a push queue
+             with the session's push settings (so the limit on pushes per
+             minute applies to each worker), and the outcomes it sends back
+             make up the push reconciliation in the summary
+            regrade: Only rerun the teacher tests that previously failed or
+             changed
+            lease_s: Time a worker has to report back a student's results
+             before the student is handed to another worker
+            on_start: Called with the address listened on once workers can
+             connect
+            timeout_s: Time to wait for the workers to grade every student;
+             None to wait for as long as it takes (e.g., until workers are
+             started)
+
+        Returns:
+            Per-student results (see `results`)
+
+        Raises:
+            Exception: If the timeout ran out before every student was
+             graded, listing the repositories that were not
+        """
+        if self.submission_type != LINK_SUBMISSION:
+            raise Exception("Only link submissions can be graded by "
+                            "distributed workers")
+        # Only needed for distributed runs, so only imported for them
+        try:
+            from .distributed import GradingCoordinator, make_grading_job
+        except ImportError:
+            from distributed import GradingCoordinator, make_grading_job
+        if self.mutation_testing:
+            raise Exception("Mutation testing needs the students' clones, "
+                            "which only the distributed workers have")
+        self._check_submissions_dir()
+        self._report = []
+        self._results = []
+        self._push_report = ""
+        self._failure_indexes = {}
+        self._teacher_test_results = {}
+
+        if self._assignments is None:
+            self.configure_teacher_tests()
+
+        self._resolve_students()
+        students_by_repo = self._students_by_repo()
+        history = GradingHistory(self.history_dir)
+        expected_durations_s = self._expected_durations_s(students_by_repo,
+                                                          history)
+        keys = sorted(students_by_repo)
+        push_settings = {"concurrency": self.push_concurrency,
+                         "max_pushes_per_minute": self.max_pushes_per_minute,
+                         "max_attempts": self.max_push_attempts}
+        jobs = [make_grading_job(job_id, students_by_repo[key],
+                                 self._assignments, push_results, regrade,
+                                 push_settings)
+                for job_id, key in enumerate(keys)]
+
+        coordinator = GradingCoordinator(
+            jobs, token, {job_id: expected_durations_s[key] for job_id, key in
+                   enumerate(keys)}, host, port, lease_s)
+        coordinator.start()
+        try:
+            if on_start is not None:
+                on_start(coordinator.address())
+            print("Waiting for workers to grade {} repositories at "
+                  "{}:{}".format(len(jobs), *coordinator.address()))
+            try:
+                job_results = coordinator.wait(timeout_s)
+            except Exception:
+                raise Exception(
+                    "Timed out after {}s waiting for workers to grade: "
+                    "{}".format(timeout_s, ", ".join(
+                        keys[job_id] for job_id in
+                        coordinator.unfinished_jobs())))
+        finally:
+            coordinator.close()
+
+        # Only collects the outcomes of the workers' pushes
+        push_queue: Union[PushQueue, None] = PushQueue() if push_results \
+            else None
+        for job_id, key in enumerate(keys):
+            job_result = job_results[job_id]
+            # A job that errored did not grade the repository, so how long
+            # it took says nothing about how long grading it takes
+            if job_result.get("error") is None and \
+                    job_result.get("duration_s") is not None:
+                history.record(key, float(job_result["duration_s"]))
+            link_results = {link_result["link"]: link_result for link_result
+                            in job_result["links"]}
+            for student in students_by_repo[key]:
+                self._record_distributed_result(
+                    student, link_results.get(student.gh_link.orig_link()),
+                    job_result.get("error"), push_queue)
+        history.save()
+        if push_queue is not None:
+            self._push_report = push_queue.reconciliation_report()
+        self._index_failures()
+        return self.results()
+
+    def _record_distributed_result(self, student: Student,
+                                   link_result: Union[Dict, None],
+                                   error: Union[str, None],
+                                   push_queue: Union[PushQueue, None] = None):
+        """Writes the results files and regrade history a worker sent back
+        for a student and records the student's result (and the outcome of
+        pushing it in the push queue, if given)
+        """
+        # Links to different branches or commits of one repository are
+        # graded from one clone, so their results are kept apart
+        results_dirs = [os.path.join(self.test_results_dir,
+                                     student.repo_folder_name(),
+                                     student.checkout_folder_name(),
+                                     hw_dir_name)
+                        for hw_dir_name in self.hw_dir_names()]
+        if link_result is None:
+            link_result = {
+                "report": "Testing for {}: Could not complete testing due to "
+                          "error: {}".format(student.__repr__(), error or
+                                             "no result from the worker"),
+                "tested_without_failure": False, "pushed_successfully": False,
+                "coverage": {}, "results_files": {}}
+        for hw_dir_name, results_dir in zip(self.hw_dir_names(),
+                                            results_dirs):
+            results_files = link_result["results_files"].get(hw_dir_name, {})
+            if len(results_files) > 0:
+                os.makedirs(results_dir, exist_ok=True)
+            for file_name, text in results_files.items():
+                with open(os.path.join(results_dir, file_name), 'w') as \
+                        results_file:
+                    results_file.write(text)
+        for assignment in self._assignments:
+            regrade_history = link_result.get("regrade_history", {}).get(
+                assignment.hw_folder)
+            if assignment.history_dir is not None and \
+                    regrade_history is not None:
+                save_regrade_history(
+                    student.regrade_history_dir(assignment.history_dir),
+                    *regrade_history)
+
+        if push_queue is not None:
+            if link_result.get("push") is None:
+                push_queue.record_failure(student, error or "no result "
+                                                            "from the worker")
+            else:
+                push_queue.record_outcome(student,
+                                          link_result["push"]["status"],
+                                          link_result["push"]["attempts"],
+                                          link_result["push"]["error"])
+        self._teacher_test_results[student.gh_link.orig_link()] = {
+            hw_dir_name: results_files["teacher_test_results.txt"] for
+            hw_dir_name, results_files in
+            link_result["results_files"].items() if
+            "teacher_test_results.txt" in results_files}
+        self._report.append(link_result["report"])
+        self._results.append({
+            "student": student.__repr__(),
+            "link": student.gh_link.orig_link(),
+            "report": link_result["report"],
+            "tested_without_failure": link_result["tested_without_failure"],
+            "pushed_successfully": link_result["pushed_successfully"],
+            "results_dir": results_dirs[0],
+            "results_dirs": results_dirs,
+            "coverage": link_result["coverage"],
+            "mutation": {},
+        })
+
+    def _students_by_repo(self) -> Dict[str, List[Student]]:
+        # Students that submitted links to the same repository share a local
+        # clone, so they are tested one after the other in the same job
+        students_by_repo: Dict[str, List[Student]] = {}
+        for student in self._students:
+            students_by_repo.setdefault(student.repo_folder_name(),
+                                        []).append(student)
+        return students_by_repo
+
+    @staticmethod
+    def _expected_durations_s(students_by_repo: Dict[str, List[Student]],
+                              history: GradingHistory) -> Dict[str, float]:
+        """Expected duration of each repository's job, from earlier runs or
+        the repository's size. Sizes of repositories that were never cloned
+        are looked up on GitHub; the API allows few unauthenticated requests,
+        and every clone is walked to size it, so only call this when the
+        order matters.
+        """
+        repo_sizes_kb: Dict[str, Union[float, None]] = {
+            key: local_repo_size_kb(students[0].repo_folder_path())
+            for key, students in students_by_repo.items()}
+        unknown_keys = [key for key in students_by_repo if
+                        repo_sizes_kb[key] is None and
+                        history.duration_s(key) is None]
+        if len(unknown_keys) > 0:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                for key, size_kb in zip(unknown_keys, executor.map(
+                        lambda unknown_key: github_repo_size_kb(
+                            students_by_repo[unknown_key][0].gh_link
+                            .username() + "/" + students_by_repo[
+                                unknown_key][0].gh_link.repo_name()),
+                        unknown_keys)):
+                    repo_sizes_kb[key] = size_kb
+        return estimate_durations_s(list(students_by_repo), history,
+                                    repo_sizes_kb)
+
+    def _test_students(self, push_queue: Union[PushQueue, None],
+                       regrade: bool) -> Dict[int, str]:
+        """Tests every student on the session's workers, longest expected
+        first, and records how long each took for future runs.
+
+        Returns:
+            Report of each student, keyed by the student's id()
+        """
+        students_by_repo = self._students_by_repo()
+        history = GradingHistory(self.history_dir)
+        # With one worker, the order students are graded in does not change
+        # how long grading takes, so the repositories are not sized (the
+        # recorded durations are still used to report progress)
+        if self.workers > 1:
+            expected_durations_s = self._expected_durations_s(
+                students_by_repo, history)
+        else:
+            expected_durations_s = estimate_durations_s(
+                list(students_by_repo), history, {})
+
+        reports: Dict[int, str] = {}
+
+        def make_job(students: List[Student]):
+            def job():
+                for student in students:
+                    try:
+                        reports[id(student)] = student.test_assignments(
+                            self._assignments, False, regrade)
+                    except Exception as ex:
+                        reports[id(student)] = "Testing for {}: Could not " \
+                            "complete testing due to error: {}".format(
+                                student.__repr__(), ex)
+                        # Reported as outstanding, since nothing was
+                        # committed to push
+                        if push_queue is not None:
+                            push_queue.record_failure(student, str(ex))
+                        continue
+                    if self._mutation_snapshots_dir is not None:
+                        self._snapshot_for_mutation_testing(student)
+                    if push_queue is not None:
+                        self._commit_and_queue_push(student, push_queue)
+            return job
+
+        durations = LongestJobFirstScheduler(self.workers).run(
+            {key: make_job(students) for key, students in
+             students_by_repo.items()},
+            expected_durations_s)
+        for key, students in students_by_repo.items():
+            # Sizes are only used to order the jobs of several workers
+            history.record(key, durations[key][1], local_repo_size_kb(
+                students[0].repo_folder_path()) if self.workers > 1 else None)
+        history.save()
+        return reports
+
+    def _snapshot_for_mutation_testing(self, student: Student):
+        """Copies the python files of each homework folder with student
+        tests as the student's link checks it out, since the next link that
+        shares the clone may check out a different branch
+        """
+        for assignment in self._assignments:
+            if assignment.student_test_file_name is None:
+                continue
+            hw_folder = os.path.join(student.repo_folder_path(), "hw",
+                                     assignment.hw_folder)
+            if not os.path.isfile(os.path.join(
+                    hw_folder, assignment.student_test_file_name)):
+                continue
+            # Named like the homework folder, which the mutation testing
+            # sandbox mirrors
+            snapshot = os.path.join(
+                tempfile.mkdtemp(dir=self._mutation_snapshots_dir),
+                assignment.hw_folder)
+            os.mkdir(snapshot)
+            for file_path in glob.glob(os.path.join(hw_folder, "*.py")):
+                shutil.copy(file_path, snapshot)
+            self._mutation_snapshots.setdefault(assignment.hw_folder, {})[
+                student.gh_link.orig_link()] = snapshot
+
+    def _mutation_test_students(self):
+        """Mutation tests the student-written tests of every assignment that
+        has them and adds the kill scores to the per-student results
+        """
+        try:
+            from .mutation import mutation_test
+        except ImportError:
+            from mutation import mutation_test
+
+        hw_root_dir = os.path.dirname(self.local_hw_folder_path)
+        for assignment in self._assignments:
+            if assignment.student_test_file_name is None:
+                continue
+            solution_paths = glob.glob(os.path.join(
+                hw_root_dir, assignment.hw_folder, "*_solution.py"))
+            if len(solution_paths) != 1:
+                print("Skipping mutation testing of {}: expected exactly one "
+                      "*_solution.py file in its folder, found {}".format(
+                          assignment.hw_folder, len(solution_paths)))
+                continue
+
+            # Keyed by link, since links to different branches of a
+            # repository can have different tests
+            scores = mutation_test(
+                solution_paths[0],
+                os.path.join(self.history_dir, assignment.hw_folder,
+                             "mutants"),
+                self._mutation_snapshots.get(assignment.hw_folder, {}),
+                assignment.student_test_file_name, self.mutation_workers)
+
+            for student in self._students:
+                score = scores.get(student.gh_link.orig_link())
+                if score is None:
+                    continue
+                i = self._result_index[id(student)]
+                self._results[i]["mutation"][assignment.hw_folder] = \
+                    score.to_dict()
+                self._results[i]["report"] += " | {}{}".format(
+                    "{}: ".format(assignment.hw_folder) if
+                    len(self._assignments) > 1 else "", score.__repr__())
+                self._report[i] = self._results[i]["report"]
+
+    def failure_index_path(self, hw_dir_name: Union[str, None] = None) -> \
+            str:
+        """Path of the failure index report of a homework folder (by default,
+        the one given to the constructor)
+        """
+        return os.path.join(self.autograding_dir,
+                            "{}_failure_index.txt".format(
+                                hw_dir_name or self.hw_dir_name))
+
+    def _index_failures(self):
+        """Groups the teacher test failures of every student by signature and
+        writes a report of the groups for each homework folder
+        """
+        for hw_dir_name in self.hw_dir_names():
+            failure_index = FailureIndex()
+            if self.submission_type == FILE_SUBMISSION:
+                for result in self._results:
+                    results_path = os.path.join(
+                        self.test_results_dir, "{}_teacher_tests.txt".format(
+                            result["student"]))
+                    if os.path.isfile(results_path):
+                        failure_index.add_file(result["student"],
+                                               results_path)
+            else:
+                # Keyed by link, since a student can submit several links
+                # (e.g., to different branches of their repository)
+                for result in self._results:
+                    results_text = self._teacher_test_results.get(
+                        result["link"], {}).get(hw_dir_name)
+                    if results_text is not None:
+                        failure_index.add(result["link"], results_text)
+            with open(self.failure_index_path(hw_dir_name), 'w') as \
+                    failure_index_file:
+                failure_index_file.write(failure_index.report())
+            self._failure_indexes[hw_dir_name] = failure_index
+
+    def failure_index(self, hw_dir_name: Union[str, None] = None) -> \
+            Union[FailureIndex, None]:
+        """Teacher test failures of the latest run grouped by signature, for
+        a homework folder (by default, the one given to the constructor)
+        """
+        return self._failure_indexes.get(hw_dir_name or self.hw_dir_name)
+
+    def _run_file_submissions(self):
+        # Only needed for file submissions, so only imported for them
+        try:
+            from .autograde_file_submission import run_file_submission_tests
+        except ImportError:
+            from autograde_file_submission import run_file_submission_tests
+
+        file_results = run_file_submission_tests(
+            self.submissions_dir, self.local_hw_folder_path,
+            self.test_results_dir)
+        for student, acquired in file_results.items():
+            tested_without_failure = acquired["student_tests"] and \
+                acquired["teacher_tests"]
+            report = "Testing for {}: {}".format(
+                student, "SUCCESS" if tested_without_failure else
+                "Could not acquire the output of all tests")
+            self._report.append(report)
+            self._results.append({
+                "student": student,
+                "link": "",
+                "report": report,
+                "tested_without_failure": tested_without_failure,
+                "pushed_successfully": False,
+                "results_dir": self.test_results_dir,
+                "results_dirs": [self.test_results_dir],
+                "coverage": {},
+                "mutation": {},
+            })
+
+    def push_only(self) -> List[Dict[str, Union[str, bool]]]:
+        """Commits and pushes the results that are already in the students'
+        repositories without running any tests (link submissions only).
+        Results that were already pushed are not pushed again, so this can
+        be rerun to push only what is still outstanding.
+
+        Returns:
+            Per-student results (see `results`)
+        """
+        if self.submission_type != LINK_SUBMISSION:
+            raise Exception("Only link submissions can have their results "
+                            "pushed")
+        self._check_submissions_dir()
+        self._report = []
+        self._results = []
+        self._failure_indexes = {}
+        self._teacher_test_results = {}
+
+        push_queue = self._make_push_queue()
+        try:
+            self._resolve_students()
+            for student in self._students:
+                try:
+                    student.sync_repo()
+                    self._commit_and_queue_push(student, push_queue)
+                except Exception as ex:
+                    push_queue.record_failure(student, str(ex))
+                self._record_student_result(student, "For {}: ".format(
+                    student.__repr__()))
+            self._finish_pushes(push_queue, True)
+        finally:
+            # Waits for the pushes queued before an error (does nothing if
+            # they were already finished)
+            push_queue.close()
+        return self.results()
+
+    def students(self) -> List[Student]:
+        return list(self._students)
+
+    def failed_links(self) -> List[str]:
+        return list(self._failed_for)
+
+    def report(self) -> List[str]:
+        return list(self._report)
+
+    def results(self) -> List[Dict[str, Union[str, bool]]]:
+        """Per-student results of the latest run, each a dictionary with the
+        keys 'student', 'link', 'report', 'tested_without_failure',
+        'pushed_successfully', 'results_dir' (of the homework folder given to
+        the constructor), 'results_dirs' (of every graded homework folder),
+        'coverage' (coverage reports by homework folder, if measured), and
+        'mutation' (mutation scores by homework folder, if measured)
+        """
+        return [dict(result) for result in self._results]
+
+    def summary(self) -> str:
+        """Human-readable summary of the latest run, as printed by the
+        scripts
+        """
+        summary = "\n--------\nSummary:"
+        if len(self._report) > 0:
+            summary += "\n" + "\n".join(self._report)
+        for hw_dir_name, failure_index in self._failure_indexes.items():
+            summary += "\n\n{}{}\n(representative outputs are in {})".format(
+                "{}: ".format(hw_dir_name) if len(self._failure_indexes) > 1
+                else "", failure_index.summary(),
+                self.failure_index_path(hw_dir_name))
+        if len(self._push_report) > 0:
+            summary += "\n\n" + self._push_report
+        if len(self._failed_for) > 0:
+            summary += "\n\nCould not proceed with repository cloning for " \
+                       "any of the following submitted links:\n{}".format(
+                            "\n".join(self._failed_for))
+        return summary
@@ -0,0 +1,395 @@
+"""
+Score how strong students' own tests are by mutation testing
+
+Mutants of a homework's solution are generated once (and cached by the hash
+of the solution), and each student's tests are run against every mutant that
+their tests reach. A mutant is killed if the student's tests fail against
+it; the fraction of mutants killed is the student's kill score.
+"""
+
+import ast
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+__author__ = "Duncan Mazza"
+
+KILLED: str = "killed"
+SURVIVED: str = "survived"
+NOT_REACHED: str = "not reached"
+
+_MUTANT_TIMEOUT_S: float = 30
+
+_BINARY_OP_SWAPS = {
+    ast.Add: ast.Sub,
+    ast.Sub: ast.Add,
+    ast.Mult: ast.Add,
+    ast.Div: ast.Mult,
+    ast.FloorDiv: ast.Mult,
+    ast.Mod: ast.FloorDiv,
+}
+_COMPARE_OP_SWAPS = {
+    ast.Lt: ast.LtE,
+    ast.LtE: ast.Lt,
+    ast.Gt: ast.GtE,
+    ast.GtE: ast.Gt,
+    ast.Eq: ast.NotEq,
+    ast.NotEq: ast.Eq,
+    ast.Is: ast.IsNot,
+    ast.IsNot: ast.Is,
+    ast.In: ast.NotIn,
+    ast.NotIn: ast.In,
+}
+_BOOL_OP_SWAPS = {
+    ast.And: ast.Or,
+    ast.Or: ast.And,
+}
+
+
+class Mutant:
+    """A copy of the solution with a single change"""
+
+    def __init__(self, mutant_id: int, line: int, description: str,
+                 source: str):
+        self.mutant_id: int = mutant_id
+        self.line: int = line
+        self.description: str = description
+        self.source: str = source
+
+    def to_dict(self) -> Dict[str, Union[int, str]]:
+        return {"mutant_id": self.mutant_id, "line": self.line,
+                "description": self.description, "source": self.source}
+
+    def __repr__(self):
+        return "mutant {} (line {}: {})".format(self.mutant_id, self.line,
+                                                self.description)
+
+
+def _mutations_of(node: ast.AST) -> List[Tuple[str, object]]:
+    """Mutations that can be applied to a node, as (description,
+    replacement) pairs
+    """
+    mutations: List[Tuple[str, object]] = []
+    if isinstance(node, (ast.BinOp, ast.AugAssign)) and \
+            type(node.op) in _BINARY_OP_SWAPS:
+        replacement = _BINARY_OP_SWAPS[type(node.op)]
+        mutations.append(("{} -> {}".format(type(node.op).__name__,
+                                            replacement.__name__),
+                          replacement))
+    elif isinstance(node, ast.BoolOp):
+        replacement = _BOOL_OP_SWAPS[type(node.op)]
+        mutations.append(("{} -> {}".format(type(node.op).__name__,
+                                            replacement.__name__),
+                          replacement))
+    elif isinstance(node, ast.Compare):
+        for i, op in enumerate(node.ops):
+            if type(op) in _COMPARE_OP_SWAPS:
+                replacement = _COMPARE_OP_SWAPS[type(op)]
+                mutations.append(("{} -> {}".format(type(op).__name__,
+                                                    replacement.__name__),
+                                  (i, replacement)))
+    elif isinstance(node, ast.Constant) and type(node.value) is int:
+        mutations.append(("{} -> {}".format(node.value, node.value + 1),
+                          node.value + 1))
+        mutations.append(("{} -> {}".format(node.value, node.value - 1),
+                          node.value - 1))
+    elif isinstance(node, ast.Return) and node.value is not None and not (
+            isinstance(node.value, ast.Constant) and node.value.value is None):
+        mutations.append(("return value removed", None))
+    return mutations
+
+
+def _apply_mutation(node: ast.AST, replacement: object):
+    if isinstance(node, (ast.BinOp, ast.AugAssign, ast.BoolOp)):
+        node.op = replacement()
+    elif isinstance(node, ast.Compare):
+        i, op = replacement
+        node.ops[i] = op()
+    elif isinstance(node, ast.Constant):
+        node.value = replacement
+    elif isinstance(node, ast.Return):
+        node.value = None
+
+
+def _docstring_nodes(tree: ast.AST) -> set:
+    docstrings = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.FunctionDef,
+                             ast.AsyncFunctionDef, ast.ClassDef)) and \
+                len(node.body) > 0 and isinstance(node.body[0], ast.Expr) \
+                and isinstance(node.body[0].value, ast.Constant):
+            docstrings.add(id(node.body[0].value))
+    return docstrings
+
+
+def generate_mutants(source: str) -> List[Mutant]:
+    """Generates every single-change mutant of a module: swapped arithmetic,
+    comparison, and boolean operators, integer constants off by one, and
+    removed return values.
+
+    Args:
+        source: Source of the module (e.g., a homework solution)
+
+    Returns:
+        Mutants that still compile, in the order of the changes in the source
+    """
+    tree = ast.parse(source)
+    skipped = _docstring_nodes(tree)
+    # Annotations are never evaluated by the tests, so do not mutate them
+    for node in ast.walk(tree):
+        for annotation in [getattr(node, "annotation", None),
+                           getattr(node, "returns", None)]:
+            if annotation is not None:
+                skipped.update(id(sub_node) for sub_node in
+                               ast.walk(annotation))
+
+    sites: List[Tuple[int, int, str, object]] = []
+    for node_index, node in enumerate(ast.walk(tree)):
+        if id(node) in skipped or not hasattr(node, "lineno"):
+            continue
+        for description, replacement in _mutations_of(node):
+            sites.append((node_index, node.lineno, description, replacement))
+    sites.sort(key=lambda site: (site[1], site[0]))
+
+    mutants: List[Mutant] = []
+    for node_index, line, description, replacement in sites:
+        # Mutate a fresh copy of the tree, finding the node by its position
+        # in the (deterministic) walk order
+        mutant_tree = ast.parse(source)
+        for i, node in enumerate(ast.walk(mutant_tree)):
+            if i == node_index:
+                _apply_mutation(node, replacement)
+                break
+        mutant_source = ast.unparse(mutant_tree)
+        try:
+            compile(mutant_source, "<mutant>", "exec")
+        except SyntaxError:
+            continue
+        mutants.append(Mutant(len(mutants), line, description,
+                              mutant_source))
+    return mutants
+
+
+def load_or_generate_mutants(solution_path: str,
+                             cache_dir: str) -> List[Mutant]:
+    """Loads the mutants of a solution from the cache, generating (and
+    caching) them if the solution changed since they were last generated.
+    """
+    with open(solution_path, 'r') as solution_file:
+        source = solution_file.read()
+    solution_hash = hashlib.sha256(source.encode()).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, "mutants_{}.json".format(
+        solution_hash))
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'r') as cache_file:
+            return [Mutant(**mutant) for mutant in json.load(cache_file)]
+
+    mutants = generate_mutants(source)
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale_cache_path in glob.glob(os.path.join(cache_dir,
+                                                   "mutants_*.json")):
+        os.remove(stale_cache_path)
+    with open(cache_path, 'w') as cache_file:
+        json.dump([mutant.to_dict() for mutant in mutants], cache_file)
+    return mutants
+
+
+def _run_student_tests(student_hw_folder: str, student_test_file_name: str,
+                       module_file_name: str, module_source: str,
+                       coverage: bool) -> Tuple[int, Union[List[int], None]]:
+    """Runs a student's tests, stopping at the first failure, against a
+    sandbox copy of their homework folder in which their module is replaced.
+
+    Runs in a worker process of the mutation testing pool.
+
+    Returns:
+        Pytest's exit code (or -1 on timeout) and, if requested, the lines of
+         the module the tests executed
+    """
+    sandbox = tempfile.mkdtemp(prefix="mutant_")
+    try:
+        # Mirror the layout of the student's repository so that the tests'
+        # imports resolve the same way as when they are graded
+        sandbox_hw_folder = os.path.join(
+            sandbox, "hw", os.path.basename(student_hw_folder))
+        os.makedirs(sandbox_hw_folder)
+        with open(os.path.join(sandbox, "hw", "__init__.py"), 'w'):
+            pass
+        for file_path in glob.glob(os.path.join(student_hw_folder, "*.py")):
+            if os.path.basename(file_path) != "teacher_tests.py":
+                shutil.copy(file_path, sandbox_hw_folder)
+        with open(os.path.join(sandbox_hw_folder, module_file_name),
+                  'w') as module_file:
+            module_file.write(module_source)
+
+        command = [sys.executable, "-m", "pytest", "-x", "-q",
+                   "-p", "no:cacheprovider", "--timeout=5",
+                   student_test_file_name]
+        env = None
+        if coverage:
+            command += ["-p", "student_coverage",
+                        "--student-cov=" + module_file_name,
+                        "--student-cov-report=coverage.json"]
+            env = dict(os.environ)
+            env["PYTHONPATH"] = os.pathsep.join(
+                [os.path.dirname(os.path.realpath(__file__))] +
+                ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+        try:
+            returncode = subprocess.run(
+                command, cwd=sandbox_hw_folder, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, timeout=_MUTANT_TIMEOUT_S, env=env
+            ).returncode
+        except subprocess.TimeoutExpired:
+            return -1, None
+
+        covered_lines: Union[List[int], None] = None
+        coverage_path = os.path.join(sandbox_hw_folder, "coverage.json")
+        if coverage and os.path.isfile(coverage_path):
+            with open(coverage_path, 'r') as coverage_file:
+                coverage_report = json.load(coverage_file)
+            if "error" not in coverage_report:
+                covered_lines = _covered_lines(module_source,
+                                               coverage_report)
+        return returncode, covered_lines
+    finally:
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+
+def _covered_lines(module_source: str, coverage_report: dict) -> List[int]:
+    try:
+        from .student_coverage import executable_lines
+    except ImportError:
+        from student_coverage import executable_lines
+    return sorted(executable_lines(module_source, "<solution>") -
+                  set(coverage_report["missing_lines"]))
+
+
+def _statement_lines(source: str) -> Dict[int, int]:
+    """Maps every line of a module to the first line of the innermost
+    statement containing it, so that a mutant of any part of a multi-line
+    statement counts as reached if the statement ran
+    """
+    statement_lines: Dict[int, int] = {}
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.stmt):
+            for line in range(node.lineno, (node.end_lineno or node.lineno)
+                              + 1):
+                if line not in statement_lines or \
+                        statement_lines[line] < node.lineno:
+                    statement_lines[line] = node.lineno
+    return statement_lines
+
+
+class MutationScore:
+    """Outcome of mutation testing one student's tests"""
+
+    def __init__(self, student: str):
+        self.student: str = student
+        self.baseline_passed: bool = False
+        self.outcomes: Dict[int, str] = {}
+
+    def killed(self) -> int:
+        return list(self.outcomes.values()).count(KILLED)
+
+    def not_reached(self) -> int:
+        return list(self.outcomes.values()).count(NOT_REACHED)
+
+    def kill_score(self) -> Union[float, None]:
+        if not self.baseline_passed or len(self.outcomes) == 0:
+            return None
+        return self.killed() / len(self.outcomes)
+
+    def to_dict(self) -> Dict[str, Union[str, bool, float, None,
+                                         Dict[str, str]]]:
+        return {"student": self.student,
+                "baseline_passed": self.baseline_passed,
+                "kill_score": self.kill_score(),
+                "outcomes": {str(mutant_id): outcome for mutant_id, outcome
+                             in self.outcomes.items()}}
+
+    def __repr__(self):
+        if not self.baseline_passed:
+            return "Student tests do not pass against the solution, so " \
+                   "they could not be mutation tested"
+        return "Student tests kill {}/{} mutants ({} not reached)".format(
+            self.killed(), len(self.outcomes), self.not_reached())
+
+
+def mutation_test(solution_path: str, cache_dir: str,
+                  student_hw_folders: Dict[str, str],
+                  student_test_file_name: str,
+                  workers: Union[int, None] = None) -> \
+        Dict[str, MutationScore]:
+    """Runs every student's tests against every mutant of the solution.
+
+    Each student's tests are first run against the unmutated solution to
+    check that they pass and to measure which lines they reach; mutants on
+    lines that are never reached count as surviving without being run. Runs
+    are spread over a process pool and stop at the first failing test.
+
+    Args:
+        solution_path: Path to the solution (e.g., 'hw/hw_2/hw2_solution.py');
+         the students' module is assumed to have the same name without the
+         '_solution' suffix
+        cache_dir: Folder to cache the solution's mutants in
+        student_hw_folders: Homework folder of each student's repository
+        student_test_file_name: File in the students' homework folders that
+         contains their tests
+        workers: Number of worker processes (defaults to the CPU count)
+
+    Returns:
+        Mutation score of each student
+    """
+    module_file_name = os.path.basename(solution_path).replace(
+        "_solution.py", ".py")
+    with open(solution_path, 'r') as solution_file:
+        solution_source = solution_file.read()
+    mutants = load_or_generate_mutants(solution_path, cache_dir)
+    statement_lines = _statement_lines(solution_source)
+    print("Mutation testing {} student(s) against {} mutant(s) of {}".format(
+        len(student_hw_folders), len(mutants), solution_path))
+
+    scores: Dict[str, MutationScore] = {
+        student: MutationScore(student) for student in student_hw_folders}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        baseline_futures = {
+            student: executor.submit(_run_student_tests, hw_folder,
+                                     student_test_file_name, module_file_name,
+                                     solution_source, True)
+            for student, hw_folder in student_hw_folders.items()}
+
+        mutant_futures = {}
+        for student, baseline_future in baseline_futures.items():
+            returncode, covered_lines = baseline_future.result()
+            scores[student].baseline_passed = returncode == 0
+            if not scores[student].baseline_passed:
+                continue
+            reached_statements = None if covered_lines is None else \
+                {statement_lines.get(line, line) for line in covered_lines}
+            for mutant in mutants:
+                if reached_statements is not None and statement_lines.get(
+                        mutant.line, mutant.line) not in reached_statements:
+                    scores[student].outcomes[mutant.mutant_id] = NOT_REACHED
+                    continue
+                mutant_futures[(student, mutant.mutant_id)] = \
+                    executor.submit(_run_student_tests,
+                                    student_hw_folders[student],
+                                    student_test_file_name, module_file_name,
+                                    mutant.source, False)
+
+        for (student, mutant_id), future in mutant_futures.items():
+            returncode, _ = future.result()
+            # Exit code 1 means a test failed; other non-zero codes (e.g.,
+            # the mutant broke importing the module, or a test timed out)
+            # also mean the tests noticed the mutant, except for 5, which
+            # means no tests were collected
+            scores[student].outcomes[mutant_id] = KILLED if \
+                returncode not in (0, 5) else SURVIVED
+    return scores
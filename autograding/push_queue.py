@@ -0,0 +1,219 @@
+"""
+Push committed test results to student repositories in the background
+"""
+
+import queue
+import random
+import threading
+import time
+from typing import Dict, List, Union
+
+__author__ = "Duncan Mazza"
+
+PUSHED: str = "pushed"
+ALREADY_PUSHED: str = "already pushed"
+FAILED: str = "failed"
+
+
+class PushOutcome:
+    """What happened when pushing one student's results"""
+
+    def __init__(self, student):
+        self.student = student
+        self.status: Union[str, None] = None
+        self.attempts: int = 0
+        self.error: str = ""
+        self._done = threading.Event()
+
+    def succeeded(self) -> bool:
+        return self.status in (PUSHED, ALREADY_PUSHED)
+
+    def wait(self):
+        """Waits until the push succeeded or was given up on"""
+        self._done.wait()
+
+    def to_dict(self) -> Dict[str, Union[str, int, None]]:
+        return {"status": self.status, "attempts": self.attempts,
+                "error": self.error}
+
+    def __repr__(self):
+        if self.status == FAILED:
+            return "{}: {} after {} attempt(s) due to error: {}".format(
+                self.student.__repr__(), self.status, self.attempts,
+                self.error)
+        return "{}: {}".format(self.student.__repr__(), self.status)
+
+
+class _RateLimiter:
+    """Spaces out calls to `wait` so that at most `max_per_minute` of them
+    return per minute, across all threads
+    """
+
+    def __init__(self, max_per_minute: Union[float, None]):
+        self._interval_s: float = 0.0 if max_per_minute is None else \
+            60.0 / max_per_minute
+        self._next_slot: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self._interval_s == 0.0:
+            return
+        with self._lock:
+            slot = max(self._next_slot, time.monotonic())
+            self._next_slot = slot + self._interval_s
+        time.sleep(max(0.0, slot - time.monotonic()))
+
+
+class PushQueue:
+    """Pushes students' committed results from a pool of background threads
+    so that testing does not wait on the remote.
+
+    Pushes are rate limited, and failed pushes are retried with exponential
+    backoff. Each push goes through `Student.push_committed_results`, which
+    does nothing if the results were already pushed, so a student can safely
+    be submitted again by a later run.
+
+    Example:
+        push_queue = PushQueue(concurrency=4, max_pushes_per_minute=30)
+        push_queue.start()
+        for student in students:
+            student.commit_results(["hw_2"])
+            push_queue.submit(student)
+        push_queue.close()
+        print(push_queue.reconciliation_report())
+    """
+
+    def __init__(self, concurrency: int = 4,
+                 max_pushes_per_minute: Union[float, None] = None,
+                 max_attempts: int = 4, backoff_base_s: float = 2.0):
+        """
+        Args:
+            concurrency: Number of pushes that may be in flight at once
+            max_pushes_per_minute: Limit on how many push attempts (including
+             retries) are started per minute; None for no limit
+            max_attempts: Number of times a push is attempted before it is
+             reported as failed
+            backoff_base_s: Delay before the first retry; each following
+             retry waits twice as long (plus jitter)
+        """
+        if concurrency < 1:
+            raise Exception("Push concurrency must be at least 1")
+        if max_attempts < 1:
+            raise Exception("Push attempts must be at least 1")
+        self._concurrency: int = concurrency
+        self._max_attempts: int = max_attempts
+        self._backoff_base_s: float = backoff_base_s
+        self._rate_limiter = _RateLimiter(max_pushes_per_minute)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._outcomes: List[PushOutcome] = []
+        self._outcomes_lock = threading.Lock()
+
+    def start(self):
+        for _ in range(self._concurrency):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, student) -> PushOutcome:
+        """Queues a student whose results have been committed for pushing"""
+        outcome = PushOutcome(student)
+        with self._outcomes_lock:
+            self._outcomes.append(outcome)
+        self._queue.put(outcome)
+        return outcome
+
+    def record_failure(self, student, error: str) -> PushOutcome:
+        """Records a student whose results could not even be committed, so
+        that they show up as outstanding in the reconciliation report
+        """
+        return self.record_outcome(student, FAILED, 0, error)
+
+    def record_outcome(self, student, status: str, attempts: int = 0,
+                       error: str = "") -> PushOutcome:
+        """Records the outcome of a push made elsewhere (e.g., by a
+        distributed worker) for the reconciliation report
+        """
+        outcome = PushOutcome(student)
+        outcome.status = status
+        outcome.attempts = attempts
+        outcome.error = error
+        outcome._done.set()
+        with self._outcomes_lock:
+            self._outcomes.append(outcome)
+        return outcome
+
+    def close(self) -> List[PushOutcome]:
+        """Waits for every queued push to finish (or give up). Closing a
+        queue that is already closed does nothing.
+
+        Returns:
+            Outcomes in the order the students were submitted
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return self.outcomes()
+
+    def _work(self):
+        while True:
+            outcome = self._queue.get()
+            if outcome is None:
+                return
+            self._push(outcome)
+
+    def _push(self, outcome: PushOutcome):
+        try:
+            self._attempt_push(outcome)
+        finally:
+            outcome._done.set()
+
+    def _attempt_push(self, outcome: PushOutcome):
+        while outcome.attempts < self._max_attempts:
+            if outcome.attempts > 0:
+                backoff_s = self._backoff_base_s * 2 ** (outcome.attempts - 1)
+                time.sleep(backoff_s + random.uniform(0, backoff_s / 2))
+            self._rate_limiter.wait()
+            outcome.attempts += 1
+            try:
+                pushed = outcome.student.push_committed_results()
+                outcome.status = PUSHED if pushed else ALREADY_PUSHED
+                outcome.error = ""
+                print("{} results for {}".format(
+                    "Pushed" if pushed else "Already pushed",
+                    outcome.student.__repr__()))
+                return
+            except Exception as ex:
+                outcome.error = str(ex)
+                print("Attempt {} of {} to push results for {} failed due "
+                      "to error: {}".format(outcome.attempts,
+                                            self._max_attempts,
+                                            outcome.student.__repr__(), ex))
+        outcome.status = FAILED
+
+    def outcomes(self) -> List[PushOutcome]:
+        with self._outcomes_lock:
+            return list(self._outcomes)
+
+    def reconciliation_report(self) -> str:
+        """Summary of which students' results were pushed, were already
+        pushed, or are still outstanding
+        """
+        by_status: Dict[str, List[PushOutcome]] = {
+            PUSHED: [], ALREADY_PUSHED: [], FAILED: []}
+        for outcome in self.outcomes():
+            if outcome.status in by_status:
+                by_status[outcome.status].append(outcome)
+
+        report = "Push reconciliation: {} pushed, {} already up to date, {} " \
+                 "still outstanding".format(len(by_status[PUSHED]),
+                                            len(by_status[ALREADY_PUSHED]),
+                                            len(by_status[FAILED]))
+        if len(by_status[FAILED]) > 0:
+            report += "\nStill outstanding (rerun with --push-only to " \
+                      "retry):\n" + "\n".join(
+                          [outcome.__repr__() for outcome in
+                           by_status[FAILED]])
+        return report
@@ -0,0 +1,49 @@
+"""
+Patterns for reading the output of `pytest -v`, shared by the modules that
+parse it (regrade.py, sharding.py, and failure_index.py)
+"""
+
+import re
+
+__author__ = "Duncan Mazza"
+
+# Per-test line, e.g.:
+# "teacher_tests.py::test_sort[case0] PASSED                 [ 50%]"
+# Only the start is matched, since the lines of a regrade's merged report
+# have no progress percentage (see `PROGRESS_RX` for the rest of the line).
+# The node id ends at the outcome, since parameter ids may contain spaces.
+OUTCOME_LINE_RX = re.compile(r"^(\S+\.py::.+?) (PASSED|FAILED|ERROR|SKIPPED|"
+                             r"XFAIL|XPASS)\b")
+# Rest of a per-test line after its outcome: anything pytest adds to the
+# outcome (e.g., an xfail reason), then the progress percentage
+PROGRESS_RX = re.compile(r"^(.*?)\s*\[\s*\d+%\]$")
+# Banner of a section of the report, e.g. '===== FAILURES ====='
+SECTION_RX = re.compile(r"^=+ (.+?) =+$")
+# Header of one test's entry in the FAILURES or ERRORS section, e.g.
+# '_____ test_add _____' or '_____ ERROR at setup of test_add _____'
+ENTRY_RX = re.compile(r"^_{3,} (.+?) _{3,}$")
+
+
+def node_test_id(node_id: str) -> str:
+    """Test id of a pytest node id: the part after the file path (e.g.,
+    'test_sort[case0]' for 'teacher_tests.py::test_sort[case0]'). Tests are
+    identified without their file path because it is relative to pytest's
+    rootdir, which differs between student repositories.
+    """
+    return node_id.split("::", 1)[-1]
+
+
+def entry_test_id(entry_title: str) -> str:
+    """Test id of an entry of the FAILURES or ERRORS section, given its
+    title
+    """
+    for prefix in ("ERROR at setup of ", "ERROR at teardown of "):
+        if entry_title.startswith(prefix):
+            entry_title = entry_title[len(prefix):]
+    if entry_title.startswith("ERROR "):
+        # e.g., 'ERROR collecting teacher_tests.py'
+        return entry_title[len("ERROR "):]
+    # Tests in classes are titled 'TestClass.test_method'; parameter ids in
+    # brackets may contain dots of their own
+    name, bracket, params = entry_title.partition("[")
+    return name.replace(".", "::") + bracket + params
@@ -0,0 +1,289 @@
+"""
+Work out which teacher tests need to be rerun when regrading a submission
+"""
+
+import ast
+import os
+from typing import Dict, List, Set, Tuple, Union
+
+try:
+    from .pytest_output import OUTCOME_LINE_RX, node_test_id
+except ImportError:
+    # Run as a script from the autograding directory
+    from pytest_output import OUTCOME_LINE_RX, node_test_id
+
+__author__ = "Duncan Mazza"
+
+FAILING_OUTCOMES: Tuple[str, ...] = ("FAILED", "ERROR")
+
+TEACHER_TESTS_SNAPSHOT_NAME: str = "teacher_tests.py"
+RESULTS_SNAPSHOT_NAME: str = "teacher_test_results.txt"
+CODE_SNAPSHOT_NAME: str = "student_code_fingerprint.txt"
+
+
+def parse_pytest_outcomes(results_text: str) -> Dict[str, str]:
+    """Parses the per-test outcomes out of the output of `pytest -v`.
+
+    Args:
+        results_text: Text that pytest printed when run with the -v flag
+
+    Returns:
+        Dictionary (in the order the tests were reported) that maps each
+         test's id (see `pytest_output.node_test_id`) to its outcome (e.g.,
+         'PASSED')
+    """
+    outcomes: Dict[str, str] = {}
+    for line in results_text.splitlines():
+        match_obj = OUTCOME_LINE_RX.match(line)
+        if match_obj is None:
+            continue
+        test_id = node_test_id(match_obj.group(1))
+        # A test that passes but errors during teardown is reported twice;
+        # the failing outcome is the one that matters
+        if outcomes.get(test_id) in FAILING_OUTCOMES:
+            continue
+        outcomes[test_id] = match_obj.group(2)
+    return outcomes
+
+
+def _top_level_name(test_id: str) -> str:
+    return test_id.split("::")[0].split("[")[0]
+
+
+def _names_defined_by(node: ast.stmt) -> List[str]:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                         ast.ClassDef)):
+        return [node.name]
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return [(alias.asname or alias.name).split(".")[0]
+                for alias in node.names if alias.name != "*"]
+    targets: List[ast.expr] = []
+    if isinstance(node, ast.Assign):
+        targets = node.targets
+    elif isinstance(node, (ast.AnnAssign, ast.AugAssign)):
+        targets = [node.target]
+    names: List[str] = []
+    for target in targets:
+        for sub_node in ast.walk(target):
+            if isinstance(sub_node, ast.Name):
+                names.append(sub_node.id)
+    return names
+
+
+def _names_referenced_by(node: ast.stmt) -> Set[str]:
+    referenced: Set[str] = set()
+    for sub_node in ast.walk(node):
+        if isinstance(sub_node, ast.Name):
+            referenced.add(sub_node.id)
+        elif isinstance(sub_node, ast.arg):
+            # Test function arguments name the fixtures the test depends on
+            referenced.add(sub_node.arg)
+    return referenced
+
+
+class _TestModuleUnits:
+    """Top-level statements of a test module, keyed by the names they define.
+
+    Statements that do not define a name (e.g., a bare function call) are
+    kept in order in `unnamed`; if those differ between two versions of a
+    module, every test has to be assumed to be affected.
+    """
+
+    def __init__(self, source: str):
+        self.dumps: Dict[str, str] = {}
+        self.references: Dict[str, Set[str]] = {}
+        self.unnamed: List[str] = []
+
+        for node in ast.parse(source).body:
+            names = _names_defined_by(node)
+            if len(names) == 0:
+                self.unnamed.append(ast.dump(node))
+                continue
+            # ast.dump omits line numbers, so code that only moved within the
+            # file is not considered changed
+            node_dump = ast.dump(node)
+            node_references = _names_referenced_by(node)
+            for name in names:
+                self.dumps[name] = self.dumps.get(name, "") + node_dump
+                self.references.setdefault(name, set()).update(
+                    node_references)
+
+    def test_names(self) -> List[str]:
+        return [name for name in self.dumps if name.startswith("test") or
+                name.startswith("Test")]
+
+
+def changed_top_level_names(old_source: str, new_source: str) -> \
+        Union[Set[str], None]:
+    """Finds the top-level names of a test module whose behavior may have
+    changed between two versions of it.
+
+    A name is considered changed if its definition differs, if it was added or
+    removed, or if it (transitively) references a changed name; test function
+    arguments count as references so that changed fixtures propagate.
+
+    Args:
+        old_source: Source of the previous version of the test module
+        new_source: Source of the current version of the test module
+
+    Returns:
+        Set of changed names, or None if a change was made that cannot be
+         attributed to any name (in which case all tests should be rerun)
+    """
+    old_units = _TestModuleUnits(old_source)
+    new_units = _TestModuleUnits(new_source)
+    if old_units.unnamed != new_units.unnamed:
+        return None
+
+    changed: Set[str] = {
+        name for name in set(old_units.dumps) | set(new_units.dumps)
+        if old_units.dumps.get(name) != new_units.dumps.get(name)
+    }
+    grew = True
+    while grew:
+        grew = False
+        for name, references in new_units.references.items():
+            if name not in changed and len(references & changed) > 0:
+                changed.add(name)
+                grew = True
+    return changed
+
+
+class RegradePlan:
+    """Decides which teacher tests to rerun for one student and merges the
+    rerun's results back into the previous report.
+
+    Tests are rerun if they failed or errored in the previous run, if their
+    source (or the source of anything they use) changed between the previous
+    and current versions of the teacher tests, or if the previous results
+    have no outcome for them (e.g., the previous run was cut short). If the
+    student's code changed since the previous run, no outcome can be carried
+    over.
+    """
+
+    def __init__(self, prev_results_text: str, prev_teacher_tests_text: str,
+                 teacher_tests_text: str,
+                 test_file_name: str = "teacher_tests.py",
+                 code_changed: bool = False):
+        self._test_file_name: str = test_file_name
+        self._prev_outcomes: Dict[str, str] = parse_pytest_outcomes(
+            prev_results_text)
+        self._new_test_names: List[str] = \
+            _TestModuleUnits(teacher_tests_text).test_names()
+        self._changed_names: Union[Set[str], None] = changed_top_level_names(
+            prev_teacher_tests_text, teacher_tests_text)
+        self._rerun_all: bool = code_changed or \
+            self._changed_names is None or len(self._prev_outcomes) == 0
+
+        self._node_ids: List[str] = []
+        if self._rerun_all:
+            return
+        for test_id, outcome in self._prev_outcomes.items():
+            top_level_name = _top_level_name(test_id)
+            if top_level_name in self._changed_names or \
+                    top_level_name not in self._new_test_names:
+                continue
+            if outcome in FAILING_OUTCOMES:
+                self._node_ids.append(self._node_id(test_id))
+        recorded_names: Set[str] = {_top_level_name(test_id) for test_id
+                                    in self._prev_outcomes}
+        for name in self._new_test_names:
+            if name in self._changed_names or name not in recorded_names:
+                self._node_ids.append(self._node_id(name))
+
+    def _node_id(self, test_id: str) -> str:
+        return self._test_file_name + "::" + test_id
+
+    def rerun_all(self) -> bool:
+        """Whether the previous results cannot be reused at all (the
+        student's code changed, no per-test outcomes were recorded, or the
+        module changed in an untraceable way)
+        """
+        return bool(self._rerun_all)
+
+    def node_ids(self) -> List[str]:
+        """Pytest node ids (relative to the homework folder) to rerun"""
+        return list(self._node_ids)
+
+    def merge(self, rerun_results_text: Union[str, None]) -> str:
+        """Merges the output of rerunning `node_ids()` with the outcomes of
+        the tests that were carried over from the previous run.
+
+        Args:
+            rerun_results_text: Output of `pytest -v` for the rerun tests, or
+             None if no tests needed to be rerun
+
+        Returns:
+            Full report covering every test in the current teacher tests
+        """
+        rerun_outcomes: Dict[str, str] = {}
+        if rerun_results_text is not None:
+            rerun_outcomes = parse_pytest_outcomes(rerun_results_text)
+
+        report_lines: List[str] = []
+        num_carried_over = 0
+        for test_id, outcome in self._prev_outcomes.items():
+            top_level_name = _top_level_name(test_id)
+            if test_id in rerun_outcomes:
+                report_lines.append("{} {}".format(
+                    self._node_id(test_id), rerun_outcomes.pop(test_id)))
+            elif top_level_name in self._new_test_names and \
+                    top_level_name not in self._changed_names:
+                report_lines.append("{} {} (carried over from the previous "
+                                    "run)".format(self._node_id(test_id),
+                                                  outcome))
+                num_carried_over += 1
+        for test_id, outcome in rerun_outcomes.items():
+            report_lines.append("{} {}".format(self._node_id(test_id),
+                                               outcome))
+
+        header = "Regrade: {} test(s) rerun, {} carried over from the " \
+                 "previous run\n\n".format(
+                    len(report_lines) - num_carried_over, num_carried_over)
+        report = header + "\n".join(report_lines) + "\n"
+        if rerun_results_text is not None:
+            report += "\nOutput of the rerun tests:\n" + rerun_results_text
+        return report
+
+
+def load_regrade_history(student_history_dir: str) -> \
+        Union[Tuple[str, str, str], None]:
+    """Loads a student's teacher test results from their previous run along
+    with the teacher tests (as written into their repository) that produced
+    them and the fingerprint of the student's code they were run against, if
+    all three were recorded.
+
+    Args:
+        student_history_dir: Folder the student's results are kept in (see
+         `Student.regrade_history_dir`)
+
+    Returns:
+        Previous results, teacher tests, and code fingerprint, or None
+    """
+    paths = [os.path.join(student_history_dir, name) for name in
+             (RESULTS_SNAPSHOT_NAME, TEACHER_TESTS_SNAPSHOT_NAME,
+              CODE_SNAPSHOT_NAME)]
+    if not all(os.path.isfile(path) for path in paths):
+        return None
+    texts: List[str] = []
+    for path in paths:
+        with open(path, 'r') as snapshot_file:
+            texts.append(snapshot_file.read())
+    return texts[0], texts[1], texts[2]
+
+
+def save_regrade_history(student_history_dir: str, results_text: str,
+                         teacher_tests_text: str,
+                         code_fingerprint: str) -> None:
+    """Records a student's teacher test results together with the teacher
+    tests that produced them and the fingerprint of the student's code (see
+    `Student.hw_folder_fingerprint`), so that a later regrade can tell which
+    tests changed and whether any outcomes can be carried over.
+    """
+    os.makedirs(student_history_dir, exist_ok=True)
+    for name, text in ((RESULTS_SNAPSHOT_NAME, results_text),
+                       (TEACHER_TESTS_SNAPSHOT_NAME, teacher_tests_text),
+                       (CODE_SNAPSHOT_NAME, code_fingerprint)):
+        with open(os.path.join(student_history_dir, name), 'w') as \
+                snapshot_file:
+            snapshot_file.write(text)
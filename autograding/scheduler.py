@@ -0,0 +1,246 @@
+"""
+Schedule students across workers using how long they took in earlier runs
+"""
+
+import heapq
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple, Union
+
+__author__ = "Duncan Mazza"
+
+DURATIONS_FILE_NAME: str = "student_durations.json"
+
+# Weight of the latest run when updating a student's recorded duration
+_SMOOTHING: float = 0.5
+
+
+class GradingHistory:
+    """Per-student durations and repository sizes recorded by earlier runs,
+    kept in `<history_dir>/student_durations.json`
+    """
+
+    def __init__(self, history_dir: str):
+        self._path: str = os.path.join(history_dir, DURATIONS_FILE_NAME)
+        self._entries: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self._path):
+            with open(self._path, 'r') as durations_file:
+                self._entries = json.load(durations_file)
+
+    def duration_s(self, key: str) -> Union[float, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else entry.get("duration_s")
+
+    def repo_size_kb(self, key: str) -> Union[float, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else entry.get("repo_size_kb")
+
+    def record(self, key: str, duration_s: float,
+               repo_size_kb: Union[float, None] = None):
+        with self._lock:
+            entry = self._entries.setdefault(key, {})
+            if "duration_s" in entry:
+                duration_s = _SMOOTHING * duration_s + \
+                    (1 - _SMOOTHING) * entry["duration_s"]
+            entry["duration_s"] = duration_s
+            if repo_size_kb is not None:
+                entry["repo_size_kb"] = repo_size_kb
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with self._lock:
+            with open(self._path, 'w') as durations_file:
+                json.dump(self._entries, durations_file, indent=2,
+                          sort_keys=True)
+
+
+def local_repo_size_kb(repo_path: str) -> Union[float, None]:
+    """Size of a local clone (including its .git folder), or None if it has
+    not been cloned
+    """
+    if not os.path.isdir(repo_path):
+        return None
+    size_b = 0
+    for dir_path, _, file_names in os.walk(repo_path):
+        for file_name in file_names:
+            try:
+                size_b += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                pass
+    return size_b / 1024
+
+
+def github_repo_size_kb(bare_link: str,
+                        timeout: float = 3) -> Union[float, None]:
+    """Size that GitHub reports for a repository (e.g., 'dm/repo_name'), or
+    None if it could not be looked up
+    """
+    # Only needed when a repository was never cloned, so only imported then
+    import urllib.request
+    try:
+        with urllib.request.urlopen(
+                "https://api.github.com/repos/" + bare_link,
+                timeout=timeout) as response:
+            return float(json.loads(response.read())["size"])
+    except Exception:
+        return None
+
+
+def estimate_durations_s(
+        keys: List[str],
+        history: GradingHistory,
+        repo_sizes_kb: Dict[str, Union[float, None]]
+) -> Dict[str, float]:
+    """Estimates how long each student will take.
+
+    Students with recorded durations are expected to take as long as they
+    did before. Students without are estimated from their repository size,
+    scaled by the median seconds per kilobyte of the students that have both;
+    students with neither get the median recorded duration.
+
+    Args:
+        keys: Keys (repository folder names) of the students to estimate
+        history: Recorded durations
+        repo_sizes_kb: Current repository sizes, where known
+
+    Returns:
+        Estimated duration (in seconds) of each student
+    """
+    known_durations = [history.duration_s(key) for key in keys
+                       if history.duration_s(key) is not None]
+    default_duration_s = statistics.median(known_durations) if \
+        len(known_durations) > 0 else 1.0
+
+    s_per_kb_samples = []
+    for key in keys:
+        size_kb = repo_sizes_kb.get(key) or history.repo_size_kb(key)
+        if history.duration_s(key) is not None and size_kb:
+            s_per_kb_samples.append(history.duration_s(key) / size_kb)
+    known_sizes = [size_kb for size_kb in repo_sizes_kb.values() if size_kb]
+    if len(s_per_kb_samples) > 0:
+        s_per_kb = statistics.median(s_per_kb_samples)
+    elif len(known_sizes) > 0:
+        s_per_kb = default_duration_s / statistics.median(known_sizes)
+    else:
+        s_per_kb = 0.0
+
+    estimates: Dict[str, float] = {}
+    for key in keys:
+        if history.duration_s(key) is not None:
+            estimates[key] = history.duration_s(key)
+        elif repo_sizes_kb.get(key) and s_per_kb > 0:
+            estimates[key] = repo_sizes_kb[key] * s_per_kb
+        else:
+            estimates[key] = default_duration_s
+    return estimates
+
+
+def predict_makespan_s(durations_s: List[float], workers: int,
+                       worker_loads_s: Union[List[float], None] = None) -> \
+        float:
+    """Simulates dispatching jobs, longest first, to whichever worker frees
+    up first.
+
+    Args:
+        durations_s: Durations of the jobs still to dispatch
+        workers: Number of workers
+        worker_loads_s: Time until each worker frees up from the job it is
+         currently running
+
+    Returns:
+        Time until every job is done
+    """
+    loads = list(worker_loads_s or [])
+    loads += [0.0] * (workers - len(loads))
+    heapq.heapify(loads)
+    for duration_s in sorted(durations_s, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + duration_s)
+    return max(loads) if len(loads) > 0 else 0.0
+
+
+class LongestJobFirstScheduler:
+    """Runs jobs on a pool of worker threads, dispatching the longest
+    expected jobs first so that no long job is left to stretch out the end
+    of the run, and reports predicted vs. actual completion as jobs finish.
+    """
+
+    def __init__(self, workers: int):
+        if workers < 1:
+            raise Exception("Number of workers must be at least 1")
+        self._workers: int = workers
+
+    def run(self, jobs: Dict[str, Callable[[], object]],
+            expected_durations_s: Dict[str, float]) -> \
+            Dict[str, Tuple[object, float]]:
+        """Runs every job.
+
+        Args:
+            jobs: Job (called with no arguments) for each key
+            expected_durations_s: Expected duration of each key's job
+
+        Returns:
+            Return value and actual duration of each key's job
+        """
+        order = sorted(jobs, key=lambda key: -expected_durations_s[key])
+        predicted_s = predict_makespan_s(
+            [expected_durations_s[key] for key in order], self._workers)
+        print("Scheduling {} job(s) longest first on {} worker(s); predicted "
+              "to take {:.1f}s".format(len(order), self._workers,
+                                       predicted_s))
+
+        start = time.monotonic()
+        started_at: Dict[str, float] = {}
+        started_lock = threading.Lock()
+
+        def timed(key: str) -> Tuple[object, float]:
+            job_start = time.monotonic()
+            with started_lock:
+                started_at[key] = job_start
+            return jobs[key](), time.monotonic() - job_start
+
+        results: Dict[str, Tuple[object, float]] = {}
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            futures = {executor.submit(timed, key): key for key in order}
+            for future in as_completed(futures):
+                key = futures[future]
+                results[key] = future.result()
+                print(self._progress(key, results, order, started_at,
+                                     started_lock, expected_durations_s,
+                                     start, predicted_s))
+        return results
+
+    def _progress(self, key: str, results: Dict[str, Tuple[object, float]],
+                  order: List[str], started_at: Dict[str, float],
+                  started_lock: threading.Lock,
+                  expected_durations_s: Dict[str, float], start: float,
+                  predicted_s: float) -> str:
+        now = time.monotonic()
+        with started_lock:
+            running = [job_key for job_key in started_at if job_key not in
+                       results]
+            queued = [job_key for job_key in order if job_key not in
+                      started_at]
+            # A running job is expected to take at least a little longer
+            # (a tenth of its estimate), even if it has already overrun its
+            # estimate
+            running_loads_s = [
+                max(expected_durations_s[job_key] -
+                    (now - started_at[job_key]),
+                    0.1 * expected_durations_s[job_key])
+                for job_key in running]
+        remaining_s = predict_makespan_s(
+            [expected_durations_s[job_key] for job_key in queued],
+            self._workers, running_loads_s)
+        return "[{}/{}] Finished {} in {:.1f}s (expected {:.1f}s); {:.1f}s " \
+               "elapsed, predicted to finish at {:.1f}s (initially " \
+               "{:.1f}s)".format(len(results), len(order), key,
+                                 results[key][1], expected_durations_s[key],
+                                 now - start, now - start + remaining_s,
+                                 predicted_s)
@@ -0,0 +1,323 @@
+"""
+Split one student's teacher tests across several pytest processes
+
+The collected tests are partitioned so that each shard is expected to take
+about as long as the others, based on how long each test took in earlier
+runs, and the `pytest -v` outputs of the shards are merged back into the
+report that a single run would have printed.
+"""
+
+import datetime
+import heapq
+import json
+import os
+import re
+import statistics
+import threading
+from typing import Dict, List, Tuple, Union
+
+try:
+    from .pytest_output import ENTRY_RX, OUTCOME_LINE_RX, PROGRESS_RX, \
+        SECTION_RX, entry_test_id, node_test_id
+except ImportError:
+    # Run as a script from the autograding directory
+    from pytest_output import ENTRY_RX, OUTCOME_LINE_RX, PROGRESS_RX, \
+        SECTION_RX, entry_test_id, node_test_id
+
+__author__ = "Duncan Mazza"
+
+TEST_DURATIONS_FILE_NAME: str = "test_durations.json"
+
+# Arguments that make pytest report how long every test took
+DURATIONS_ARGS: List[str] = ["--durations=0", "--durations-min=0"]
+
+# Weight of the latest run when updating a test's recorded duration
+_SMOOTHING: float = 0.5
+
+_STATS_RX = re.compile(r"^(.*) in ([\d.]+)s(?: \([\d:]+\))?$")
+_DURATION_LINE_RX = re.compile(r"^([\d.]+)s (setup|call|teardown)\s+(\S.*)$")
+_COLLECTED_RX = re.compile(r"collected \d+ items?")
+# e.g., 'FAILED teacher_tests.py::test_add[a b] - assert 1 == 2'
+_SHORT_SUMMARY_RX = re.compile(r"^([A-Z]+) (.+?)(?: - .*)?$")
+
+# Order of the counts in pytest's final summary line
+_STATS_ORDER: Tuple[str, ...] = ("failed", "passed", "skipped", "deselected",
+                                 "xfailed", "xpassed", "warnings", "error")
+_SESSION_START_TITLE: str = "test session starts"
+_SECTIONS_IN_ORDER: Tuple[str, ...] = ("ERRORS", "FAILURES")
+_SHORT_SUMMARY_SECTION: str = "short test summary info"
+_DURATIONS_SECTION: str = "slowest durations"
+
+
+class PerTestDurations:
+    """How long each of a homework's teacher tests took in earlier runs,
+    kept in `<history_dir>/<hw_dir_name>/test_durations.json`
+    """
+
+    def __init__(self, history_dir: str, hw_dir_name: str):
+        self._path: str = os.path.join(history_dir, hw_dir_name,
+                                       TEST_DURATIONS_FILE_NAME)
+        self._durations_s: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self._path):
+            with open(self._path, 'r') as durations_file:
+                self._durations_s = json.load(durations_file)
+
+    def durations_s(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._durations_s)
+
+    def record(self, durations_s: Dict[str, float]):
+        with self._lock:
+            for test_id, duration_s in durations_s.items():
+                if test_id in self._durations_s:
+                    duration_s = _SMOOTHING * duration_s + \
+                        (1 - _SMOOTHING) * self._durations_s[test_id]
+                self._durations_s[test_id] = duration_s
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with self._lock:
+            with open(self._path, 'w') as durations_file:
+                json.dump(self._durations_s, durations_file, indent=2,
+                          sort_keys=True)
+
+
+def parse_collected_test_ids(collect_only_text: str) -> List[str]:
+    """Parses the test ids (node ids without their file path) out of the
+    output of `pytest --collect-only -q`
+    """
+    test_ids: List[str] = []
+    for line in collect_only_text.splitlines():
+        if len(line.strip()) == 0:
+            break
+        if "::" in line:
+            test_ids.append(node_test_id(line.strip()))
+    return test_ids
+
+
+def parse_test_durations(results_text: str) -> Dict[str, float]:
+    """Parses the total (setup, call, and teardown) duration of each test
+    out of the 'slowest durations' section that `--durations=0` adds
+    """
+    durations_s: Dict[str, float] = {}
+    for line in results_text.splitlines():
+        match_obj = _DURATION_LINE_RX.match(line.strip())
+        if match_obj is not None:
+            test_id = node_test_id(match_obj.group(3))
+            durations_s[test_id] = durations_s.get(test_id, 0.0) + \
+                float(match_obj.group(1))
+    return durations_s
+
+
+def partition_test_ids(test_ids: List[str], durations_s: Dict[str, float],
+                       shards: int) -> List[List[str]]:
+    """Partitions tests into shards of about equal expected duration by
+    adding the longest tests first, each to the shard with the least work.
+    Tests without a recorded duration are expected to take the median
+    recorded duration.
+
+    Returns:
+        Non-empty shards, each in the order the tests were collected
+    """
+    known_durations_s = [durations_s[test_id] for test_id in test_ids if
+                         test_id in durations_s]
+    default_duration_s = statistics.median(known_durations_s) if \
+        len(known_durations_s) > 0 else 1.0
+    order = {test_id: i for i, test_id in enumerate(test_ids)}
+
+    loads: List[Tuple[float, int]] = [(0.0, i) for i in range(shards)]
+    shard_test_ids: List[List[str]] = [[] for _ in range(shards)]
+    for test_id in sorted(test_ids, key=lambda test_id: (
+            -durations_s.get(test_id, default_duration_s), order[test_id])):
+        load_s, i = heapq.heappop(loads)
+        shard_test_ids[i].append(test_id)
+        heapq.heappush(loads, (load_s + durations_s.get(
+            test_id, default_duration_s), i))
+    return [sorted(test_ids_of_shard, key=order.get) for test_ids_of_shard in
+            shard_test_ids if len(test_ids_of_shard) > 0]
+
+
+class _PytestOutput:
+    """The parts of one `pytest -v` output that merging needs"""
+
+    def __init__(self, results_text: str):
+        self.header: List[str] = []
+        self.outcome_lines: List[Tuple[str, str, str]] = []
+        self.sections: Dict[str, List[str]] = {}
+        self.stats: Dict[str, int] = {}
+        self.duration_s: float = 0.0
+        self.width: int = 0
+        self.node_file: str = ""
+
+        section: Union[List[str], None] = None
+        for line in results_text.splitlines():
+            banner_match = SECTION_RX.match(line)
+            if banner_match is not None:
+                self.width = max(self.width, len(line))
+                title = banner_match.group(1)
+                stats_match = _STATS_RX.match(title)
+                if stats_match is not None:
+                    self._parse_stats(stats_match)
+                    section = None
+                    continue
+                if title != _SESSION_START_TITLE:
+                    section = self.sections.setdefault(title, [])
+                    continue
+            if section is not None:
+                section.append(line)
+                continue
+            outcome_match = OUTCOME_LINE_RX.match(line)
+            progress_match = None if outcome_match is None else \
+                PROGRESS_RX.match(line[outcome_match.end():])
+            if progress_match is not None:
+                self.outcome_lines.append((
+                    node_test_id(outcome_match.group(1)),
+                    outcome_match.group(2), progress_match.group(1)))
+                self.node_file = outcome_match.group(1).split("::", 1)[0]
+            elif len(self.outcome_lines) == 0:
+                self.header.append(line)
+
+    def _parse_stats(self, stats_match):
+        self.duration_s = float(stats_match.group(2))
+        for part in stats_match.group(1).split(", "):
+            count, _, noun = part.partition(" ")
+            if not count.isdigit():
+                continue
+            if noun in ("errors", "error"):
+                noun = "error"
+            elif noun in ("warnings", "warning"):
+                noun = "warnings"
+            self.stats[noun] = self.stats.get(noun, 0) + int(count)
+
+
+def _banner(title: str, width: int) -> str:
+    # Same as pytest's TerminalWriter.sep("=", title)
+    fill = "=" * max((width - len(title) - 2) // 2, 1)
+    line = "{} {} {}".format(fill, title, fill)
+    if len(line) + 1 <= width:
+        line += "="
+    return line
+
+
+def _split_entries(section_lines: List[str]) -> List[Tuple[str, List[str]]]:
+    entries: List[Tuple[str, List[str]]] = []
+    for line in section_lines:
+        entry_match = ENTRY_RX.match(line)
+        if entry_match is not None:
+            entries.append((entry_test_id(entry_match.group(1)), [line]))
+        elif len(entries) > 0:
+            entries[-1][1].append(line)
+    return entries
+
+
+def _pluralize(count: int, noun: str) -> str:
+    if noun in ("error", "warnings"):
+        noun = noun.rstrip("s")
+        if count != 1:
+            noun += "s"
+    return "{} {}".format(count, noun)
+
+
+def _format_duration(duration_s: float) -> str:
+    # Same as pytest's format_session_duration
+    if duration_s < 60:
+        return "{:.2f}s".format(duration_s)
+    return "{:.2f}s ({})".format(duration_s, datetime.timedelta(
+        seconds=int(duration_s)))
+
+
+def merge_shard_outputs(shard_results_texts: List[str],
+                        test_ids: List[str]) -> str:
+    """Merges the `pytest -v` outputs of the shards of a test file into the
+    output that running the whole file at once would have given: per-test
+    lines in collection order with their progress percentages recomputed,
+    failure and error entries in collection order, and one summary line
+    with the counts of every shard.
+
+    Args:
+        shard_results_texts: Output of each shard
+        test_ids: Every collected test, in collection order
+
+    Returns:
+        Merged output
+    """
+    outputs = [_PytestOutput(text) for text in shard_results_texts]
+    order = {test_id: i for i, test_id in enumerate(test_ids)}
+    width = max([output.width for output in outputs] + [0]) or 80
+    node_file = next((output.node_file for output in outputs if
+                      len(output.outcome_lines) > 0), "")
+
+    lines: List[str] = []
+    for line in outputs[0].header:
+        lines.append(_COLLECTED_RX.sub("collected {} item{}".format(
+            len(test_ids), "" if len(test_ids) == 1 else "s"), line))
+
+    outcome_lines = sorted(
+        [outcome_line for output in outputs for outcome_line in
+         output.outcome_lines],
+        key=lambda outcome_line: order.get(outcome_line[0], len(order)))
+    reported = set()
+    for test_id, outcome, extra in outcome_lines:
+        reported.add(test_id)
+        text = "{}::{} {}{}".format(node_file, test_id, outcome, extra)
+        progress = " [{:3d}%]".format(len(reported) * 100 // max(
+            len(test_ids), 1))
+        lines.append(text + progress.rjust(width - len(text) - 1))
+
+    section_titles: List[str] = [title for title in _SECTIONS_IN_ORDER if
+                                 any(title in output.sections for output in
+                                     outputs)]
+    for output in outputs:
+        for title in output.sections:
+            if title not in section_titles and title not in (
+                    _SHORT_SUMMARY_SECTION, _DURATIONS_SECTION):
+                section_titles.append(title)
+    if any(_SHORT_SUMMARY_SECTION in output.sections for output in outputs):
+        section_titles.append(_SHORT_SUMMARY_SECTION)
+
+    if len(outcome_lines) > 0:
+        lines.append("")
+    for title in section_titles:
+        lines.append(_banner(title, width))
+        if title in _SECTIONS_IN_ORDER:
+            entries = [entry for output in outputs for entry in
+                       _split_entries(output.sections.get(title, []))]
+            # Collection errors are not tests, so they go first
+            entries.sort(key=lambda entry: order.get(entry[0], -1))
+            for _, entry_lines in entries:
+                lines.extend(entry_lines)
+        elif title == _SHORT_SUMMARY_SECTION:
+            summary_lines = [line for output in outputs for line in
+                             output.sections.get(title, [])]
+            kinds: List[str] = []
+            for line in summary_lines:
+                match_obj = _SHORT_SUMMARY_RX.match(line)
+                kind = match_obj.group(1) if match_obj is not None else ""
+                if kind not in kinds:
+                    kinds.append(kind)
+
+            def summary_key(line: str) -> Tuple[int, int]:
+                match_obj = _SHORT_SUMMARY_RX.match(line)
+                if match_obj is None:
+                    return kinds.index(""), len(order)
+                return kinds.index(match_obj.group(1)), order.get(
+                    node_test_id(match_obj.group(2)), len(order))
+
+            lines.extend(sorted(summary_lines, key=summary_key))
+        else:
+            for output in outputs:
+                lines.extend(output.sections.get(title, []))
+
+    stats: Dict[str, int] = {}
+    for output in outputs:
+        for noun, count in output.stats.items():
+            stats[noun] = stats.get(noun, 0) + count
+    nouns = [noun for noun in _STATS_ORDER if noun in stats] + \
+        [noun for noun in stats if noun not in _STATS_ORDER]
+    stats_text = ", ".join([_pluralize(stats[noun], noun) for noun in nouns]) \
+        or "no tests ran"
+    lines.append(_banner("{} in {}".format(
+        stats_text, _format_duration(max(
+            [output.duration_s for output in outputs] + [0.0]))), width))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,294 @@
+"""
+Pytest plugin that measures line and branch coverage of one student module
+
+Loaded into the run of a student's own tests with
+
+    python3 -m pytest -p student_coverage --student-cov=hw2.py \
+        --student-cov-report=student_test_coverage.json hw2_student_tests.py
+
+(with this folder on PYTHONPATH). On Python 3.12+ it uses sys.monitoring,
+only enables events for code objects of the measured module, and disables
+each line and branch once it has been seen, so measuring adds next to no
+overhead to the tests. Older versions fall back to sys.settrace.
+"""
+
+import ast
+import dis
+import json
+import os
+import sys
+import threading
+import types
+from typing import Dict, List, Set, Tuple, Union
+
+__author__ = "Duncan Mazza"
+
+_TOOL_NAME: str = "student_coverage"
+
+
+def executable_lines(source: str, file_path: str) -> Set[int]:
+    """Lines of a module that hold executable code"""
+    lines: Set[int] = set()
+    code_objects = [compile(source, file_path, "exec")]
+    while len(code_objects) > 0:
+        code = code_objects.pop()
+        for _, _, line in code.co_lines():
+            if line is not None and line > 0:
+                lines.add(line)
+        code_objects.extend([const for const in code.co_consts if
+                             isinstance(const, types.CodeType)])
+    return lines
+
+
+def branch_points(source: str) -> Dict[int, int]:
+    """Maps the line of every if/while/for statement to the first line of
+    its body. The branch was taken if the first line of its body ran and not
+    taken if execution went from the statement's line anywhere else.
+    """
+    points: Dict[int, int] = {}
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, (ast.If, ast.While, ast.For, ast.AsyncFor)):
+            points[node.lineno] = node.body[0].lineno
+    return points
+
+
+class CoverageCollector:
+    """Records the lines and line-to-line arcs executed in one file"""
+
+    def __init__(self, file_path: str):
+        self._file_path: str = os.path.realpath(file_path)
+        self._is_target: Dict[str, bool] = {}
+        self.lines: Set[int] = set()
+        self.arcs: Set[Tuple[int, int]] = set()
+        self.tracer: str = ""
+        self._branch_destinations: Dict[Tuple[types.CodeType, int],
+                                        Set[int]] = {}
+        self._instructions: Dict[types.CodeType,
+                                 Tuple[List[dis.Instruction],
+                                       Dict[int, int]]] = {}
+
+    def _in_target(self, code: types.CodeType) -> bool:
+        is_target = self._is_target.get(code.co_filename)
+        if is_target is None:
+            is_target = os.path.realpath(code.co_filename) == self._file_path
+            self._is_target[code.co_filename] = is_target
+        return is_target
+
+    def start(self):
+        monitoring = getattr(sys, "monitoring", None)
+        if monitoring is not None:
+            try:
+                monitoring.use_tool_id(monitoring.COVERAGE_ID, _TOOL_NAME)
+                self._start_monitoring(monitoring)
+                return
+            except ValueError:
+                # Another tool (e.g., coverage.py) is already using the
+                # coverage tool id
+                pass
+        self.tracer = "settrace"
+        threading.settrace(self._global_trace)
+        sys.settrace(self._global_trace)
+
+    def stop(self):
+        if self.tracer == "sys.monitoring":
+            monitoring = sys.monitoring
+            monitoring.set_events(monitoring.COVERAGE_ID, 0)
+            monitoring.free_tool_id(monitoring.COVERAGE_ID)
+        else:
+            sys.settrace(None)
+            threading.settrace(None)
+
+    # sys.monitoring (Python 3.12+)
+
+    def _start_monitoring(self, monitoring):
+        self.tracer = "sys.monitoring"
+        events = monitoring.events
+        tool_id = monitoring.COVERAGE_ID
+        # Python 3.14 splits BRANCH into BRANCH_LEFT and BRANCH_RIGHT, which
+        # can be disabled separately
+        if hasattr(events, "BRANCH_LEFT"):
+            self._local_events = events.LINE | events.BRANCH_LEFT | \
+                events.BRANCH_RIGHT
+            monitoring.register_callback(tool_id, events.BRANCH_LEFT,
+                                         self._on_split_branch)
+            monitoring.register_callback(tool_id, events.BRANCH_RIGHT,
+                                         self._on_split_branch)
+        else:
+            self._local_events = events.LINE | events.BRANCH
+            monitoring.register_callback(tool_id, events.BRANCH,
+                                         self._on_branch)
+        monitoring.register_callback(tool_id, events.PY_START,
+                                     self._on_py_start)
+        monitoring.register_callback(tool_id, events.LINE, self._on_line)
+        monitoring.set_events(tool_id, events.PY_START)
+
+    def _on_py_start(self, code: types.CodeType, instruction_offset: int):
+        if self._in_target(code):
+            sys.monitoring.set_local_events(sys.monitoring.COVERAGE_ID, code,
+                                            self._local_events)
+        return sys.monitoring.DISABLE
+
+    def _on_line(self, code: types.CodeType, line_number: int):
+        self.lines.add(line_number)
+        return sys.monitoring.DISABLE
+
+    def _destination_line(self, code: types.CodeType,
+                          instruction_offset: int,
+                          destination_offset: int) -> \
+            Tuple[Union[int, None], Union[int, None]]:
+        """Finds the line a branch instruction leads to.
+
+        The instructions a branch jumps to often still belong to the branch's
+        own line (e.g., assigning a for loop's variable or returning at the
+        end of a function), so follow them until the line changes. Returns
+        the source line and the destination line (negative when leaving the
+        function), or None for the destination line if the branch only leads
+        to another branch on the same line (e.g., the next operand of an
+        `and`), which will record its own arc.
+        """
+        instructions = self._instructions.get(code)
+        if instructions is None:
+            instruction_list = list(dis.get_instructions(code))
+            instructions = (instruction_list, {
+                instruction.offset: i for i, instruction in
+                enumerate(instruction_list)})
+            self._instructions[code] = instructions
+        instruction_list, index_of_offset = instructions
+
+        src_index = index_of_offset.get(instruction_offset)
+        i = index_of_offset.get(destination_offset)
+        if src_index is None or i is None:
+            return None, None
+        src_line = instruction_list[src_index].positions.lineno
+        for _ in range(len(instruction_list)):
+            if i >= len(instruction_list):
+                return src_line, None
+            instruction = instruction_list[i]
+            line = instruction.positions.lineno
+            if line is not None and line != src_line:
+                return src_line, line
+            if instruction.opname.startswith("RETURN"):
+                return src_line, -code.co_firstlineno
+            if instruction.opname.startswith("JUMP"):
+                i = index_of_offset.get(instruction.argval, len(
+                    instruction_list))
+            elif instruction.opcode in dis.hasjrel or \
+                    instruction.opcode in dis.hasjabs:
+                return src_line, None
+            else:
+                i += 1
+        return src_line, None
+
+    def _record_branch(self, code: types.CodeType, instruction_offset: int,
+                       destination_offset: int):
+        src_line, dst_line = self._destination_line(
+            code, instruction_offset, destination_offset)
+        if src_line is not None and dst_line is not None:
+            self.arcs.add((src_line, dst_line))
+
+    def _on_branch(self, code: types.CodeType, instruction_offset: int,
+                   destination_offset: int):
+        self._record_branch(code, instruction_offset, destination_offset)
+        # BRANCH can only be disabled for both directions at once, so wait
+        # until both have been seen
+        destinations = self._branch_destinations.setdefault(
+            (code, instruction_offset), set())
+        destinations.add(destination_offset)
+        if len(destinations) >= 2:
+            return sys.monitoring.DISABLE
+        return None
+
+    def _on_split_branch(self, code: types.CodeType, instruction_offset: int,
+                         destination_offset: int):
+        self._record_branch(code, instruction_offset, destination_offset)
+        return sys.monitoring.DISABLE
+
+    # sys.settrace fallback
+
+    def _global_trace(self, frame, event: str, arg):
+        if not self._in_target(frame.f_code):
+            return None
+        last_line: List[Union[int, None]] = [None]
+
+        def local_trace(frame, event: str, arg):
+            if event == "line":
+                line = frame.f_lineno
+                self.lines.add(line)
+                if last_line[0] is not None:
+                    self.arcs.add((last_line[0], line))
+                last_line[0] = line
+            elif event == "return" and last_line[0] is not None:
+                # Leaving the function counts as going somewhere other than
+                # the body of a branch on the last line
+                self.arcs.add((last_line[0], -frame.f_code.co_firstlineno))
+            return local_trace
+
+        return local_trace
+
+    def report(self, source: str) -> Dict[str, Union[str, int, float,
+                                                     List[int]]]:
+        """Summarizes what was recorded against the module's source"""
+        all_lines = executable_lines(source, self._file_path)
+        covered_lines = self.lines & all_lines
+        branches_total = 0
+        branches_covered = 0
+        for branch_line, body_line in branch_points(source).items():
+            destinations = {dst_line for src_line, dst_line in self.arcs
+                            if src_line == branch_line}
+            branches_total += 2
+            branches_covered += int(body_line in self.lines)
+            branches_covered += int(len(destinations - {body_line,
+                                                        branch_line}) > 0)
+        return {
+            "module": os.path.basename(self._file_path),
+            "tracer": self.tracer,
+            "lines_total": len(all_lines),
+            "lines_covered": len(covered_lines),
+            "line_rate": len(covered_lines) / len(all_lines) if
+            len(all_lines) > 0 else 1.0,
+            "branches_total": branches_total,
+            "branches_covered": branches_covered,
+            "branch_rate": branches_covered / branches_total if
+            branches_total > 0 else 1.0,
+            "missing_lines": sorted(all_lines - covered_lines),
+        }
+
+
+_collector: Union[CoverageCollector, None] = None
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("student_coverage")
+    group.addoption("--student-cov", default=None,
+                    help="student module to measure the coverage of")
+    group.addoption("--student-cov-report", default=None,
+                    help="json file to write the coverage report to")
+
+
+def pytest_configure(config):
+    global _collector
+    module_path = config.getoption("--student-cov")
+    if module_path is None:
+        return
+    _collector = CoverageCollector(module_path)
+    _collector.start()
+
+
+def pytest_unconfigure(config):
+    global _collector
+    if _collector is None:
+        return
+    _collector.stop()
+    module_path = config.getoption("--student-cov")
+    report: Dict[str, Union[str, int, float, List[int]]]
+    try:
+        with open(module_path, 'r') as module_file:
+            report = _collector.report(module_file.read())
+    except (OSError, SyntaxError) as ex:
+        report = {"module": os.path.basename(module_path),
+                  "error": str(ex)}
+    report_path = config.getoption("--student-cov-report")
+    if report_path is not None:
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    _collector = None
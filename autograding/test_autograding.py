@@ -1,6 +1,32 @@
+import importlib.util
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
-from .autograde_link_submission import GHLink
-from typing import Tuple, Union, Dict
+from .autograde_link_submission import Assignment, GHLink, Student, \
+    acquire_gh_links
+from .canvas_fetch import CanvasClient, fetch_submissions
+from .distributed import TOKEN_ENV, GradingCoordinator, GradingWorker
+from .grading_session import GradingSession
+from .push_queue import ALREADY_PUSHED, FAILED, PUSHED, PushQueue
+from .student_coverage import CoverageCollector
+from .failure_index import FailureIndex, parse_failures
+from .mutation import KILLED, NOT_REACHED, generate_mutants, mutation_test
+from .scheduler import GradingHistory, LongestJobFirstScheduler, \
+    estimate_durations_s, predict_makespan_s
+from .sharding import merge_shard_outputs, parse_collected_test_ids, \
+    parse_test_durations, partition_test_ids, DURATIONS_ARGS
+from .regrade import RegradePlan, changed_top_level_names, \
+    load_regrade_history, parse_pytest_outcomes, save_regrade_history
+from typing import Callable, Dict, List, Tuple, Union
 
 # Dictionary keys must match the GHLink attribute names
 links = [
@@ -170,3 +196,1465 @@ def test_GHLink_valid(link_dict_pair: Tuple[str, Dict[str, Union[str, bool]]]):
     g = GHLink(link_dict_pair[0])
     for key in link_dict_pair[1]:
         assert(link_dict_pair[1][key] == g.__getattribute__(key))
+
+
+prev_teacher_tests = """
+import pytest
+from hw2 import add, sub
+
+CASES = [(1, 2, 3)]
+
+
+@pytest.fixture
+def offset():
+    return 0
+
+
+def test_add():
+    assert add(1, 2) == 3
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_add_cases(case):
+    assert add(case[0], case[1]) == case[2]
+
+
+def test_sub(offset):
+    assert sub(2, 1) == 1 + offset
+"""
+
+prev_teacher_results = """\
+teacher_tests.py::test_add PASSED                                   [ 33%]
+teacher_tests.py::test_add_cases[case0] FAILED                      [ 66%]
+teacher_tests.py::test_sub PASSED                                   [100%]
+"""
+
+
+def test_changed_top_level_names_follows_references():
+    new_teacher_tests = prev_teacher_tests.replace("return 0", "return 1")
+    assert changed_top_level_names(prev_teacher_tests, new_teacher_tests) \
+        == {"offset", "test_sub"}
+    new_teacher_tests = prev_teacher_tests.replace("(1, 2, 3)", "(2, 2, 4)")
+    assert changed_top_level_names(prev_teacher_tests, new_teacher_tests) \
+        == {"CASES", "test_add_cases"}
+    new_teacher_tests = prev_teacher_tests + "\nprint('hi')\n"
+    assert changed_top_level_names(prev_teacher_tests,
+                                   new_teacher_tests) is None
+
+
+def test_RegradePlan_reruns_failing_and_changed_tests():
+    new_teacher_tests = prev_teacher_tests.replace("return 0", "return 1")
+    plan = RegradePlan(prev_teacher_results, prev_teacher_tests,
+                       new_teacher_tests)
+    assert not plan.rerun_all()
+    assert plan.node_ids() == ["teacher_tests.py::test_add_cases[case0]",
+                               "teacher_tests.py::test_sub"]
+
+    merged = plan.merge(
+        "teacher_tests.py::test_add_cases[case0] PASSED  [ 50%]\n"
+        "teacher_tests.py::test_sub FAILED  [100%]\n")
+    assert "teacher_tests.py::test_add PASSED (carried over" in merged
+    assert "teacher_tests.py::test_add_cases[case0] PASSED\n" in merged
+    assert "teacher_tests.py::test_sub FAILED\n" in merged
+
+
+def test_RegradePlan_reruns_tests_without_recorded_outcomes(tmp_path):
+    # e.g., the previous run was cut short before test_sub was reported
+    prev_results = prev_teacher_results.split("teacher_tests.py::test_sub")[0]
+    new_teacher_tests = prev_teacher_tests + \
+        "\n\ndef test_mul():\n    assert True\n"
+    save_regrade_history(str(tmp_path / "dm_repo" / "main"), prev_results,
+                         new_teacher_tests, "fingerprint")
+    prev_results, prev_teacher_tests_text, code_fingerprint = \
+        load_regrade_history(str(tmp_path / "dm_repo" / "main"))
+    assert code_fingerprint == "fingerprint"
+    plan = RegradePlan(prev_results, prev_teacher_tests_text,
+                       new_teacher_tests)
+    assert RegradePlan(prev_results, prev_teacher_tests_text,
+                       new_teacher_tests, code_changed=True).rerun_all()
+    assert load_regrade_history(str(tmp_path / "missing")) is None
+    assert plan.node_ids() == ["teacher_tests.py::test_add_cases[case0]",
+                               "teacher_tests.py::test_sub",
+                               "teacher_tests.py::test_mul"]
+    merged = plan.merge("teacher_tests.py::test_add_cases[case0] PASSED\n"
+                        "teacher_tests.py::test_sub PASSED\n"
+                        "teacher_tests.py::test_mul PASSED\n")
+    assert "Regrade: 3 test(s) rerun, 1 carried over" in merged
+
+
+def _git(cwd, *args: str) -> str:
+    return subprocess.run(["git"] + list(args), cwd=str(cwd), check=True,
+                          stdout=subprocess.PIPE, text=True).stdout
+
+
+@pytest.fixture
+def student_remote(tmp_path):
+    """Repository of student 'dm' (https://github.com/dm/dsa) whose remote
+    is a local bare repository, already cloned into tmp_path/student_repos
+    """
+    remote = tmp_path / "remote.git"
+    _git(tmp_path, "init", "-q", "--bare", "-b", "main", str(remote))
+    clone = tmp_path / "student_repos" / "dm_dsa"
+    _git(tmp_path, "clone", "-q", str(remote), str(clone))
+    _git(clone, "config", "user.email", "dm@example.com")
+    _git(clone, "config", "user.name", "dm")
+    (clone / "hw" / "hw_2").mkdir(parents=True)
+    (clone / "hw" / "hw_2" / "hw2.py").write_text(
+        "def add(a, b):\n    return a + b\n")
+    _git(clone, "add", ".")
+    _git(clone, "commit", "-q", "-m", "Add hw2")
+    _git(clone, "push", "-q", "-u", "origin", "main")
+    (tmp_path / "hw" / "hw_2").mkdir(parents=True)
+    (tmp_path / "submissions").mkdir()
+    return remote, clone
+
+
+def _submit_links(tmp_path, links):
+    for i, link in enumerate(links):
+        (tmp_path / "submissions" / "{}.html".format(i)).write_text(
+            '<html><body><a href="{}">link</a></body></html>'.format(link))
+
+
+def test_GradingSession_requires_student_tests_for_coverage_and_mutants(
+        tmp_path):
+    for options, student_test_file, message in [
+            ({"measure_coverage": True}, None,
+             "Coverage needs a student test file, but none was given for "
+             "hw_2"),
+            ({"mutation_testing": True}, "test_hw2.py",
+             "Mutation testing needs a student test file, but none was given "
+             "for hw_3")]:
+        session = GradingSession(str(tmp_path), "hw_2",
+                                 teacher_test_file="test_hw2.py",
+                                 student_test_file=student_test_file,
+                                 hw_root_dir=str(tmp_path / "hw"),
+                                 autograding_dir=str(tmp_path), **options)
+        session.add_assignment("hw_3", "test_hw3.py")
+        with pytest.raises(Exception, match=message):
+            session.configure_teacher_tests()
+
+
+def test_GradingSession_regrades_from_recorded_results(tmp_path,
+                                                       student_remote):
+    _, clone = student_remote
+    # Results committed by an earlier run, before test_a was parametrized
+    # and test_c was added
+    (clone / "hw" / "hw_2" / "teacher_test_results.txt").write_text(
+        "teacher_tests.py::test_a PASSED\n")
+    _git(clone, "add", ".")
+    _git(clone, "commit", "-q", "-m", "Add testing results for hw_2")
+    _git(clone, "push", "-q")
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "import pytest\nfrom hw2_solution import add\n\n\n"
+        "@pytest.mark.parametrize('x', [1, 2])\ndef test_a(x):\n"
+        "    assert add(x, 0) == x\n\n\ndef test_c():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    session.run()
+    # Syncing the repository resets the results to the committed ones, but
+    # the regrade starts from the results of the run above
+    session.run(regrade=True)
+    results = (clone / "hw" / "hw_2" / "teacher_test_results.txt") \
+        .read_text()
+    assert "Regrade: 0 test(s) rerun, 3 carried over" in results
+    for test_id in ("test_a[1]", "test_a[2]", "test_c"):
+        assert "teacher_tests.py::{} PASSED (carried over".format(
+            test_id) in results
+
+
+def test_GradingSession_regrade_reruns_all_after_student_changes_code(
+        tmp_path, student_remote):
+    remote, clone = student_remote
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_a():\n"
+        "    assert add(1, 0) == 1\n\n\ndef test_c():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    results_path = clone / "hw" / "hw_2" / "teacher_test_results.txt"
+    session.run(push_results=True)
+    assert _git(remote, "log", "-1", "--format=%s").strip() == \
+        "Add testing results for hw_2"
+    # Committing the results does not count as a change to the student's
+    # code
+    session.run(regrade=True)
+    assert "Regrade: 0 test(s) rerun, 2 carried over" in \
+        results_path.read_text()
+
+    # The student breaks test_c after the recorded run
+    work = tmp_path / "student_work"
+    _git(tmp_path, "clone", "-q", str(remote), str(work))
+    _git(work, "config", "user.email", "dm@example.com")
+    _git(work, "config", "user.name", "dm")
+    (work / "hw" / "hw_2" / "hw2.py").write_text(
+        "def add(a, b):\n    return a - b\n")
+    _git(work, "commit", "-q", "-am", "Rewrite add")
+    _git(work, "push", "-q")
+    session.run(regrade=True)
+    results = results_path.read_text()
+    assert "carried over" not in results
+    assert "teacher_tests.py::test_a PASSED" in results
+    assert "teacher_tests.py::test_c FAILED" in results
+
+
+def test_GradingSession_regrades_on_workers_from_the_coordinators_history(
+        tmp_path, student_remote):
+    _, clone = student_remote
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_a():\n"
+        "    assert add(1, 0) == 1\n\n\ndef test_c():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    # The regrade is graded by a worker with a clone of its own, which has
+    # never graded the student
+    other_repos = tmp_path / "other_repos"
+    shutil.copytree(str(clone), str(other_repos / "dm_dsa"))
+    for student_repos_dir, regrade in ((tmp_path / "student_repos", False),
+                                       (other_repos, True)):
+        workers = []
+
+        def start_worker(address, student_repos_dir=student_repos_dir):
+            worker = GradingWorker(address[0], address[1], WORKER_TOKEN,
+                                   str(student_repos_dir))
+            workers.append(threading.Thread(target=worker.run))
+            workers[-1].start()
+        session.run_distributed(WORKER_TOKEN, port=0, regrade=regrade,
+                                on_start=start_worker)
+        workers[0].join()
+
+    results = (tmp_path / "hw_2_test_results" / "dm_dsa" / "main" /
+               "hw_2" / "teacher_test_results.txt").read_text()
+    assert "Regrade: 0 test(s) rerun, 2 carried over" in results
+    assert len(list((tmp_path / "student_repos").glob(".history_*"))) == 0
+
+
+def test_GradingSession_grades_on_a_worker_process(tmp_path,
+                                                   student_remote):
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    workers = []
+
+    def start_worker(address):
+        env = dict(os.environ)
+        env[TOKEN_ENV] = WORKER_TOKEN
+        workers.append(subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(
+                os.path.abspath(__file__)), "distributed.py"),
+             "{}:{}".format(*address), "-r",
+             str(tmp_path / "student_repos")],
+            env=env, stdout=subprocess.DEVNULL))
+    results = session.run_distributed(WORKER_TOKEN, port=0,
+                                      on_start=start_worker)
+    assert workers[0].wait(timeout=60) == 0
+    assert results[0]["tested_without_failure"]
+    assert "teacher_tests.py::test_add PASSED" in (
+        tmp_path / "hw_2_test_results" / "dm_dsa" / "main" /
+        "hw_2" / "teacher_test_results.txt").read_text()
+
+
+def test_GradingSession_reconciles_pushes_of_workers(tmp_path,
+                                                     student_remote):
+    remote, clone = student_remote
+    _git(clone, "push", "-q", "origin", "main:b1")
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa/tree/b1",
+                             "https://github.com/dm/dsa/tree/missing"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path),
+                             max_pushes_per_minute=600)
+    workers = []
+
+    def start_worker(address):
+        worker = GradingWorker(address[0], address[1], WORKER_TOKEN,
+                               str(tmp_path / "student_repos"))
+        workers.append(threading.Thread(target=worker.run))
+        workers[-1].start()
+    results = session.run_distributed(WORKER_TOKEN, port=0,
+                                      push_results=True,
+                                      on_start=start_worker)
+    workers[0].join()
+    assert [result["pushed_successfully"] for result in results] == \
+        [True, False]
+    assert results[0]["report"].endswith(" | Pushed successfully")
+    assert "1 pushed, 0 already up to date, 1 still outstanding" in \
+        session.summary()
+    assert _git(remote, "log", "-1", "--format=%s", "b1").strip() == \
+        "Add testing results for hw_2"
+
+
+def test_GradingSession_does_not_record_durations_of_failed_jobs(
+        tmp_path, student_remote):
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    workers = []
+
+    def executor(job):
+        raise Exception("out of disk space")
+
+    def start_worker(address):
+        worker = GradingWorker(address[0], address[1], WORKER_TOKEN,
+                               str(tmp_path / "other_repos"),
+                               executor=executor)
+        workers.append(threading.Thread(target=worker.run))
+        workers[-1].start()
+    results = session.run_distributed(WORKER_TOKEN, port=0,
+                                      on_start=start_worker)
+    workers[0].join()
+    assert "out of disk space" in results[0]["report"]
+    assert GradingHistory(str(tmp_path / "grading_history")).duration_s(
+        "dm_dsa") is None
+
+
+def test_GradingSession_lists_ungraded_repos_without_workers(
+        tmp_path, student_remote):
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    with pytest.raises(Exception, match="to grade: dm_dsa$"):
+        session.run_distributed(WORKER_TOKEN, port=0, timeout_s=0.5)
+
+
+def test_GradingSession_pushes_each_branch_of_a_shared_clone(
+        tmp_path, student_remote):
+    remote, clone = student_remote
+    for branch in ("b1", "b2", "b3"):
+        _git(clone, "push", "-q", "origin", "main:" + branch)
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa/tree/" + branch
+                             for branch in ("b1", "b2", "b3")])
+    # Rate limiting holds each push back until the next link has been synced
+    # (and has checked out its own branch)
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path),
+                             max_pushes_per_minute=60)
+    session.run(push_results=True)
+    assert "3 pushed, 0 already up to date" in session.summary()
+    assert session.failure_index().summary().startswith(
+        "Failure index: 0 of 3 student(s)")
+    main_commit = _git(remote, "rev-parse", "main").strip()
+    for branch in ("b1", "b2", "b3"):
+        assert _git(remote, "log", "-1", "--format=%s", branch).strip() == \
+            "Add testing results for hw_2"
+        assert _git(remote, "rev-parse", branch + "~1").strip() == \
+            main_commit
+        assert "hw/hw_2/teacher_test_results.txt" in _git(
+            remote, "ls-tree", "-r", "--name-only", branch)
+
+    # Everything was pushed, so pushing again has nothing to do
+    session.push_only()
+    assert "0 pushed, 3 already up to date" in session.summary()
+
+
+def _push_branch(tmp_path, remote, branch: str, hw2_files: Dict[str, str]):
+    work = tmp_path / "work_{}".format(branch)
+    _git(tmp_path, "clone", "-q", str(remote), str(work))
+    _git(work, "config", "user.email", "dm@example.com")
+    _git(work, "config", "user.name", "dm")
+    _git(work, "checkout", "-q", "-B", branch)
+    for file_name, text in hw2_files.items():
+        (work / "hw" / "hw_2" / file_name).write_text(text)
+    _git(work, "add", ".")
+    _git(work, "commit", "-q", "-m", "Update hw2")
+    _git(work, "push", "-q", "origin", branch)
+
+
+def test_GradingSession_indexes_failures_of_each_branch(tmp_path,
+                                                        student_remote):
+    remote, _ = student_remote
+    _push_branch(tmp_path, remote, "broken",
+                 {"hw2.py": "def add(a, b):\n    return a - b\n"})
+    _push_branch(tmp_path, remote, "fixed",
+                 {"hw2.py": "def add(a, b):\n    return b + a\n"})
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    # The passing branch is checked out last
+    _submit_links(tmp_path, ["https://github.com/dm/dsa/tree/broken",
+                             "https://github.com/dm/dsa/tree/fixed"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    session.run()
+    assert session.failure_index().failing_students() == [
+        "https://github.com/dm/dsa/tree/broken"]
+
+
+def test_GradingSession_keeps_results_of_each_branch_from_workers(
+        tmp_path, student_remote):
+    remote, _ = student_remote
+    _push_branch(tmp_path, remote, "broken",
+                 {"hw2.py": "def add(a, b):\n    return a - b\n"})
+    _push_branch(tmp_path, remote, "fixed",
+                 {"hw2.py": "def add(a, b):\n    return b + a\n"})
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa/tree/broken",
+                             "https://github.com/dm/dsa/tree/fixed"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    workers = []
+
+    def start_worker(address):
+        worker = GradingWorker(address[0], address[1], WORKER_TOKEN,
+                               str(tmp_path / "student_repos"))
+        workers.append(threading.Thread(target=worker.run))
+        workers[-1].start()
+    session.run_distributed(WORKER_TOKEN, port=0, on_start=start_worker)
+    workers[0].join()
+    results_dir = tmp_path / "hw_2_test_results" / "dm_dsa"
+    assert "test_add FAILED" in (results_dir / "broken" / "hw_2" /
+                                 "teacher_test_results.txt").read_text()
+    assert "test_add PASSED" in (results_dir / "fixed" / "hw_2" /
+                                 "teacher_test_results.txt").read_text()
+
+
+def test_GradingSession_mutation_tests_each_branch(tmp_path,
+                                                   student_remote):
+    remote, _ = student_remote
+    _push_branch(tmp_path, remote, "strong", {
+        "test_mine.py": "from hw2 import add\n\n\ndef test_add():\n"
+                        "    assert add(1, 2) == 3\n"})
+    _push_branch(tmp_path, remote, "weak", {
+        "test_mine.py": "from hw2 import add\n\n\ndef test_add():\n"
+                        "    add(1, 2)\n"})
+    (tmp_path / "hw" / "hw_2" / "hw2_solution.py").write_text(
+        "def add(a, b):\n    return a + b\n")
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    # The weak tests are checked out last
+    _submit_links(tmp_path, ["https://github.com/dm/dsa/tree/strong",
+                             "https://github.com/dm/dsa/tree/weak"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             student_test_file="test_mine.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path),
+                             mutation_testing=True, mutation_workers=2)
+    kill_scores = {result["link"]: result["mutation"]["hw_2"]["kill_score"]
+                   for result in session.run()}
+    assert kill_scores == {"https://github.com/dm/dsa/tree/strong": 1.0,
+                           "https://github.com/dm/dsa/tree/weak": 0.0}
+
+
+def test_Student_keeps_commits_pushed_after_syncing(tmp_path,
+                                                    student_remote):
+    remote, clone = student_remote
+    student = Student(GHLink("https://github.com/dm/dsa"),
+                      str(tmp_path / "student_repos"))
+    student.sync_repo()
+    (clone / "hw" / "hw_2" / "teacher_test_results.txt").write_text(
+        "teacher_tests.py::test_add PASSED\n")
+    student.commit_results(["hw_2"])
+    # The student pushes a fix before the results are pushed
+    _push_branch(tmp_path, remote, "main",
+                 {"hw2.py": "def add(a, b):\n    return b + a\n"})
+
+    push_queue = PushQueue(max_attempts=2, backoff_base_s=0.0)
+    push_queue.start()
+    push_queue.submit(student)
+    outcome = push_queue.close()[0]
+    # The first push is rejected, and the results are committed again on
+    # top of the student's fix for the second
+    assert (outcome.status, outcome.attempts) == (PUSHED, 2)
+    assert _git(remote, "log", "--format=%s", "main").splitlines()[:2] == \
+        ["Add testing results for hw_2", "Update hw2"]
+    assert _git(remote, "show", "main:hw/hw_2/hw2.py") == \
+        "def add(a, b):\n    return b + a\n"
+    assert _git(remote, "show", "main:hw/hw_2/teacher_test_results.txt") \
+        == "teacher_tests.py::test_add PASSED\n"
+
+
+def test_GradingSession_push_only_without_results_is_outstanding(
+        tmp_path, student_remote):
+    _submit_links(tmp_path, ["https://github.com/dm/dsa"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             autograding_dir=str(tmp_path))
+    # The repository was never graded, so it has no results to push
+    results = session.push_only()
+    assert not results[0]["pushed_successfully"]
+    assert "there are no test results to commit" in results[0]["report"]
+    assert "0 pushed, 0 already up to date, 1 still outstanding" in \
+        session.summary()
+
+
+def test_GradingSession_reports_untested_students_as_outstanding(
+        tmp_path, student_remote):
+    (tmp_path / "hw" / "hw_2" / "test_hw2.py").write_text(
+        "from hw2_solution import add\n\n\ndef test_add():\n"
+        "    assert add(1, 1) == 2\n")
+    _submit_links(tmp_path, ["https://github.com/dm/dsa/tree/missing"])
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    results = session.run(push_results=True)
+    assert "Could not complete testing" in results[0]["report"]
+    assert not results[0]["pushed_successfully"]
+    summary = session.summary()
+    assert "0 pushed, 0 already up to date, 1 still outstanding" in summary
+    assert "dm: failed after 0 attempt(s) due to error: Command" in \
+        summary.split("Still outstanding")[1]
+
+
+def test_RegradePlan_without_previous_outcomes_reruns_all():
+    plan = RegradePlan("ImportError while importing test module",
+                       prev_teacher_tests, prev_teacher_tests)
+    assert plan.rerun_all()
+
+
+def test_GradingSession_configure_teacher_tests(tmp_path):
+    hw_folder = tmp_path / "hw" / "hw_2"
+    hw_folder.mkdir(parents=True)
+    (hw_folder / "test_hw2.py").write_text(
+        "import pytest\nfrom hw2_solution import add\n")
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    assert session.configure_teacher_tests() == \
+        "import pytest\nfrom hw2 import add\n"
+
+    with pytest.raises(Exception):
+        session.configure_teacher_tests("test_hw3.py")
+    with pytest.raises(Exception):
+        session.run()
+
+
+def test_GradingSession_add_assignment(tmp_path):
+    for hw_num in (2, 3):
+        hw_folder = tmp_path / "hw" / "hw_{}".format(hw_num)
+        hw_folder.mkdir(parents=True)
+        (hw_folder / "test_hw{}.py".format(hw_num)).write_text(
+            "from hw{}_solution import f\n".format(hw_num))
+    session = GradingSession(str(tmp_path), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    session.add_assignment("hw_3", "test_hw3.py", "hw3_student_tests.py")
+    assert session.hw_dir_names() == ["hw_2", "hw_3"]
+    assert session.configure_teacher_tests() == "from hw2 import f\n"
+
+    session.add_assignment("hw_4", "test_hw4.py")
+    with pytest.raises(Exception):
+        session.configure_teacher_tests()
+
+
+def test_Student_test_assignments_syncs_and_commits_once(tmp_path):
+    for hw_dir_name in ("hw_2", "hw_3"):
+        (tmp_path / "dm_dsa" / "hw" / hw_dir_name).mkdir(parents=True)
+    student = Student(GHLink("https://github.com/dm/dsa"), str(tmp_path))
+    commands = []
+
+    def run_cmd_for_student(command, cwd=None, check=True, env=None):
+        commands.append(command)
+        if command[:3] == ["git", "diff", "--cached"]:
+            return "hw/hw_2/teacher_test_results.txt\n"
+        if command[:2] == ["git", "symbolic-ref"]:
+            return "main\n"
+        if command[:2] == ["git", "rev-parse"]:
+            return "" if "--verify" in command else "0123abc\n"
+        return ""
+
+    student._run_cmd_for_student = run_cmd_for_student
+    report = student.test_assignments(
+        [Assignment("hw_2", "def test_a():\n    pass\n", "test_hw2.py"),
+         Assignment("hw_3", "def test_b():\n    pass\n")],
+        push_results=True)
+    assert "Pushed successfully" in report
+
+    def count(*prefix):
+        return len([command for command in commands if
+                    command[:len(prefix)] == list(prefix)])
+    assert count("git", "reset") == 1
+    assert count("git", "pull") == 1
+    assert count("git", "fetch") == 1
+    assert count("python3", "-m", "pytest") == 3
+    assert count("git", "add") == 2
+    assert [command for command in commands if command[:2] ==
+            ["git", "commit"]] == [
+        ["git", "commit", "-m", "Add testing results for hw_2, hw_3"]]
+    assert [command for command in commands if command[:2] ==
+            ["git", "push"]] == [
+        ["git", "push", "--force-with-lease=refs/heads/main:", "origin",
+         "0123abc:refs/heads/main"]]
+
+
+def test_Student_test_assignments_skips_a_missing_hw_folder(tmp_path):
+    (tmp_path / "dm_dsa" / "hw" / "hw_2").mkdir(parents=True)
+    student = Student(GHLink("https://github.com/dm/dsa"), str(tmp_path))
+    commands = []
+
+    def run_cmd_for_student(command, cwd=None, check=True, env=None):
+        commands.append(command)
+        if command[:3] == ["git", "diff", "--cached"]:
+            return "hw/hw_2/teacher_test_results.txt\n"
+        if command[:2] == ["git", "symbolic-ref"]:
+            return "main\n"
+        if command[:2] == ["git", "rev-parse"]:
+            return "" if "--verify" in command else "0123abc\n"
+        return ""
+
+    student._run_cmd_for_student = run_cmd_for_student
+    report = student.test_assignments(
+        [Assignment("hw_2", "def test_a():\n    pass\n"),
+         Assignment("hw_3", "def test_b():\n    pass\n"),
+         Assignment("hw_4", "def test_c():\n    pass\n")],
+        push_results=True)
+    assert "hw_2: SUCCESS" in report
+    assert "hw_3: Could not complete testing due to error: the repository " \
+           "has no hw/hw_3 folder" in report
+    assert "hw_4: Could not complete" in report
+    assert "Pushed successfully" in report
+    assert not student.tested_without_failure()
+    assert [command for command in commands if command[:2] ==
+            ["git", "add"]] == [
+        ["git", "add", os.path.join(str(tmp_path), "dm_dsa", "hw", "hw_2",
+                                    ".")]]
+    assert [command for command in commands if command[:2] ==
+            ["git", "commit"]] == [
+        ["git", "commit", "-m", "Add testing results for hw_2"]]
+
+
+def test_importing_GradingSession_does_not_import_bs4():
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__)))
+    subprocess.run(
+        [sys.executable, "-c",
+         "import sys, autograding; autograding.GradingSession; "
+         "assert 'bs4' not in sys.modules; "
+         "assert 'urllib.request' not in sys.modules; "
+         "assert 'autograding.distributed' not in sys.modules"],
+        cwd=package_parent, check=True)
+
+
+class FakePushStudent:
+    def __init__(self, name: str, failures_before_success: int,
+                 already_pushed: bool = False):
+        self.name = name
+        self.failures_before_success = failures_before_success
+        self.already_pushed = already_pushed
+        self.push_times = []
+
+    def push_committed_results(self) -> bool:
+        self.push_times.append(time.monotonic())
+        if len(self.push_times) <= self.failures_before_success:
+            raise Exception("remote hung up")
+        return not self.already_pushed
+
+    def __repr__(self):
+        return self.name
+
+
+def test_PushQueue_retries_and_reconciles():
+    students = [FakePushStudent("alice", 0), FakePushStudent("bob", 2),
+                FakePushStudent("carol", 5), FakePushStudent("dan", 0, True)]
+    push_queue = PushQueue(concurrency=2, max_attempts=3, backoff_base_s=0.0)
+    push_queue.start()
+    for student in students:
+        push_queue.submit(student)
+    push_queue.record_failure(FakePushStudent("erin", 0), "nothing to push")
+    outcomes = push_queue.close()
+
+    assert [outcome.status for outcome in outcomes] == \
+        [PUSHED, PUSHED, FAILED, ALREADY_PUSHED, FAILED]
+    assert [outcome.attempts for outcome in outcomes] == [1, 3, 3, 1, 0]
+    assert push_queue.reconciliation_report().startswith(
+        "Push reconciliation: 2 pushed, 1 already up to date, 2 still "
+        "outstanding")
+
+
+def test_GradingSession_finishes_queued_pushes_after_an_error(tmp_path):
+    session = GradingSession(str(tmp_path), "hw_2",
+                             autograding_dir=str(tmp_path))
+    session._assignments = []
+    for run in (lambda: session.run(push_results=True), session.push_only):
+        # The second push waits for the rate limit
+        push_queue = PushQueue(max_pushes_per_minute=300)
+        students = [FakePushStudent("alice", 0), FakePushStudent("bob", 0)]
+
+        def make_push_queue():
+            push_queue.start()
+            return push_queue
+
+        def resolve_students():
+            for student in students:
+                push_queue.submit(student)
+            raise Exception("Could not read the submissions")
+
+        session._make_push_queue = make_push_queue
+        session._resolve_students = resolve_students
+        with pytest.raises(Exception):
+            run()
+        assert [outcome.status for outcome in push_queue.outcomes()] == \
+            [PUSHED, PUSHED]
+
+
+def test_PushQueue_rate_limit():
+    students = [FakePushStudent(str(i), 0) for i in range(3)]
+    push_queue = PushQueue(concurrency=3, max_pushes_per_minute=600)
+    push_queue.start()
+    for student in students:
+        push_queue.submit(student)
+    push_queue.close()
+    push_times = sorted(student.push_times[0] for student in students)
+    assert push_times[2] - push_times[0] >= 0.19
+
+
+class MockCanvasHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    submissions = []
+    requests = []
+
+    def do_GET(self):
+        MockCanvasHandler.requests.append(
+            (self.path, self.headers.get("Authorization")))
+        host = "http://" + self.headers["Host"]
+        body = b""
+        headers = {}
+        if self.path.startswith("/api/v1/courses/1/assignments/2/submissions"):
+            page = 2 if "page=2" in self.path else 1
+            body = json.dumps(
+                MockCanvasHandler.submissions[(page - 1) * 2:page * 2]
+            ).encode()
+            if page == 1:
+                headers["Link"] = "<{}/api/v1/courses/1/assignments/2/" \
+                                  "submissions?page=2>; rel=\"next\"".format(host)
+        elif self.path.startswith("/files/"):
+            self.send_response(302)
+            # File storage lives on another host than the API
+            self.send_header("Location", host.replace(
+                "127.0.0.1", "localhost") + "/storage" + self.path)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        elif self.path.startswith("/storage/files/"):
+            body = "# {}\n".format(self.path).encode()
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mock_canvas():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockCanvasHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+    MockCanvasHandler.requests = []
+    MockCanvasHandler.submissions = [
+        {"user_id": user_id, "submitted_at": "2021-02-0{}T00:00:00Z".format(
+            user_id), "workflow_state": "submitted",
+         "user": {"sortable_name": name},
+         "url": "https://github.com/{}/dsa".format(name.split(",")[0]),
+         "attachments": [{"id": 10 * user_id, "filename": "hw2.py",
+                          "url": base_url + "/files/{}".format(user_id)}]}
+        for user_id, name in [(1, "alice, A"), (2, "bob, B"),
+                              (3, "carol, C")]
+    ] + [{"user_id": 4, "submitted_at": None, "workflow_state": "unsubmitted",
+          "user": {"sortable_name": "dan, D"}}]
+    yield base_url
+    server.shutdown()
+
+
+def test_fetch_link_submissions_incrementally(mock_canvas, tmp_path):
+    client = CanvasClient(mock_canvas, "secret")
+    summary = fetch_submissions(client, "1", "2", str(tmp_path))
+    assert summary == {"downloaded": ["alicea_1", "bobb_2", "carolc_3"],
+                       "unchanged": [], "skipped": ["dand_4"], "failed": []}
+    assert [str(link) for link in acquire_gh_links(str(tmp_path))] == [
+        "https://github.com/alice/dsa", "https://github.com/bob/dsa",
+        "https://github.com/carol/dsa"]
+
+    MockCanvasHandler.submissions[1]["submitted_at"] = "2021-03-01T00:00:00Z"
+    summary = fetch_submissions(client, "1", "2", str(tmp_path))
+    assert summary["downloaded"] == ["bobb_2"]
+    assert summary["unchanged"] == ["alicea_1", "carolc_3"]
+
+
+def test_fetch_submissions_again_if_files_are_gone(mock_canvas, tmp_path):
+    client = CanvasClient(mock_canvas, "secret")
+    fetch_submissions(client, "1", "2", str(tmp_path), "file")
+    # Renamed like the file submission script does, and deleted
+    os.rename(str(tmp_path / "alicea_1_10_hw2.py"),
+              str(tmp_path / "alicea_1_10_hw2_renamed.py"))
+    os.remove(str(tmp_path / "carolc_3_30_hw2.py"))
+    summary = fetch_submissions(client, "1", "2", str(tmp_path), "file")
+    assert summary["downloaded"] == ["alicea_1", "carolc_3"]
+    assert summary["unchanged"] == ["bobb_2"]
+    assert (tmp_path / "carolc_3_30_hw2.py").read_text() == \
+        "# /storage/files/3\n"
+
+
+def test_fetch_file_submissions(mock_canvas, tmp_path):
+    client = CanvasClient(mock_canvas, "secret")
+    fetch_submissions(client, "1", "2", str(tmp_path), "file", workers=3)
+    assert sorted(os.listdir(str(tmp_path))) == [
+        ".canvas_fetch_state.json", "alicea_1_10_hw2.py", "bobb_2_20_hw2.py",
+        "carolc_3_30_hw2.py"]
+    assert (tmp_path / "bobb_2_20_hw2.py").read_text() == \
+        "# /storage/files/2\n"
+
+    # A failed download is reported, and retried by the next fetch without
+    # downloading the others again
+    for user_id in (1, 2):
+        MockCanvasHandler.submissions[user_id - 1]["submitted_at"] = \
+            "2021-03-01T00:00:00Z"
+    attachment = MockCanvasHandler.submissions[1]["attachments"][0]
+    attachment["url"] = attachment["url"].replace("/files/", "/missing/")
+    summary = fetch_submissions(client, "1", "2", str(tmp_path), "file")
+    assert summary["downloaded"] == ["alicea_1"]
+    assert len(summary["failed"]) == 1 and \
+        summary["failed"][0].startswith("bobb_2 (reason: ")
+    attachment["url"] = attachment["url"].replace("/missing/", "/files/")
+    summary = fetch_submissions(client, "1", "2", str(tmp_path), "file")
+    assert summary["downloaded"] == ["bobb_2"]
+    assert summary["unchanged"] == ["alicea_1", "carolc_3"]
+    # The token is only sent to the Canvas API, not to file storage
+    assert all(authorization == "Bearer secret" for path, authorization in
+               MockCanvasHandler.requests if not path.startswith("/storage"))
+    assert all(authorization is None for path, authorization in
+               MockCanvasHandler.requests if path.startswith("/storage"))
+
+
+def test_predict_makespan_s_dispatches_longest_first():
+    assert predict_makespan_s([3, 3, 2, 2, 2], 2) == 7
+    assert predict_makespan_s([1, 5, 2, 4], 2) == 6
+    assert predict_makespan_s([1], 2, [4, 0]) == 4
+    assert predict_makespan_s([], 3) == 0
+
+
+def test_estimate_durations_s_falls_back_to_repo_size(tmp_path):
+    history = GradingHistory(str(tmp_path))
+    history.record("alice_dsa", 10.0, 100.0)
+    history.record("bob_dsa", 30.0, 100.0)
+    history.save()
+
+    history = GradingHistory(str(tmp_path))
+    estimates = estimate_durations_s(
+        ["alice_dsa", "bob_dsa", "carol_dsa", "dan_dsa"], history,
+        {"alice_dsa": 100.0, "bob_dsa": 100.0, "carol_dsa": 1000.0,
+         "dan_dsa": None})
+    assert estimates == {"alice_dsa": 10.0, "bob_dsa": 30.0,
+                         "carol_dsa": 200.0, "dan_dsa": 20.0}
+
+
+def test_GradingSession_sizes_repos_only_with_several_workers(
+        tmp_path, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(sys.modules[GradingSession.__module__],
+                        "github_repo_size_kb",
+                        lambda bare_link: lookups.append(bare_link))
+    # Sizing a repository walks its clone
+    sizings = []
+    repo_size_kb = sys.modules[GradingSession.__module__].local_repo_size_kb
+    monkeypatch.setattr(sys.modules[GradingSession.__module__],
+                        "local_repo_size_kb",
+                        lambda repo_path: sizings.append(repo_path) or
+                        repo_size_kb(repo_path))
+    estimates = []
+    expected_durations_s = GradingSession._expected_durations_s
+    monkeypatch.setattr(GradingSession, "_expected_durations_s", staticmethod(
+        lambda *args: estimates.append(args) or expected_durations_s(*args)))
+    for workers in (1, 2):
+        # Separate grading histories, so neither run has a recorded duration
+        autograding_dir = tmp_path / str(workers)
+        session = GradingSession(str(tmp_path), "hw_2",
+                                 autograding_dir=str(autograding_dir),
+                                 workers=workers)
+        session._assignments = []
+        student = Student(GHLink("https://github.com/dm/dsa"),
+                          str(autograding_dir / "student_repos"))
+        student.test_assignments = lambda *args: "Testing for dm: SUCCESS"
+        session._students = [student]
+        session._test_students(None, False)
+        assert len(estimates) == workers - 1
+        assert (len(sizings) > 0) == (workers > 1)
+    assert lookups == ["dm/dsa"]
+
+
+def test_LongestJobFirstScheduler_runs_longest_first():
+    started = []
+
+    def make_job(key):
+        return lambda: started.append(key) or key.upper()
+
+    results = LongestJobFirstScheduler(1).run(
+        {key: make_job(key) for key in ("a", "b", "c")},
+        {"a": 1.0, "b": 3.0, "c": 2.0})
+    assert started == ["b", "c", "a"]
+    assert {key: result[0] for key, result in results.items()} == \
+        {"a": "A", "b": "B", "c": "C"}
+
+
+student_module_source = """\
+def classify(x):
+    if x > 0 and x < 100:
+        return "small"
+    elif x >= 100:
+        return "big"
+    return "negative"
+
+
+def total(xs):
+    s = 0
+    for x in xs:
+        s += x
+    return s
+
+
+def unused():
+    return 1
+"""
+
+
+def test_CoverageCollector_lines_and_branches(tmp_path):
+    module_path = tmp_path / "hw_cov.py"
+    module_path.write_text(student_module_source)
+    collector = CoverageCollector(str(module_path))
+    collector.start()
+    try:
+        spec = importlib.util.spec_from_file_location("hw_cov",
+                                                      str(module_path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.classify(5)
+        module.classify(500)
+        module.total([1, 2])
+    finally:
+        collector.stop()
+
+    report = collector.report(student_module_source)
+    assert report["missing_lines"] == [6, 17]
+    assert (report["lines_covered"], report["lines_total"]) == (11, 13)
+    # Only the 'elif' is never skipped
+    assert (report["branches_covered"], report["branches_total"]) == (5, 6)
+
+
+solution_source = """def clamp(x: int, high: int) -> int:
+    \"\"\"Clamps x to at most high\"\"\"
+    if x > high:
+        return high
+    return x
+
+
+def double(x):
+    return x * 2
+"""
+
+
+def test_generate_mutants():
+    descriptions = [(mutant.line, mutant.description) for mutant in
+                    generate_mutants(solution_source)]
+    # Neither the docstring nor the annotations are mutated
+    assert descriptions == [
+        (3, "Gt -> GtE"), (4, "return value removed"),
+        (5, "return value removed"), (9, "return value removed"),
+        (9, "Mult -> Add"), (9, "2 -> 3"), (9, "2 -> 1")]
+
+
+def test_mutation_test_kill_scores(tmp_path):
+    solution_path = tmp_path / "hw2_solution.py"
+    solution_path.write_text(solution_source)
+    student_tests = {
+        # Only checks clamp, and never at the boundary
+        "weak": "from hw2 import clamp\n\n\ndef test_clamp():\n"
+                "    assert clamp(1, 3) == 1\n    assert clamp(5, 3) == 3\n",
+        "strong": "from hw2 import clamp, double\n\n\ndef test_clamp():\n"
+                  "    assert clamp(3, 3) == 3\n    assert clamp(5, 3) == 3\n"
+                  "    assert clamp(1, 3) == 1\n\n\ndef test_double():\n"
+                  "    assert double(3) == 6\n",
+        "failing": "from hw2 import double\n\n\ndef test_double():\n"
+                   "    assert double(3) == 7\n",
+    }
+    hw_folders = {}
+    for student, tests in student_tests.items():
+        hw_folder = tmp_path / student / "hw" / "hw_2"
+        hw_folder.mkdir(parents=True)
+        (hw_folder / "hw2.py").write_text("")
+        (hw_folder / "hw2_student_tests.py").write_text(tests)
+        hw_folders[student] = str(hw_folder)
+
+    scores = mutation_test(str(solution_path), str(tmp_path / "mutants"),
+                           hw_folders, "hw2_student_tests.py", workers=2)
+    # The 'Gt -> GtE' mutant survives...
+    assert scores["weak"].killed() == 2
+    assert scores["weak"].not_reached() == 4
+    assert scores["weak"].outcomes[0] != KILLED
+    assert scores["weak"].outcomes[3] == NOT_REACHED
+    # ...as it does for any tests, since it is equivalent to the solution
+    assert scores["strong"].killed() == 6
+    assert scores["strong"].outcomes[0] != KILLED
+    assert not scores["failing"].baseline_passed
+    assert scores["failing"].kill_score() is None
+    assert len(list((tmp_path / "mutants").iterdir())) == 1
+
+
+teacher_results_template = """teacher_tests.py::test_add FAILED                [ 33%]
+teacher_tests.py::test_div[1] FAILED             [ 66%]
+teacher_tests.py::TestNode::test_node ERROR      [100%]
+
+==================================== ERRORS ====================================
+_________________________ ERROR at setup of TestNode.test_node _________________________
+
+    @pytest.fixture
+    def node():
+>       return load("{repo}/hw/hw_2/nodes.txt")
+E       FileNotFoundError: No such file: '{repo}/hw/hw_2/nodes.txt'
+
+{repo}/hw/hw_2/hw2.py:20: FileNotFoundError
+=================================== FAILURES ===================================
+___________________________________ test_add ___________________________________
+
+    def test_add():
+>       assert add(1, 2) == 3
+E       assert {sum} == 3
+E        +  where {sum} = add(1, 2)
+
+teacher_tests.py:9: AssertionError
+_________________________________ test_div[1] __________________________________
+
+    def test_div(x):
+>       assert div(x) == 1
+
+teacher_tests.py:13: 
+_ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ 
+hw2.py:8: in div
+    return helper(a)
+_ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ 
+
+    def helper(a):
+>       return Node(a) / 0
+E       TypeError: unsupported operand: <hw2.Node object at {address}>
+
+hw2.py:11: TypeError
+=========================== short test summary info ============================
+FAILED teacher_tests.py::test_add - assert {sum} == 3
+"""
+
+
+def test_parse_failures():
+    signatures = [signature.key() for signature, _ in parse_failures(
+        teacher_results_template.format(repo="/repos/alice", sum=-1,
+                                        address="0x7f00"))]
+    assert signatures == [
+        ("TestNode::test_node", "FileNotFoundError",
+         "FileNotFoundError: No such file: 'nodes.txt'", "hw2.py"),
+        ("test_add", "AssertionError", "assert -1 == 3", "teacher_tests.py"),
+        ("test_div[1]", "TypeError",
+         "TypeError: unsupported operand: <hw2.Node object at 0x...>",
+         "hw2.py"),
+    ]
+
+
+def test_FailureIndex_groups_students_by_signature():
+    failure_index = FailureIndex()
+    for student, total, address in [("alice", -1, "0x7f00"),
+                                    ("bob", -1, "0x7fab"),
+                                    ("carol", 2, "0x7f12")]:
+        failure_index.add(student, teacher_results_template.format(
+            repo="/repos/" + student, sum=total, address=address))
+    failure_index.add("dave", "teacher_tests.py::test_add PASSED\n")
+
+    groups = failure_index.groups()
+    assert [(group.signature.test_id, group.students) for group in groups] == [
+        ("TestNode::test_node", ["alice", "bob", "carol"]),
+        ("test_div[1]", ["alice", "bob", "carol"]),
+        ("test_add", ["alice", "bob"]),
+        ("test_add", ["carol"]),
+    ]
+    assert groups[2].representative.splitlines()[-1] == \
+        "teacher_tests.py:9: AssertionError"
+    assert failure_index.summary().startswith(
+        "Failure index: 3 of 4 student(s) failed teacher tests in 4 distinct "
+        "way(s)")
+
+
+def test_partition_test_ids_balances_durations():
+    test_ids = ["a", "b", "c", "d", "e", "f"]
+    durations_s = {"a": 1.0, "b": 6.0, "c": 2.0, "d": 3.0, "e": 4.0}
+    shards = partition_test_ids(test_ids, durations_s, 2)
+    # 'f' is expected to take the median (3s); each shard is kept in
+    # collection order
+    assert shards == [["a", "b", "f"], ["c", "d", "e"]]
+    assert partition_test_ids(["a"], {}, 4) == [["a"]]
+
+
+sharded_tests_source = """import pytest
+
+
+@pytest.fixture
+def broken():
+    raise ValueError("broken fixture")
+
+
+@pytest.mark.parametrize("x", range(7))
+def test_case(x):
+    assert x % 3 != 2
+
+
+def test_fixture(broken):
+    pass
+
+
+@pytest.mark.skip(reason="not yet")
+def test_skipped():
+    pass
+
+
+class TestGroup:
+    def test_member(self):
+        assert [1, 2] == [1, 3]
+"""
+
+
+def test_merge_shard_outputs_matches_unsharded_run(tmp_path):
+    (tmp_path / "teacher_tests.py").write_text(sharded_tests_source)
+
+    def run_pytest(args):
+        return subprocess.run(
+            [sys.executable, "-m", "pytest", "-p", "no:cacheprovider"] + args,
+            cwd=str(tmp_path), stdout=subprocess.PIPE, text=True,
+            env=dict(os.environ, COLUMNS="80")).stdout
+
+    def without_duration(results_text):
+        # The run time and object addresses differ between any two runs
+        results_text = re.sub(r"0x[0-9a-f]+", "0x...", results_text)
+        return re.sub(r" in [\d.]+s =", " in 0.00s =", results_text)
+
+    test_ids = parse_collected_test_ids(run_pytest(
+        ["--collect-only", "-q", "teacher_tests.py"]))
+    assert len(test_ids) == 10
+    shard_outputs = [run_pytest(["-v"] + ["teacher_tests.py::" + test_id for
+                                          test_id in shard] + DURATIONS_ARGS)
+                     for shard in partition_test_ids(test_ids, {}, 3)]
+    assert set(parse_test_durations(shard_outputs[0])) < set(test_ids)
+
+    merged = merge_shard_outputs(shard_outputs, test_ids)
+    assert without_duration(merged) == without_duration(
+        run_pytest(["-v", "teacher_tests.py"]))
+
+
+def test_parsers_read_parameter_ids_with_spaces(tmp_path):
+    (tmp_path / "teacher_tests.py").write_text(
+        "import pytest\n\n\n@pytest.mark.parametrize('x', [1, 2, 3], "
+        "ids=['one item', 'two items', 'three items'])\n"
+        "def test_len(x):\n    assert x == 1\n")
+    results_text = subprocess.run(
+        [sys.executable, "-m", "pytest", "-p", "no:cacheprovider", "-v",
+         "-rA", "teacher_tests.py"] + DURATIONS_ARGS, cwd=str(tmp_path),
+        stdout=subprocess.PIPE, text=True).stdout
+    test_ids = ["test_len[one item]", "test_len[two items]",
+                "test_len[three items]"]
+    assert parse_pytest_outcomes(results_text) == dict(zip(
+        test_ids, ("PASSED", "FAILED", "FAILED")))
+    assert set(parse_test_durations(results_text)) == set(test_ids)
+    # The short summary follows the order of the tests it is given
+    merged = merge_shard_outputs([results_text], test_ids[::-1])
+    assert merged.index("FAILED teacher_tests.py::test_len[three items]") < \
+        merged.index("FAILED teacher_tests.py::test_len[two items]")
+
+
+golden_solution_source = """import os
+
+CALLS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "calls.txt")
+
+
+def slow_sort(xs):
+    with open(CALLS_PATH, "a") as calls_file:
+        calls_file.write("call\\n")
+    return sorted(xs)
+"""
+
+golden_teacher_tests_source = """from hw2_solution import slow_sort
+
+GOLDEN_CASES = {"reversed": (slow_sort, (list(range(50, 0, -1)),), {})}
+
+
+def golden_output(key):
+    func, args, kwargs = GOLDEN_CASES[key]
+    return func(*args, **kwargs)
+
+
+def test_reversed():
+    expected = golden_output("reversed")
+    expected.append(0)
+    assert slow_sort(list(range(50, 0, -1))) + [0] == expected
+
+
+def test_fresh_copy():
+    assert golden_output("reversed") == list(range(1, 51))
+"""
+
+
+def test_GradingSession_precomputes_golden_outputs(tmp_path):
+    hw_folder = tmp_path / "hw" / "hw_2"
+    hw_folder.mkdir(parents=True)
+    (hw_folder / "hw2_solution.py").write_text(golden_solution_source)
+    (hw_folder / "test_hw2.py").write_text(golden_teacher_tests_source)
+    session = GradingSession(str(tmp_path / "submissions"), "hw_2",
+                             teacher_test_file="test_hw2.py",
+                             hw_root_dir=str(tmp_path / "hw"),
+                             autograding_dir=str(tmp_path))
+    teacher_tests_text = session.configure_teacher_tests()
+    # Computed once and then loaded from the cache
+    session.configure_teacher_tests()
+    assert (hw_folder / "calls.txt").read_text() == "call\n"
+    assert "hw2_solution" not in sys.modules
+
+    golden_dir = tmp_path / "grading_history" / "hw_2" / "golden"
+    fixture_path, = golden_dir.iterdir()
+    outcomes = {}
+    for student, student_source in [
+            ("correct", "def slow_sort(xs):\n    return sorted(xs)\n"),
+            ("wrong", "def slow_sort(xs):\n    return xs\n")]:
+        student_hw_folder = tmp_path / student / "hw_2"
+        student_hw_folder.mkdir(parents=True)
+        (student_hw_folder / "hw2.py").write_text(student_source)
+        (student_hw_folder / "teacher_tests.py").write_text(
+            teacher_tests_text)
+        shutil.copyfile(str(fixture_path),
+                        str(student_hw_folder / "teacher_golden.pickle"))
+        outcomes[student] = subprocess.run(
+            [sys.executable, "-m", "pytest", "-v", "-p", "no:cacheprovider",
+             "teacher_tests.py"], cwd=str(student_hw_folder),
+            stdout=subprocess.PIPE, text=True).stdout
+    assert "2 passed" in outcomes["correct"]
+    assert "test_reversed FAILED" in outcomes["wrong"]
+    assert "test_fresh_copy PASSED" in outcomes["wrong"]
+    assert (hw_folder / "calls.txt").read_text() == "call\n"
+
+    # Changing the solution invalidates the fixture
+    (hw_folder / "hw2_solution.py").write_text(
+        golden_solution_source + "\n# Fixed a bug\n")
+    session.configure_teacher_tests()
+    assert [path.name for path in golden_dir.iterdir()] != [fixture_path.name]
+    assert (hw_folder / "calls.txt").read_text() == "call\ncall\n"
+
+
+WORKER_TOKEN = "shared-secret"
+
+
+def _send_to_coordinator(connection_file, message: Dict[str, object]):
+    connection_file.write((json.dumps(message) + "\n").encode())
+    connection_file.flush()
+    line = connection_file.readline()
+    return None if len(line) == 0 else json.loads(line)
+
+
+def _start_worker(coordinator: GradingCoordinator, worker_id: str,
+                  run_job: Callable[[str, Dict], None] = lambda *args: None
+                  ) -> threading.Thread:
+    """Starts a worker thread whose results name the worker that ran the
+    job
+    """
+    def executor(job):
+        run_job(worker_id, job)
+        return {"job_id": job["job_id"], "worker": worker_id, "links": []}
+    worker = GradingWorker("127.0.0.1", coordinator.address()[1],
+                           WORKER_TOKEN, "", worker_id=worker_id,
+                           executor=executor)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    return thread
+
+
+def _run_workers(coordinator: GradingCoordinator, worker_ids: List[str]):
+    threads = [_start_worker(coordinator, worker_id) for worker_id in
+               worker_ids]
+    results = coordinator.wait(timeout=30)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_GradingCoordinator_workers_grade_at_once():
+    jobs = [{"job_id": i} for i in range(24)]
+    for num_workers in (1, 4):
+        # Each worker holds on to its first job until every worker has one,
+        # which only happens if they all grade at once
+        barrier = threading.Barrier(num_workers, timeout=10)
+        started = set()
+
+        def run_job(worker_id, job, barrier=barrier, started=started):
+            if worker_id not in started:
+                started.add(worker_id)
+                barrier.wait()
+        coordinator = GradingCoordinator(jobs, WORKER_TOKEN)
+        coordinator.start()
+        threads = [_start_worker(coordinator, str(i), run_job) for i in
+                   range(num_workers)]
+        results = coordinator.wait(timeout=30)
+        for thread in threads:
+            thread.join()
+        coordinator.close()
+        assert {job_id: result["job_id"] for job_id, result in
+                results.items()} == {i: i for i in range(24)}
+        assert {result["worker"] for result in results.values()} == \
+            {str(i) for i in range(num_workers)}
+
+
+def test_GradingCoordinator_steals_from_a_busy_worker():
+    jobs = [{"job_id": i} for i in range(24)]
+    coordinator = GradingCoordinator(jobs, WORKER_TOKEN)
+    coordinator.start()
+    # The busy worker is dealt a chunk of jobs and is stuck on the first of
+    # them until the other worker has graded every other job, including
+    # the rest of the busy worker's chunk
+    busy_started = threading.Event()
+    others_graded = threading.Event()
+    graded_by_other = []
+
+    def run_busy_job(worker_id, job):
+        busy_started.set()
+        assert others_graded.wait(timeout=30)
+
+    def run_other_job(worker_id, job):
+        graded_by_other.append(job["job_id"])
+        if len(graded_by_other) == len(jobs) - 1:
+            others_graded.set()
+    busy = _start_worker(coordinator, "busy", run_busy_job)
+    assert busy_started.wait(timeout=30)
+    other = _start_worker(coordinator, "other", run_other_job)
+    results = coordinator.wait(timeout=30)
+    busy.join()
+    other.join()
+    coordinator.close()
+    # Longest expected first, and all jobs are expected to take as long
+    assert results[0]["worker"] == "busy"
+    assert all(results[job_id]["worker"] == "other" for job_id in
+               range(1, len(jobs)))
+    assert coordinator.steals() > 0
+    assert coordinator.jobs_by_worker() == {"busy": 1, "other": 23}
+
+
+def test_GradingCoordinator_requeues_abandoned_jobs():
+    jobs = [{"job_id": i} for i in range(3)]
+    coordinator = GradingCoordinator(jobs, WORKER_TOKEN,
+                                     {0: 5.0, 1: 1.0, 2: 1.0}, lease_s=0.5)
+    coordinator.start()
+    host, port = coordinator.address()
+
+    # One worker disconnects with a job and another goes silent with one
+    abandoned = []
+    silent = socket.create_connection((host, port))
+    for worker_id, connection in [
+            ("dropped", socket.create_connection((host, port))),
+            ("silent", silent)]:
+        connection_file = connection.makefile("rwb")
+        connection_file.write((json.dumps({
+            "type": "request", "token": WORKER_TOKEN,
+            "worker": worker_id}) + "\n").encode())
+        connection_file.flush()
+        abandoned.append(json.loads(connection_file.readline())["job"][
+            "job_id"])
+        if worker_id == "dropped":
+            connection.close()
+    # Longest expected first
+    assert abandoned[0] == 0
+
+    results = _run_workers(coordinator, ["steady"])
+    silent.close()
+    coordinator.close()
+    assert sorted(results) == [0, 1, 2]
+    assert coordinator.jobs_by_worker() == {"steady": 3}
+
+
+def test_GradingCoordinator_rejects_untrusted_messages():
+    jobs = [{"job_id": i} for i in range(2)]
+    coordinator = GradingCoordinator(jobs, WORKER_TOKEN)
+    coordinator.start()
+    host, port = coordinator.address()
+    assert host == "127.0.0.1"
+
+    # Without the token, no job is handed out
+    for token in (None, "wrong"):
+        with socket.create_connection((host, port)) as connection:
+            message = {"type": "request", "worker": "intruder"}
+            if token is not None:
+                message["token"] = token
+            assert _send_to_coordinator(connection.makefile("rwb"),
+                                        message) is None
+
+    # A worker cannot report a job leased to another worker, nor one it was
+    # never handed
+    with socket.create_connection((host, port)) as holder, \
+            socket.create_connection((host, port)) as forger:
+        holder_file = holder.makefile("rwb")
+        leased_job_id = _send_to_coordinator(holder_file, {
+            "type": "request", "token": WORKER_TOKEN,
+            "worker": "holder"})["job"]["job_id"]
+        forger_file = forger.makefile("rwb")
+        for job_id in (0, 1):
+            forger_file.write((json.dumps({
+                "type": "result", "token": WORKER_TOKEN, "worker": "forger",
+                "job_id": job_id, "result": {"forged": True}}) +
+                "\n").encode())
+            forger_file.flush()
+        # Nor speak for another worker on its own connection
+        assert _send_to_coordinator(forger_file, {
+            "type": "result", "token": WORKER_TOKEN, "worker": "holder",
+            "job_id": leased_job_id, "result": {"forged": True}}) is None
+
+        holder_file.write((json.dumps({
+            "type": "result", "token": WORKER_TOKEN, "worker": "holder",
+            "job_id": leased_job_id, "result": {"forged": False}}) +
+            "\n").encode())
+        holder_file.flush()
+        results = _run_workers(coordinator, ["steady"])
+    coordinator.close()
+    assert results[leased_job_id] == {"forged": False}
+    assert {"forged": True} not in results.values()
+    assert coordinator.jobs_by_worker() == {"holder": 1, "steady": 1}